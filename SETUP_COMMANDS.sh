@@ -32,7 +32,7 @@ export MAILPIPE_BACKEND_URL="http://localhost:8000"
 export MAX_EMAIL_SIZE_MB=10
 export MAX_ATTACHMENT_SIZE_MB=5
 export TEMP_DIR="/tmp/mailpipe"
-/opt/mailpipe/mailpipe.py
+/opt/mailpipe/mailpipe.py "$@"
 EOF
 
 sudo chmod +x /opt/mailpipe/run_mailpipe.sh
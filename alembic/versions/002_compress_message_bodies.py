@@ -0,0 +1,89 @@
+"""Compress message bodies
+
+Revision ID: 002
+Revises: 001
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.services.body_compression import compress_text, decompress_text, register_dictionary
+
+# revision identifiers, used by Alembic.
+revision = '002'
+down_revision = '001'
+branch_labels = None
+depends_on = None
+
+BODY_COLUMNS = ('text_content', 'html_content', 'raw_message')
+BATCH_SIZE = 500
+
+messages = sa.table(
+    'messages',
+    sa.column('id', sa.String()),
+    *[sa.column(name, sa.LargeBinary()) for name in BODY_COLUMNS]
+)
+
+
+def rewrite_bodies(convert) -> None:
+    """Rewrite every body column in id-ordered batches"""
+    conn = op.get_bind()
+    last_id = ''
+    while True:
+        rows = conn.execute(
+            sa.select(messages).where(messages.c.id > last_id).order_by(messages.c.id).limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            values = {name: convert(getattr(row, name)) for name in BODY_COLUMNS}
+            conn.execute(messages.update().where(messages.c.id == row.id).values(**values))
+        last_id = rows[-1].id
+
+
+def upgrade() -> None:
+    op.create_table(
+        'compression_dictionaries',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+    with op.batch_alter_table('messages') as batch_op:
+        for name in BODY_COLUMNS:
+            batch_op.alter_column(
+                name,
+                existing_type=sa.Text(),
+                type_=sa.LargeBinary(),
+                postgresql_using=f"convert_to({name}, 'UTF8')"
+            )
+
+    # Existing rows now hold raw UTF-8 bytes; compress them (no dictionary yet)
+    rewrite_bodies(
+        lambda value: None if value is None
+        else compress_text(bytes(value).decode('utf-8', errors='ignore'), use_dictionary=False)
+    )
+
+
+def downgrade() -> None:
+    # Bodies may use trained dictionaries; load them from this connection
+    conn = op.get_bind()
+    for dict_id, data in conn.execute(sa.text('SELECT id, data FROM compression_dictionaries')):
+        register_dictionary(dict_id, data)
+
+    rewrite_bodies(
+        lambda value: None if value is None else decompress_text(value).encode('utf-8')
+    )
+
+    with op.batch_alter_table('messages') as batch_op:
+        for name in BODY_COLUMNS:
+            batch_op.alter_column(
+                name,
+                existing_type=sa.LargeBinary(),
+                type_=sa.Text(),
+                postgresql_using=f"convert_from({name}, 'UTF8')"
+            )
+
+    op.drop_table('compression_dictionaries')
@@ -0,0 +1,92 @@
+"""Share message bodies and attachments between recipients
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+BODY_COLUMNS = ('text_content', 'html_content', 'raw_message')
+
+
+def upgrade() -> None:
+    op.create_table(
+        'message_contents',
+        sa.Column('id', sa.String(), nullable=False),
+        *[sa.Column(name, sa.LargeBinary(), nullable=True) for name in BODY_COLUMNS],
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+    # Existing messages each get their own content row with the same id;
+    # bodies are already compressed, so they are copied as-is
+    op.execute(
+        "INSERT INTO message_contents (id, text_content, html_content, raw_message, created_at) "
+        "SELECT id, text_content, html_content, raw_message, received_at FROM messages"
+    )
+
+    op.add_column('messages', sa.Column('content_id', sa.String(), nullable=True))
+    op.execute("UPDATE messages SET content_id = id")
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.alter_column('content_id', existing_type=sa.String(), nullable=False)
+        batch_op.create_foreign_key('fk_messages_content_id', 'message_contents', ['content_id'], ['id'])
+        batch_op.create_index(batch_op.f('ix_messages_content_id'), ['content_id'], unique=False)
+        for name in BODY_COLUMNS:
+            batch_op.drop_column(name)
+
+    op.add_column('attachments', sa.Column('content_id', sa.String(), nullable=True))
+    op.execute("UPDATE attachments SET content_id = message_id")
+    op.drop_index(op.f('ix_attachments_message_id'), table_name='attachments')
+    with op.batch_alter_table('attachments') as batch_op:
+        batch_op.alter_column('content_id', existing_type=sa.String(), nullable=False)
+        batch_op.create_foreign_key(
+            'fk_attachments_content_id', 'message_contents', ['content_id'], ['id'], ondelete='CASCADE'
+        )
+        batch_op.create_index(batch_op.f('ix_attachments_content_id'), ['content_id'], unique=False)
+        batch_op.drop_column('message_id')
+
+
+def downgrade() -> None:
+    # Bodies are copied back to every recipient's message. Attachments of a
+    # shared content can only belong to one message again and stay with the
+    # earliest-received recipient.
+    with op.batch_alter_table('messages') as batch_op:
+        for name in BODY_COLUMNS:
+            batch_op.add_column(sa.Column(name, sa.LargeBinary(), nullable=True))
+    for name in BODY_COLUMNS:
+        op.execute(
+            f"UPDATE messages SET {name} = "
+            f"(SELECT {name} FROM message_contents WHERE message_contents.id = messages.content_id)"
+        )
+
+    op.add_column('attachments', sa.Column('message_id', sa.String(), nullable=True))
+    op.execute(
+        "UPDATE attachments SET message_id = ("
+        "SELECT id FROM messages WHERE messages.content_id = attachments.content_id "
+        "ORDER BY received_at, id LIMIT 1)"
+    )
+    op.execute("DELETE FROM attachments WHERE message_id IS NULL")
+    with op.batch_alter_table('attachments') as batch_op:
+        batch_op.alter_column('message_id', existing_type=sa.String(), nullable=False)
+        batch_op.drop_index(batch_op.f('ix_attachments_content_id'))
+        batch_op.drop_constraint('fk_attachments_content_id', type_='foreignkey')
+        batch_op.drop_column('content_id')
+        batch_op.create_foreign_key(
+            'fk_attachments_message_id', 'messages', ['message_id'], ['id'], ondelete='CASCADE'
+        )
+    op.create_index(op.f('ix_attachments_message_id'), 'attachments', ['message_id'], unique=False)
+
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_messages_content_id'))
+        batch_op.drop_constraint('fk_messages_content_id', type_='foreignkey')
+        batch_op.drop_column('content_id')
+
+    op.drop_table('message_contents')
@@ -0,0 +1,69 @@
+"""Track per-inbox quota usage
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.services.body_compression import decompress_text, register_dictionary
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+contents = sa.table('message_contents', sa.column('id'), sa.column('raw_message', sa.LargeBinary()))
+messages = sa.table('messages', sa.column('content_id'), sa.column('size', sa.Integer()))
+
+
+def charge_raw_sizes() -> None:
+    """Set every message's size to the byte length of its raw email, as ingest charges it"""
+    conn = op.get_bind()
+    for dict_id, data in conn.execute(sa.text('SELECT id, data FROM compression_dictionaries')):
+        register_dictionary(dict_id, data)
+
+    last_id = None
+    while True:
+        query = sa.select(contents.c.id, contents.c.raw_message).order_by(contents.c.id).limit(BATCH_SIZE)
+        if last_id is not None:
+            query = query.where(contents.c.id > last_id)
+        rows = conn.execute(query).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            # Raw emails are stored compressed and decoded as UTF-8
+            raw = decompress_text(row.raw_message) or ''
+            conn.execute(
+                messages.update().where(messages.c.content_id == row.id).values(size=len(raw.encode('utf-8')))
+            )
+        last_id = rows[-1].id
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('inboxes') as batch_op:
+        batch_op.add_column(sa.Column('message_count', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('stored_bytes', sa.Integer(), nullable=False, server_default='0'))
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.add_column(sa.Column('size', sa.Integer(), nullable=False, server_default='0'))
+
+    # Existing messages are charged their raw size (not the compressed column length)
+    charge_raw_sizes()
+    op.execute(
+        "UPDATE inboxes SET "
+        "message_count = (SELECT count(*) FROM messages WHERE messages.inbox_id = inboxes.id), "
+        "stored_bytes = (SELECT COALESCE(sum(size), 0) FROM messages WHERE messages.inbox_id = inboxes.id)"
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.drop_column('size')
+    with op.batch_alter_table('inboxes') as batch_op:
+        batch_op.drop_column('stored_bytes')
+        batch_op.drop_column('message_count')
@@ -0,0 +1,61 @@
+"""Full-text search index over messages
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.services.body_compression import decompress_text, register_dictionary
+from app.services.search_index import create_search_index, searchable_body
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    create_search_index(conn)
+
+    # Index existing messages; bodies may use trained dictionaries
+    for dict_id, data in conn.execute(sa.text('SELECT id, data FROM compression_dictionaries')):
+        register_dictionary(dict_id, data)
+
+    last_id = ''
+    while True:
+        rows = conn.execute(sa.text(
+            "SELECT messages.id, messages.inbox_id, messages.subject, messages.from_address, "
+            "message_contents.text_content, message_contents.html_content "
+            "FROM messages JOIN message_contents ON message_contents.id = messages.content_id "
+            "WHERE messages.id > :last_id ORDER BY messages.id LIMIT :limit"
+        ), {"last_id": last_id, "limit": BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        conn.execute(sa.text(
+            "INSERT INTO message_search (message_id, inbox_id, subject, from_address, body) "
+            "VALUES (:message_id, :inbox_id, :subject, :from_address, :body)"
+        ), [
+            {
+                "message_id": row.id,
+                "inbox_id": row.inbox_id,
+                "subject": row.subject or "",
+                "from_address": row.from_address or "",
+                "body": searchable_body(
+                    decompress_text(row.text_content) if row.text_content is not None else "",
+                    decompress_text(row.html_content) if row.html_content is not None else ""
+                )
+            }
+            for row in rows
+        ])
+        last_id = rows[-1].id
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS message_search")
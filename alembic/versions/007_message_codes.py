@@ -0,0 +1,73 @@
+"""Add extracted verification codes and links
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.services.body_compression import decompress_text, register_dictionary
+from app.services.email_parser import extract_verification
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+
+def upgrade() -> None:
+    op.create_table(
+        'message_codes',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('content_id', sa.String(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('value', sa.Text(), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False, server_default='0'),
+        sa.ForeignKeyConstraint(['content_id'], ['message_contents.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_message_codes_content_id'), 'message_codes', ['content_id'], unique=False)
+
+    # Extract codes from existing messages; bodies may use trained dictionaries
+    conn = op.get_bind()
+    for dict_id, data in conn.execute(sa.text('SELECT id, data FROM compression_dictionaries')):
+        register_dictionary(dict_id, data)
+
+    last_id = ''
+    while True:
+        rows = conn.execute(sa.text(
+            "SELECT message_contents.id, message_contents.text_content, message_contents.html_content, "
+            "(SELECT subject FROM messages WHERE messages.content_id = message_contents.id LIMIT 1) AS subject "
+            "FROM message_contents WHERE message_contents.id > :last_id "
+            "ORDER BY message_contents.id LIMIT :limit"
+        ), {"last_id": last_id, "limit": BATCH_SIZE}).fetchall()
+        if not rows:
+            break
+        codes = []
+        for row in rows:
+            verification = extract_verification(
+                row.subject or "",
+                decompress_text(row.text_content) if row.text_content is not None else "",
+                decompress_text(row.html_content) if row.html_content is not None else ""
+            )
+            for kind, key in (("code", "codes"), ("link", "links")):
+                codes.extend(
+                    {"content_id": row.id, "kind": kind, "value": value, "position": position}
+                    for position, value in enumerate(verification[key])
+                )
+        if codes:
+            conn.execute(sa.text(
+                "INSERT INTO message_codes (content_id, kind, value, position) "
+                "VALUES (:content_id, :kind, :value, :position)"
+            ), codes)
+        last_id = rows[-1].id
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_message_codes_content_id'), table_name='message_codes')
+    op.drop_table('message_codes')
@@ -0,0 +1,28 @@
+"""Record the ingest trace id on messages
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing messages have no trace
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.add_column(sa.Column('trace_id', sa.String(length=32), nullable=True))
+        batch_op.create_index(batch_op.f('ix_messages_trace_id'), ['trace_id'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.drop_index(batch_op.f('ix_messages_trace_id'))
+        batch_op.drop_column('trace_id')
@@ -0,0 +1,28 @@
+"""Order messages by time-ordered id
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # New ids are UUIDv7 (same text format), so (inbox_id, id) serves both the
+    # inbox filter and newest-first ordering; it also covers inbox_id lookups.
+    # Existing uuid4 ids are kept so links to them keep working; they sort
+    # randomly among themselves until they expire with their inbox.
+    op.create_index('ix_messages_inbox_id_id', 'messages', ['inbox_id', 'id'], unique=False)
+    op.drop_index(op.f('ix_messages_inbox_id'), table_name='messages')
+
+
+def downgrade() -> None:
+    op.create_index(op.f('ix_messages_inbox_id'), 'messages', ['inbox_id'], unique=False)
+    op.drop_index('ix_messages_inbox_id_id', table_name='messages')
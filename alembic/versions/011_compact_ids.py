@@ -0,0 +1,81 @@
+"""Store ids in 16 bytes
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+import uuid
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '011'
+down_revision = '010'
+branch_labels = None
+depends_on = None
+
+# (table, id columns) in parent-first order
+ID_COLUMNS = [
+    ('inboxes', ['id']),
+    ('message_contents', ['id']),
+    ('messages', ['id', 'inbox_id', 'content_id']),
+    ('attachments', ['id', 'content_id']),
+    ('message_codes', ['content_id']),
+]
+
+# Foreign keys over id columns: (name, table, column, referenced table, ondelete)
+FOREIGN_KEYS = [
+    ('messages_inbox_id_fkey', 'messages', 'inbox_id', 'inboxes', 'CASCADE'),
+    ('fk_messages_content_id', 'messages', 'content_id', 'message_contents', None),
+    ('fk_attachments_content_id', 'attachments', 'content_id', 'message_contents', 'CASCADE'),
+    ('message_codes_content_id_fkey', 'message_codes', 'content_id', 'message_contents', 'CASCADE'),
+]
+
+
+def uuid_to_bytes(value):
+    return None if value is None else uuid.UUID(value).bytes
+
+
+def bytes_to_uuid(value):
+    return None if value is None else str(uuid.UUID(bytes=value))
+
+
+def convert_sqlite(function, target_type) -> None:
+    # SQLite keeps whatever is stored, so rewrite the values in place, then
+    # the declared column types (batch mode copies the converted values)
+    bind = op.get_bind()
+    bind.connection.driver_connection.create_function('convert_id', 1, function, deterministic=True)
+    for table, columns in ID_COLUMNS:
+        assignments = ', '.join(f'{column} = convert_id({column})' for column in columns)
+        op.execute(f'UPDATE {table} SET {assignments}')
+    for table, columns in ID_COLUMNS:
+        with op.batch_alter_table(table) as batch_op:
+            for column in columns:
+                batch_op.alter_column(column, type_=target_type, existing_nullable=False)
+
+
+def convert_postgresql(target: str) -> None:
+    # Column types can't change under a foreign key between them
+    for name, table, _, _, _ in FOREIGN_KEYS:
+        op.drop_constraint(name, table, type_='foreignkey')
+    for table, columns in ID_COLUMNS:
+        for column in columns:
+            op.execute(f'ALTER TABLE {table} ALTER COLUMN {column} TYPE {target} USING {column}::{target}')
+    for name, table, column, referenced, ondelete in FOREIGN_KEYS:
+        op.create_foreign_key(name, table, referenced, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade() -> None:
+    # Ids keep their value and text form in the API; only the storage changes
+    if op.get_bind().dialect.name == 'postgresql':
+        convert_postgresql('uuid')
+    else:
+        convert_sqlite(uuid_to_bytes, sa.LargeBinary(length=16))
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        convert_postgresql('varchar')
+    else:
+        convert_sqlite(bytes_to_uuid, sa.String())
@@ -0,0 +1,55 @@
+"""Recharge message sizes as raw bytes
+
+Revision ID: 012
+Revises: 011
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.services.body_compression import decompress_text, register_dictionary
+
+# revision identifiers, used by Alembic.
+revision = '012'
+down_revision = '011'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+contents = sa.table('message_contents', sa.column('id'), sa.column('raw_message', sa.LargeBinary()))
+messages = sa.table('messages', sa.column('content_id'), sa.column('size', sa.Integer()))
+
+
+def upgrade() -> None:
+    # Databases migrated with an earlier 005 charged existing messages their
+    # compressed column length; ingest charges raw bytes
+    conn = op.get_bind()
+    for dict_id, data in conn.execute(sa.text('SELECT id, data FROM compression_dictionaries')):
+        register_dictionary(dict_id, data)
+
+    last_id = None
+    while True:
+        query = sa.select(contents.c.id, contents.c.raw_message).order_by(contents.c.id).limit(BATCH_SIZE)
+        if last_id is not None:
+            query = query.where(contents.c.id > last_id)
+        rows = conn.execute(query).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            raw = decompress_text(row.raw_message) or ''
+            conn.execute(
+                messages.update().where(messages.c.content_id == row.id).values(size=len(raw.encode('utf-8')))
+            )
+        last_id = rows[-1].id
+
+    op.execute(
+        "UPDATE inboxes SET "
+        "stored_bytes = (SELECT COALESCE(sum(size), 0) FROM messages WHERE messages.inbox_id = inboxes.id)"
+    )
+
+
+def downgrade() -> None:
+    # Sizes stay in raw bytes
+    pass
@@ -2,62 +2,96 @@
 Background tasks for cleanup and maintenance
 """
 import asyncio
-from datetime import datetime, timedelta
-from app.database import SessionLocal
-from app.models import Inbox, Message, Attachment
-from app.services.attachment_service import delete_attachment_file
-from app.config import settings
+import time
+from datetime import datetime
+from typing import List, Tuple
+from sqlalchemy.orm import Session
+from app.database import engines, session_for_shard
+from app.models import Inbox, Message
+from app.services.ingest import discard_files
+from app.services.inbox_limits import delete_orphaned_contents
+from app.services.message_cache import message_cache
+from app.services import search_index
+from app.services.storage import get_storage
+from app.services.dedup import delete_expired_keys
+from app.services.metrics import cleanup_seconds, cleanup_deleted_total
+
+LOCAL_STORAGE_INTERVAL_SECONDS = 60
 
 async def cleanup_expired_inboxes():
-    """Periodically clean up expired inboxes and their data"""
+    """Clean up expired inboxes and their data on every shard (maintenance job, leader only)"""
+    started = time.perf_counter()
+    try:
+        for shard in range(len(engines)):
+            cleanup_shard(shard)
+        
+        # Storage housekeeping (e.g. dropping expired pack segments)
+        result = get_storage().maintain()
+        if result and any(result):
+            print(f"Cleanup: Dropped {result[0]} pack segments, compacted {result[1]}")
+    except Exception as e:
+        print(f"Error during storage maintenance: {e}")
+    finally:
+        cleanup_seconds.observe(time.perf_counter() - started)
+
+async def maintain_local_storage_periodically():
+    """Per-process storage housekeeping (every worker), e.g. sealing idle pack segments"""
     while True:
         try:
-            await asyncio.sleep(settings.CLEANUP_INTERVAL_MINUTES * 60)
-            
-            db = SessionLocal()
-            try:
-                # Find expired inboxes
-                now = datetime.utcnow()
-                expired_inboxes = db.query(Inbox).filter(Inbox.expires_at < now).all()
-                
-                deleted_inboxes = 0
-                deleted_messages = 0
-                deleted_attachments = 0
-                
-                for inbox in expired_inboxes:
-                    # Get all messages for this inbox
-                    messages = db.query(Message).filter(Message.inbox_id == inbox.id).all()
-                    
-                    # Delete attachments
-                    for message in messages:
-                        attachments = db.query(Attachment).filter(Attachment.message_id == message.id).all()
-                        for attachment in attachments:
-                            delete_attachment_file(attachment)
-                            db.delete(attachment)
-                            deleted_attachments += 1
-                    
-                    # Delete messages (cascade will handle it, but we do it explicitly)
-                    for message in messages:
-                        db.delete(message)
-                        deleted_messages += 1
-                    
-                    # Delete inbox
-                    db.delete(inbox)
-                    deleted_inboxes += 1
-                
-                db.commit()
-                
-                if deleted_inboxes > 0:
-                    print(f"Cleanup: Deleted {deleted_inboxes} inboxes, {deleted_messages} messages, {deleted_attachments} attachments")
-            
-            except Exception as e:
-                db.rollback()
-                print(f"Error during cleanup: {e}")
-            finally:
-                db.close()
-                
+            await asyncio.sleep(LOCAL_STORAGE_INTERVAL_SECONDS)
+            get_storage().maintain_local()
         except asyncio.CancelledError:
             break
         except Exception as e:
-            print(f"Error in cleanup task: {e}")
+            print(f"Error in local storage maintenance: {e}")
+
+def delete_inboxes(db: Session, inbox_ids: List[str]) -> Tuple[List[str], int]:
+    """
+    Delete inboxes with their messages, search rows, and the contents and
+    attachment rows no other inbox still references, without committing.
+    Returns (attachment file paths to discard once committed, messages deleted).
+    """
+    content_ids = set()
+    deleted_messages = 0
+    for inbox_id in inbox_ids:
+        messages = db.query(Message.id, Message.content_id).filter(Message.inbox_id == inbox_id).all()
+        for message_id, content_id in messages:
+            content_ids.add(content_id)
+            message_cache.invalidate(message_id)
+        db.query(Message).filter(Message.inbox_id == inbox_id).delete(synchronize_session=False)
+        deleted_messages += len(messages)
+        
+        search_index.delete_inbox(db, inbox_id)
+        db.query(Inbox).filter(Inbox.id == inbox_id).delete(synchronize_session=False)
+    
+    # Delete shared contents no other recipient still references
+    return delete_orphaned_contents(db, content_ids), deleted_messages
 
+def cleanup_shard(shard: int):
+    """Delete expired inboxes, their messages and orphaned contents on one shard"""
+    db = session_for_shard(shard)
+    try:
+        # Find expired inboxes
+        now = datetime.utcnow()
+        expired_ids = [row.id for row in db.query(Inbox.id).filter(Inbox.expires_at < now).all()]
+        
+        file_paths, deleted_messages = delete_inboxes(db, expired_ids)
+        deleted_inboxes = len(expired_ids)
+        deleted_attachments = len(file_paths)
+        
+        # Dedup keys live as long as the inboxes they protect
+        delete_expired_keys(db)
+        
+        db.commit()
+        discard_files(file_paths)
+        cleanup_deleted_total.inc("inboxes", amount=deleted_inboxes)
+        cleanup_deleted_total.inc("messages", amount=deleted_messages)
+        cleanup_deleted_total.inc("attachments", amount=deleted_attachments)
+        
+        if deleted_inboxes > 0:
+            print(f"Cleanup: Deleted {deleted_inboxes} inboxes, {deleted_messages} messages, {deleted_attachments} attachments (shard {shard})")
+    except Exception as e:
+        db.rollback()
+        print(f"Error during cleanup of shard {shard}: {e}")
+    finally:
+        db.close()
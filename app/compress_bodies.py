@@ -0,0 +1,113 @@
+"""
+Maintain message body compression.
+
+Usage:
+    python -m app.compress_bodies train [--samples N] [--dict-size BYTES]
+    python -m app.compress_bodies recompress [--batch-size N]
+
+``train`` builds a zstd dictionary from recent message bodies on every
+shard and stores it in compression_dictionaries (on shard 0); new bodies
+are compressed with the newest dictionary. ``recompress`` rewrites the
+existing bodies on every shard with the current settings and dictionary
+(older dictionaries stay valid for reads).
+"""
+import argparse
+from sqlalchemy import desc
+from sqlalchemy.orm import undefer
+from sqlalchemy.orm.attributes import flag_modified
+from app.database import SessionLocal, engines, session_for_shard
+from app.models import MessageContent, CompressionDictionary
+from app.services import body_compression
+
+def train(samples: int = 2000, dict_size: int = 110 * 1024) -> int:
+    if body_compression.zstandard is None:
+        raise SystemExit("Training a dictionary requires the zstandard package")
+
+    # Sample recent bodies from every shard
+    corpus = []
+    per_shard = max(1, samples // len(engines))
+    for shard in range(len(engines)):
+        db = session_for_shard(shard)
+        try:
+            contents = db.query(MessageContent.text_content, MessageContent.html_content)\
+                .order_by(desc(MessageContent.created_at))\
+                .limit(per_shard)\
+                .all()
+        finally:
+            db.close()
+
+        corpus.extend(
+            body.encode("utf-8")
+            for content in contents
+            for body in (content.text_content, content.html_content)
+            if body
+        )
+    if len(corpus) < 10:
+        raise SystemExit(f"Not enough bodies to train a dictionary ({len(corpus)})")
+
+    trained = body_compression.zstandard.train_dictionary(dict_size, corpus)
+    # Dictionaries are global: they live on shard 0
+    db = SessionLocal()
+    try:
+        row = CompressionDictionary(data=trained.as_bytes())
+        db.add(row)
+        db.commit()
+        body_compression.load_dictionaries()
+        print(f"Trained dictionary {row.id} from {len(corpus)} bodies ({len(row.data)} bytes)")
+        return row.id
+    finally:
+        db.close()
+
+def recompress(batch_size: int = 500) -> int:
+    count = 0
+    for shard in range(len(engines)):
+        db = session_for_shard(shard)
+        try:
+            count += recompress_shard(db, batch_size)
+        finally:
+            db.close()
+
+    print(f"Recompressed {count} message bodies")
+    return count
+
+def recompress_shard(db, batch_size: int) -> int:
+    """Re-encode the bodies of one shard in id order, committing per batch"""
+    count = 0
+    last_id = None
+    while True:
+        query = db.query(MessageContent).options(undefer("*"))
+        if last_id is not None:
+            query = query.filter(MessageContent.id > last_id)
+        contents = query.order_by(MessageContent.id).limit(batch_size).all()
+        if not contents:
+            break
+        for content in contents:
+            # Mark as modified so the bodies are re-encoded on flush
+            for name in ("text_content", "html_content", "raw_message"):
+                if getattr(content, name) is not None:
+                    flag_modified(content, name)
+            count += 1
+        last_id = contents[-1].id
+        db.commit()
+        db.expunge_all()
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Message body compression maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="Train a shared zstd dictionary")
+    train_parser.add_argument("--samples", type=int, default=2000, help="Messages to sample")
+    train_parser.add_argument("--dict-size", type=int, default=110 * 1024, help="Dictionary size in bytes")
+
+    recompress_parser = subparsers.add_parser("recompress", help="Re-encode stored bodies")
+    recompress_parser.add_argument("--batch-size", type=int, default=500, help="Bodies per commit")
+
+    args = parser.parse_args()
+    if args.command == "train":
+        train(samples=args.samples, dict_size=args.dict_size)
+    else:
+        recompress(batch_size=args.batch_size)
+
+if __name__ == "__main__":
+    main()
@@ -16,16 +16,123 @@ class Settings(BaseSettings):
     STORAGE_PATH: str = os.getenv("STORAGE_PATH", "./storage")
     ATTACHMENTS_PATH: str = os.getenv("ATTACHMENTS_PATH", "./storage/attachments")
     
+    # Attachment storage backend: "local" (hash-sharded under ATTACHMENTS_PATH) or "s3"
+    STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "local")
+    S3_BUCKET: str = os.getenv("S3_BUCKET", "tempmail-attachments")
+    S3_PREFIX: str = os.getenv("S3_PREFIX", "")
+    S3_ENDPOINT_URL: str = os.getenv("S3_ENDPOINT_URL", "")
+    S3_ACCESS_KEY_ID: str = os.getenv("S3_ACCESS_KEY_ID", "")
+    S3_SECRET_ACCESS_KEY: str = os.getenv("S3_SECRET_ACCESS_KEY", "")
+    S3_REGION: str = os.getenv("S3_REGION", "")
+    
+    # Pack small attachments into append-only segment files
+    PACK_SMALL_ATTACHMENTS: bool = os.getenv("PACK_SMALL_ATTACHMENTS", "False").lower() == "true"
+    PACK_PATH: str = os.getenv("PACK_PATH", "./storage/packs")
+    PACK_MAX_BLOB_KB: int = int(os.getenv("PACK_MAX_BLOB_KB", "64"))
+    PACK_SEGMENT_MAX_MB: int = int(os.getenv("PACK_SEGMENT_MAX_MB", "64"))
+    PACK_SEGMENT_MAX_MINUTES: int = int(os.getenv("PACK_SEGMENT_MAX_MINUTES", "60"))
+    PACK_COMPACT_DEAD_RATIO: float = float(os.getenv("PACK_COMPACT_DEAD_RATIO", "0.5"))
+    
+    # Message body compression: "zstd" (needs zstandard, else zlib), "zlib" or "none"
+    BODY_COMPRESSION: str = os.getenv("BODY_COMPRESSION", "zstd")
+    BODY_COMPRESSION_LEVEL: int = int(os.getenv("BODY_COMPRESSION_LEVEL", "3"))
+    BODY_COMPRESSION_MIN_BYTES: int = int(os.getenv("BODY_COMPRESSION_MIN_BYTES", "256"))
+    
     # Inbox settings
     MAX_INBOX_LIFETIME_HOURS: int = int(os.getenv("MAX_INBOX_LIFETIME_HOURS", "24"))
+    MAX_BULK_INBOXES: int = int(os.getenv("MAX_BULK_INBOXES", "1000"))
+    
+    # Per-inbox flood protection (0 disables a limit). Over the rate, mail for
+    # the inbox is dropped; over the quotas, its oldest messages are evicted.
+    INBOX_RATE_LIMIT_PER_MINUTE: int = int(os.getenv("INBOX_RATE_LIMIT_PER_MINUTE", "60"))
+    INBOX_RATE_LIMIT_BURST: int = int(os.getenv("INBOX_RATE_LIMIT_BURST", "120"))
+    INBOX_MAX_MESSAGES: int = int(os.getenv("INBOX_MAX_MESSAGES", "500"))
+    INBOX_MAX_MB: int = int(os.getenv("INBOX_MAX_MB", "100"))
+    
+    # Verification code lookups: longest long-poll, and how often a waiting
+    # request re-checks for mail stored by other worker processes
+    LATEST_CODE_MAX_WAIT_SECONDS: int = int(os.getenv("LATEST_CODE_MAX_WAIT_SECONDS", "60"))
+    LATEST_CODE_POLL_SECONDS: int = int(os.getenv("LATEST_CODE_POLL_SECONDS", "2"))
     
     # File limits
     MAX_ATTACHMENT_SIZE_MB: int = int(os.getenv("MAX_ATTACHMENT_SIZE_MB", "5"))
     MAX_EMAIL_SIZE_MB: int = int(os.getenv("MAX_EMAIL_SIZE_MB", "10"))
     
+    # Ingest: group commits through a single writer task
+    INGEST_GROUP_COMMIT: bool = os.getenv("INGEST_GROUP_COMMIT", "True").lower() == "true"
+    INGEST_BATCH_MAX_SIZE: int = int(os.getenv("INGEST_BATCH_MAX_SIZE", "64"))
+    INGEST_BATCH_MAX_WAIT_MS: int = int(os.getenv("INGEST_BATCH_MAX_WAIT_MS", "10"))
+    
+    # Ingest: accept into a durable spool and process with a worker pool
+    INGEST_QUEUE_ENABLED: bool = os.getenv("INGEST_QUEUE_ENABLED", "False").lower() == "true"
+    INGEST_SPOOL_PATH: str = os.getenv("INGEST_SPOOL_PATH", "./storage/spool")
+    INGEST_WORKERS: int = int(os.getenv("INGEST_WORKERS", "4"))
+    INGEST_MAX_ATTEMPTS: int = int(os.getenv("INGEST_MAX_ATTEMPTS", "5"))
+    INGEST_RETRY_DELAY_SECONDS: int = int(os.getenv("INGEST_RETRY_DELAY_SECONDS", "5"))
+    
+    # Ingest: admission control (0 disables a limit); overload answers 503 + Retry-After
+    INGEST_MAX_CONCURRENT: int = int(os.getenv("INGEST_MAX_CONCURRENT", "64"))
+    INGEST_MAX_INFLIGHT_MB: int = int(os.getenv("INGEST_MAX_INFLIGHT_MB", "128"))
+    INGEST_RETRY_AFTER_SECONDS: int = int(os.getenv("INGEST_RETRY_AFTER_SECONDS", "30"))
+    
+    # Ingest: drop redelivered emails (Message-ID + recipient + body hash)
+    INGEST_DEDUP_ENABLED: bool = os.getenv("INGEST_DEDUP_ENABLED", "True").lower() == "true"
+    
+    # LMTP listener: Postfix delivers straight to the backend (unix socket
+    # when LMTP_SOCKET is set, otherwise TCP)
+    LMTP_ENABLED: bool = os.getenv("LMTP_ENABLED", "False").lower() == "true"
+    LMTP_HOST: str = os.getenv("LMTP_HOST", "127.0.0.1")
+    LMTP_PORT: int = int(os.getenv("LMTP_PORT", "8024"))
+    LMTP_SOCKET: str = os.getenv("LMTP_SOCKET", "")
+    # Only the worker holding this lock listens (default: next to the
+    # socket, or in the temp directory for TCP)
+    LMTP_LOCK_PATH: str = os.getenv("LMTP_LOCK_PATH", "")
+    
+    # Sharding: inboxes and their mail are spread over the main database and
+    # these extra databases (comma-separated URLs) by a hash of the address.
+    # DATABASE_SHARDS_SINCE is the ISO time sharding was enabled; inboxes and
+    # ids from before it stay on the main database.
+    DATABASE_SHARD_URLS: str = os.getenv("DATABASE_SHARD_URLS", "")
+    DATABASE_SHARDS_SINCE: str = os.getenv("DATABASE_SHARDS_SINCE", "")
+    
+    # Read replicas for read-only endpoints (comma-separated URLs, each
+    # optionally prefixed with the shard it replicates: "1=postgresql://...";
+    # default shard 0). Reads go to the primary for READ_REPLICA_PIN_SECONDS
+    # after a client creates inboxes or new mail arrives for an inbox.
+    DATABASE_REPLICA_URLS: str = os.getenv("DATABASE_REPLICA_URLS", "")
+    READ_REPLICA_PIN_SECONDS: int = int(os.getenv("READ_REPLICA_PIN_SECONDS", "5"))
+    
+    # Prometheus metrics at GET /metrics (per worker process)
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+    
+    # Ingest tracing: finished traces are appended as OTLP/JSON lines (empty
+    # disables export; trace ids are still stored on messages)
+    TRACE_EXPORT_PATH: str = os.getenv("TRACE_EXPORT_PATH", "")
+    
+    # Database diagnostics: SQL_ECHO logs every statement (development only);
+    # statements slower than SLOW_QUERY_MS (0 disables) are logged and kept
+    # for GET /api/admin/slow-queries
+    SQL_ECHO: bool = os.getenv("SQL_ECHO", "False").lower() == "true"
+    SLOW_QUERY_MS: int = int(os.getenv("SLOW_QUERY_MS", "200"))
+    SLOW_QUERY_LOG_SIZE: int = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+    
+    # Admin endpoints (/api/admin: slow queries, profiler); disabled unless ADMIN_TOKEN is set
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+    PROFILE_MAX_SECONDS: int = int(os.getenv("PROFILE_MAX_SECONDS", "60"))
+    
     # Cleanup
     CLEANUP_INTERVAL_MINUTES: int = int(os.getenv("CLEANUP_INTERVAL_MINUTES", "60"))
     
+    # Maintenance jobs (cleanup) run only in the elected leader worker; a dead
+    # leader's lease is taken over after MAINTENANCE_LEASE_SECONDS (SQLite)
+    MAINTENANCE_LEASE_SECONDS: int = int(os.getenv("MAINTENANCE_LEASE_SECONDS", "60"))
+    
+    # Inbox activity tracking
+    ACTIVITY_FLUSH_INTERVAL_SECONDS: int = int(os.getenv("ACTIVITY_FLUSH_INTERVAL_SECONDS", "5"))
+    
+    # Message detail cache
+    MESSAGE_CACHE_MAX_MB: int = int(os.getenv("MESSAGE_CACHE_MAX_MB", "64"))
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
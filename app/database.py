@@ -1,23 +1,121 @@
+import time
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import List, Tuple
+from fastapi import Request
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
+from app.services.query_monitor import slow_query_log
 
-# Use SQLite with absolute path
-database_url = "sqlite:///tempmail.db"
-engine = create_engine(
-    database_url,
-    connect_args={"check_same_thread": False},
-    echo=True
-)
+# Path parameters whose ids carry the shard of the row they name
+SHARDED_PATH_PARAMS = ("inbox_id", "message_id", "attachment_id")
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def create_shard_engine(url: str, shard: int, replica: bool = False):
+    connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+    shard_engine = create_engine(
+        url,
+        connect_args=connect_args,
+        echo=settings.SQL_ECHO,
+        # Read by the id column default (models.generate_id) and slow-query capture
+        execution_options={"shard_id": shard, "replica": replica}
+    )
+    slow_query_log.install(shard_engine)
+    return shard_engine
+
+database_url = settings.DATABASE_URL
+
+# Shard 0 is the main database (it also holds global tables such as
+# compression dictionaries and maintenance leases); DATABASE_SHARD_URLS
+# adds shards 1..N-1
+shard_urls = [database_url] + [url.strip() for url in settings.DATABASE_SHARD_URLS.split(",") if url.strip()]
+engines = [create_shard_engine(url, shard) for shard, url in enumerate(shard_urls)]
+engine = engines[0]
+
+shard_sessions = [
+    sessionmaker(autocommit=False, autoflush=False, bind=shard_engine, info={"shard": shard})
+    for shard, shard_engine in enumerate(engines)
+]
+SessionLocal = shard_sessions[0]
+
+def parse_replica_urls(value: str) -> List[Tuple[int, str]]:
+    """(shard, url) pairs from DATABASE_REPLICA_URLS ("url" or "shard=url")"""
+    replicas = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        prefix, _, rest = item.partition("=")
+        shard, url = (int(prefix), rest.strip()) if prefix.strip().isdigit() else (0, item)
+        if shard >= len(engines):
+            raise ValueError(f"DATABASE_REPLICA_URLS: no shard {shard} for {url}")
+        replicas.append((shard, url))
+    return replicas
+
+# Read-only copies of each shard, used by read endpoints (services/read_routing)
+replica_engines: List[List] = [[] for _ in engines]
+for replica_shard, replica_url in parse_replica_urls(settings.DATABASE_REPLICA_URLS):
+    replica_engines[replica_shard].append(create_shard_engine(replica_url, replica_shard, replica=True))
+
+replica_sessions = [
+    [
+        sessionmaker(autocommit=False, autoflush=False, bind=replica_engine, info={"shard": shard, "replica": True})
+        for replica_engine in shard_replicas
+    ]
+    for shard, shard_replicas in enumerate(replica_engines)
+]
 
 Base = declarative_base()
 
-def get_db():
-    """Dependency for getting database session"""
-    db = SessionLocal()
+def parse_utc_ms(value: str) -> int:
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+# Ids minted before sharding was enabled (and inboxes created before then)
+# live on shard 0
+shards_since_ms = parse_utc_ms(settings.DATABASE_SHARDS_SINCE) if settings.DATABASE_SHARDS_SINCE else 0
+
+def shard_for_email(email: str) -> int:
+    """Home shard of an address (stable across processes and restarts)"""
+    return zlib.crc32(email.lower().strip().encode("utf-8")) % len(engines)
+
+def shard_from_id(value: str) -> int:
+    """Shard of a row from its id: UUIDv7 ids carry it in rand_a (see models.generate_uuid)"""
+    if len(engines) == 1:
+        return 0
+    try:
+        parsed = uuid.UUID(value)
+    except ValueError:
+        return 0
+    if parsed.version != 7 or (parsed.int >> 80) < shards_since_ms:
+        # uuid4 ids and ids from before sharding
+        return 0
+    shard = (parsed.int >> 64) & 0xFFF
+    return shard if shard < len(engines) else 0
+
+def legacy_inboxes_possible() -> bool:
+    """True while inboxes created on shard 0 before sharding may still be valid"""
+    if not shards_since_ms or len(engines) == 1:
+        return False
+    return time.time() * 1000 < shards_since_ms + settings.MAX_INBOX_LIFETIME_HOURS * 3600 * 1000
+
+def session_for_shard(shard: int):
+    return shard_sessions[shard]()
+
+def shard_for_path(path_params: dict) -> int:
+    """Shard of the inbox, message or attachment named in a request path"""
+    for name in SHARDED_PATH_PARAMS:
+        if name in path_params:
+            return shard_from_id(path_params[name])
+    return 0
+
+def get_db(request: Request):
+    """Dependency for getting database session on the shard of the inbox, message or attachment in the path"""
+    db = session_for_shard(shard_for_path(request.path_params))
     try:
         yield db
     finally:
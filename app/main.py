@@ -1,12 +1,28 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from app.database import engine, Base
-from app.routers import inbound, inboxes, messages, attachments, websocket
-from app.background import cleanup_expired_inboxes
+from fastapi.responses import Response
+from app.database import engine, engines, Base
+from app.routers import inbound, inboxes, messages, attachments, websocket, admin
+from app.background import cleanup_expired_inboxes, maintain_local_storage_periodically
+from app.services.activity_tracker import tracker, flush_activity_periodically
+from app.services.maintenance import maintenance
+from app.services.ingest_writer import ingest_writer
+from app.services.ingest_queue import ingest_spool
+from app.services.lmtp_server import lmtp_server
+from app.services.body_compression import load_dictionaries
+from app.services.search_index import create_search_index
+from app.services.websocket_manager import manager
+from app.services.admission import inbound_admission
+from app.services.metrics import register_gauge, render_metrics
+from app.services.query_monitor import RequestContextMiddleware
+from app.config import settings
 import asyncio
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+# Create database tables on every shard
+for shard_engine in engines:
+    Base.metadata.create_all(bind=shard_engine)
+    with shard_engine.begin() as connection:
+        create_search_index(connection)
 
 app = FastAPI(
     title="TempMail API",
@@ -22,6 +38,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Lets slow-query capture name the calling route
+app.add_middleware(RequestContextMiddleware)
 
 # Include routers
 app.include_router(inbound.router, prefix="/api/inbound", tags=["inbound"])
@@ -29,13 +47,65 @@ app.include_router(inboxes.router, prefix="/api/inboxes", tags=["inboxes"])
 app.include_router(messages.router, prefix="/api/messages", tags=["messages"])
 app.include_router(attachments.router, prefix="/api/attachments", tags=["attachments"])
 app.include_router(websocket.router, prefix="/ws", tags=["websocket"])
+app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
 
 @app.on_event("startup")
 async def startup_event():
     """Start background tasks"""
-    asyncio.create_task(cleanup_expired_inboxes())
+    load_dictionaries()
+    # Cleanup runs in one worker per deployment (the elected leader)
+    maintenance.add_job("cleanup_expired_inboxes", settings.CLEANUP_INTERVAL_MINUTES * 60, cleanup_expired_inboxes)
+    maintenance.start(engine)
+    asyncio.create_task(flush_activity_periodically())
+    asyncio.create_task(maintain_local_storage_periodically())
+    if settings.INGEST_GROUP_COMMIT:
+        ingest_writer.start()
+    if settings.INGEST_QUEUE_ENABLED:
+        ingest_spool.start()
+    if settings.LMTP_ENABLED:
+        await lmtp_server.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush pending state before the worker exits"""
+    await lmtp_server.stop()
+    await maintenance.stop()
+    await ingest_spool.stop()
+    await ingest_writer.stop()
+    tracker.flush()
+
+# Gauges read at scrape time
+register_gauge(
+    "tempmail_websocket_connections", "Open WebSocket connections",
+    lambda: sum(len(connections) for connections in list(manager.active_connections.values()))
+)
+register_gauge(
+    "tempmail_websocket_inboxes", "Inboxes with at least one WebSocket subscriber",
+    lambda: len(manager.active_connections)
+)
+register_gauge(
+    "tempmail_db_pool_checked_out", "Database connections in use (all shards)",
+    lambda: sum(e.pool.checkedout() for e in engines if hasattr(e.pool, "checkedout"))
+)
+register_gauge(
+    "tempmail_db_pool_size", "Database connection pool size (all shards)",
+    lambda: sum(e.pool.size() for e in engines if hasattr(e.pool, "size"))
+)
+register_gauge(
+    "tempmail_maintenance_leader", "1 if this worker runs maintenance jobs",
+    lambda: int(maintenance.is_leader)
+)
+register_gauge("tempmail_ingest_inflight_requests", "Inbound emails being processed", lambda: inbound_admission.requests)
+register_gauge("tempmail_ingest_inflight_bytes", "Declared bytes of inbound emails being processed", lambda: inbound_admission.bytes)
 
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text exposition"""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
+
@@ -0,0 +1,111 @@
+"""
+Move attachments from the legacy flat directory into the configured
+storage backend.
+
+Usage:
+    python -m app.migrate_storage [--dry-run] [--batch-size N]
+
+Rows whose file_path is still a filesystem path are copied into the
+backend under a storage key, updated, committed in batches, and the old
+file is removed, on every database shard. Safe to re-run: migrated rows
+are skipped.
+"""
+import argparse
+import os
+from app.database import engines, session_for_shard
+from app.models import Attachment
+from app.config import settings
+from app.services.storage import get_storage, is_legacy_path, CHUNK_SIZE
+
+def migrate(dry_run: bool = False, batch_size: int = 500) -> dict:
+    storage = get_storage()
+    resolved_dir = os.path.realpath(settings.ATTACHMENTS_PATH)
+    stats = {"migrated": 0, "missing": 0, "failed": 0}
+
+    for shard in range(len(engines)):
+        db = session_for_shard(shard)
+        try:
+            migrate_shard(db, storage, resolved_dir, stats, dry_run, batch_size)
+        finally:
+            db.close()
+
+    return stats
+
+def migrate_shard(db, storage, resolved_dir: str, stats: dict, dry_run: bool, batch_size: int):
+    """Migrate the legacy attachments of one shard, counting into stats"""
+    # Only legacy rows contain a path separator
+    legacy_ids = [
+        row.id for row in db.query(Attachment.id).filter(
+            Attachment.file_path.contains("/") | Attachment.file_path.contains("\\")
+        )
+    ]
+
+    for i in range(0, len(legacy_ids), batch_size):
+        batch = db.query(Attachment).filter(Attachment.id.in_(legacy_ids[i:i + batch_size])).all()
+        migrated_files = []
+
+        for attachment in batch:
+            if not is_legacy_path(attachment.file_path):
+                continue
+
+            old_path = os.path.realpath(attachment.file_path)
+            if not old_path.startswith(resolved_dir + os.sep) or not os.path.exists(old_path):
+                print(f"Missing or invalid legacy file for attachment {attachment.id}: {attachment.file_path}")
+                stats["missing"] += 1
+                continue
+
+            if dry_run:
+                stats["migrated"] += 1
+                continue
+
+            key = os.path.basename(old_path)
+            try:
+                copy_into_storage(storage, old_path, key)
+            except Exception as e:
+                print(f"Failed to migrate attachment {attachment.id}: {e}")
+                stats["failed"] += 1
+                continue
+
+            attachment.file_path = key
+            migrated_files.append(old_path)
+            stats["migrated"] += 1
+
+        if not dry_run:
+            db.commit()
+            remove_files(migrated_files)
+
+def copy_into_storage(storage, path: str, key: str):
+    """Stream a local file into the storage backend"""
+    writer = storage.writer(key)
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+        writer.commit()
+    except Exception:
+        writer.abort()
+        raise
+
+def remove_files(paths):
+    """Remove legacy files once their new location is committed"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Could not remove {path}: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate attachments into the configured storage backend")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be migrated")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows per commit")
+    args = parser.parse_args()
+
+    stats = migrate(dry_run=args.dry_run, batch_size=args.batch_size)
+    action = "Would migrate" if args.dry_run else "Migrated"
+    print(f"{action} {stats['migrated']} attachments ({stats['missing']} missing, {stats['failed']} failed)")
+
+if __name__ == "__main__":
+    main()
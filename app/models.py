@@ -1,22 +1,89 @@
-from sqlalchemy import Column, String, Integer, DateTime, Text, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, Integer, DateTime, Text, ForeignKey, LargeBinary, Index
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 from datetime import datetime, timedelta
 from app.database import Base
 from app.config import settings
+from app.services.body_compression import CompressedText
+import os
+import threading
+import time
 import uuid
 
-def generate_uuid():
-    return str(uuid.uuid4())
+_id_lock = threading.Lock()
+_last_id = 0
+
+def generate_uuid(shard: int = 0):
+    """
+    Time-ordered UUIDv7 string (RFC 9562): 48-bit millisecond timestamp, the
+    12-bit rand_a field holding the database shard, then random bits. Ids
+    sort by creation time, so inserts append to the primary key and
+    (inbox_id, id) indexes instead of landing at random positions. Same text
+    format as the uuid4 ids stored before.
+    """
+    global _last_id
+    with _id_lock:
+        # 48 timestamp + 62 random bits; ids from this process strictly increase
+        value = (time.time_ns() // 1_000_000) << 62 | int.from_bytes(os.urandom(8), "big") >> 2
+        if value <= _last_id:
+            value = _last_id + 1
+        _last_id = value
+    timestamp, rand_b = value >> 62, value & ((1 << 62) - 1)
+    return str(uuid.UUID(int=timestamp << 80 | 0x7 << 76 | (shard & 0xFFF) << 64 | 0b10 << 62 | rand_b))
+
+class CompactId(TypeDecorator):
+    """
+    UUID id stored in 16 bytes (BLOB on SQLite, uuid on PostgreSQL) instead
+    of a 36-character string; the application and the API keep the text form.
+    """
+
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=False))
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            parsed = uuid.UUID(value)
+        except (ValueError, TypeError, AttributeError):
+            # Not an id (e.g. a mistyped URL): matches no row
+            return None
+        return str(parsed) if dialect.name == "postgresql" else parsed.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None or dialect.name == "postgresql":
+            return value
+        return str(uuid.UUID(bytes=value))
+
+def is_time_ordered(value: str) -> bool:
+    """True for UUIDv7 ids from generate_uuid; rows stored before them have random uuid4 ids"""
+    try:
+        return uuid.UUID(value).version == 7
+    except ValueError:
+        return False
+
+def generate_id(context):
+    """Primary key default: tagged with the shard whose connection inserts the row"""
+    return generate_uuid(context.execution_options.get("shard_id", 0))
 
 class Inbox(Base):
     __tablename__ = "inboxes"
     
-    id = Column(String, primary_key=True, default=generate_uuid)
+    id = Column(CompactId, primary_key=True, default=generate_id)
     email = Column(String, unique=True, nullable=False, index=True)
     created_at = Column(DateTime, default=func.now(), nullable=False)
     expires_at = Column(DateTime, nullable=False)
     last_activity = Column(DateTime, default=func.now(), nullable=False)
+    # Quota usage, maintained by ingest and eviction
+    message_count = Column(Integer, default=0, nullable=False)
+    stored_bytes = Column(Integer, default=0, nullable=False)
     
     # Relationships
     messages = relationship("Message", back_populates="inbox", cascade="all, delete-orphan")
@@ -31,33 +98,104 @@ class Inbox(Base):
         return datetime.utcnow() < self.expires_at
 
 class Message(Base):
+    """A received email as seen by one recipient inbox"""
     __tablename__ = "messages"
     
-    id = Column(String, primary_key=True, default=generate_uuid)
-    inbox_id = Column(String, ForeignKey("inboxes.id", ondelete="CASCADE"), nullable=False, index=True)
+    id = Column(CompactId, primary_key=True, default=generate_id)
+    inbox_id = Column(CompactId, ForeignKey("inboxes.id", ondelete="CASCADE"), nullable=False)
+    content_id = Column(CompactId, ForeignKey("message_contents.id"), nullable=False, index=True)
     from_address = Column(String, nullable=False)
     to_address = Column(String, nullable=False)
     subject = Column(Text)
-    text_content = Column(Text)
-    html_content = Column(Text)
-    raw_message = Column(Text)
+    size = Column(Integer, default=0, nullable=False)  # Bytes charged to the inbox quota
     received_at = Column(DateTime, default=func.now(), nullable=False, index=True)
+    # Ingest trace (W3C trace id) for following a delivery across mailpipe and the backend
+    trace_id = Column(String(32), index=True)
+    
+    # Message ids are time-ordered: lists, "newest" and eviction order by (inbox_id, id)
+    __table_args__ = (Index("ix_messages_inbox_id_id", "inbox_id", "id"),)
     
     # Relationships
     inbox = relationship("Inbox", back_populates="messages")
-    attachments = relationship("Attachment", back_populates="message", cascade="all, delete-orphan")
+    content = relationship("MessageContent", back_populates="messages")
+    
+    @staticmethod
+    def inbox_order(inbox_id: str) -> tuple:
+        """
+        Oldest-first sort columns for an inbox's messages. Inboxes created
+        before UUIDv7 ids may hold uuid4 message ids, which sort randomly, so
+        they sort by received_at until they expire.
+        """
+        if is_time_ordered(inbox_id):
+            return (Message.id,)
+        return (Message.received_at, Message.id)
+
+class MessageContent(Base):
+    """Body and attachments of a received email, shared by every recipient's Message"""
+    __tablename__ = "message_contents"
+    
+    id = Column(CompactId, primary_key=True, default=generate_id)
+    # Bodies are stored compressed and only loaded when accessed
+    text_content = deferred(Column(CompressedText), group="body")
+    html_content = deferred(Column(CompressedText), group="body")
+    raw_message = deferred(Column(CompressedText))
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    
+    # Relationships
+    messages = relationship("Message", back_populates="content")
+    attachments = relationship("Attachment", back_populates="content", cascade="all, delete-orphan")
+    codes = relationship("MessageCode", back_populates="content", cascade="all, delete-orphan")
 
 class Attachment(Base):
     __tablename__ = "attachments"
     
-    id = Column(String, primary_key=True, default=generate_uuid)
-    message_id = Column(String, ForeignKey("messages.id", ondelete="CASCADE"), nullable=False, index=True)
+    id = Column(CompactId, primary_key=True, default=generate_id)
+    content_id = Column(CompactId, ForeignKey("message_contents.id", ondelete="CASCADE"), nullable=False, index=True)
     filename = Column(String, nullable=False)
     content_type = Column(String, nullable=False)
     size = Column(Integer, nullable=False)
-    file_path = Column(String, nullable=False)
+    file_path = Column(String, nullable=False)  # Storage key (legacy rows: filesystem path)
     created_at = Column(DateTime, default=func.now(), nullable=False)
     
     # Relationships
-    message = relationship("Message", back_populates="attachments")
+    content = relationship("MessageContent", back_populates="attachments")
+
 
+class MessageCode(Base):
+    """Verification code or link extracted from a received email at ingest"""
+    __tablename__ = "message_codes"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    content_id = Column(CompactId, ForeignKey("message_contents.id", ondelete="CASCADE"), nullable=False, index=True)
+    kind = Column(String, nullable=False)  # "code" or "link"
+    value = Column(Text, nullable=False)
+    position = Column(Integer, default=0, nullable=False)  # 0 = most likely candidate
+    
+    # Relationships
+    content = relationship("MessageContent", back_populates="codes")
+
+
+class CompressionDictionary(Base):
+    __tablename__ = "compression_dictionaries"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+
+
+class IngestDedupKey(Base):
+    """Delivery already stored for one recipient; expires with the inbox lifetime"""
+    __tablename__ = "ingest_dedup_keys"
+    
+    key = Column(String, primary_key=True)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class MaintenanceLease(Base):
+    """Maintenance leader lease; the holder renews it before expires_at"""
+    __tablename__ = "maintenance_leases"
+    
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
@@ -0,0 +1,50 @@
+"""
+Local read-replica stand-in for SQLite databases.
+
+Usage:
+    python -m app.replicate_sqlite --target replica.db [--source tempmail.db] [--interval 2] [--once]
+
+Copies the primary database into the replica file with SQLite's online
+backup API every --interval seconds, so the replica trails the primary by
+up to that long, like an asynchronously replicated database. Point the app
+at the copy with DATABASE_REPLICA_URLS=sqlite:///replica.db (run one copier
+per shard and prefix shard replicas: "1=sqlite:///shard1-replica.db").
+
+For development and testing only; in production use the database's own
+replication (e.g. Postgres streaming replicas).
+"""
+import argparse
+import sqlite3
+import time
+
+def copy_database(source: str, target: str):
+    """Snapshot source into target; readers of target see the old or the new copy, never a mix"""
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True, timeout=30)
+    dst = sqlite3.connect(target, timeout=30)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy a SQLite database to a lagging read replica")
+    parser.add_argument("--source", default="tempmail.db", help="Primary database file")
+    parser.add_argument("--target", required=True, help="Replica database file")
+    parser.add_argument("--interval", type=float, default=2.0, help="Seconds between copies (the replica lag)")
+    parser.add_argument("--once", action="store_true", help="Copy once and exit")
+    args = parser.parse_args()
+
+    print(f"Replicating {args.source} -> {args.target} every {args.interval}s")
+    while True:
+        started = time.monotonic()
+        try:
+            copy_database(args.source, args.target)
+        except sqlite3.Error as e:
+            print(f"Replica copy failed: {e}")
+        if args.once:
+            break
+        time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+
+if __name__ == "__main__":
+    main()
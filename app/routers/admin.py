@@ -0,0 +1,57 @@
+import asyncio
+import secrets
+from fastapi import APIRouter, HTTPException, Header, Query, Depends
+from fastapi.responses import PlainTextResponse
+from typing import Optional
+from app.services.query_monitor import slow_query_log
+from app.services.profiler import profiler, collapsed, ProfilerBusy
+from app.services.shards import shard_stats
+from app.config import settings
+
+router = APIRouter()
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Admin endpoints need ADMIN_TOKEN in the X-Admin-Token header; without ADMIN_TOKEN they don't exist"""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@router.get("/slow-queries", dependencies=[Depends(require_admin)])
+async def slow_queries(limit: int = Query(50, ge=1, le=1000), clear: bool = False):
+    """
+    Statements slower than SLOW_QUERY_MS in this worker, newest first, with
+    their bound parameters and calling route. clear=true empties the log
+    after reading it.
+    """
+    entries = slow_query_log.recent(limit)
+    if clear:
+        slow_query_log.clear()
+    return {"threshold_ms": settings.SLOW_QUERY_MS, "queries": entries}
+
+@router.get("/shards", dependencies=[Depends(require_admin)])
+async def shards():
+    """Inbox, message and byte totals of every database shard"""
+    return {"shards": await asyncio.to_thread(shard_stats)}
+
+@router.post("/profile", dependencies=[Depends(require_admin)], response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(10, gt=0),
+    interval_ms: float = Query(10, ge=1, le=1000),
+    idle: bool = False
+):
+    """
+    Sample this worker's stacks for `seconds` and return them in collapsed
+    format (flamegraph.pl, speedscope). Threads parked waiting for work are
+    left out unless idle=true. The worker keeps serving meanwhile.
+    """
+    if seconds > settings.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be at most {settings.PROFILE_MAX_SECONDS}")
+    try:
+        result = await asyncio.to_thread(profiler.profile, seconds, interval_ms / 1000, idle)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return PlainTextResponse(
+        collapsed(result),
+        headers={"X-Profile-Samples": str(result["samples"])}
+    )
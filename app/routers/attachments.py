@@ -1,44 +1,52 @@
 from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from app.database import get_db
 from app.models import Attachment, Message, Inbox
-from app.services.attachment_service import read_attachment_file
+from app.services.attachment_service import open_attachment_stream
+from app.services.storage import iter_chunks
+from app.services.activity_tracker import touch_inbox
+from app.services.read_routing import get_read_db, use_primary
 
 router = APIRouter()
 
 @router.get("/{attachment_id}")
-async def download_attachment(attachment_id: str, db: Session = Depends(get_db)):
+async def download_attachment(attachment_id: str, db: Session = Depends(get_read_db)):
     """Download an attachment"""
     attachment = db.query(Attachment).filter(Attachment.id == attachment_id).first()
+    if not attachment and use_primary(db):
+        # Not replicated yet
+        attachment = db.query(Attachment).filter(Attachment.id == attachment_id).first()
     
     if not attachment:
         raise HTTPException(status_code=404, detail="Attachment not found")
     
-    # Verify message and inbox are valid
-    message = db.query(Message).filter(Message.id == attachment.message_id).first()
-    if not message:
+    # Verify a recipient inbox of the (shared) message is still valid
+    inboxes = db.query(Inbox)\
+        .join(Message, Message.inbox_id == Inbox.id)\
+        .filter(Message.content_id == attachment.content_id)\
+        .all()
+    if not inboxes:
         raise HTTPException(status_code=404, detail="Message not found")
     
-    inbox = db.query(Inbox).filter(Inbox.id == message.inbox_id).first()
-    if inbox:
-        if not inbox.is_valid():
-            raise HTTPException(status_code=410, detail="Inbox has expired")
-        
-        # Update inbox last activity
-        from datetime import datetime
-        inbox.last_activity = datetime.utcnow()
-        db.commit()
+    valid_inboxes = [inbox for inbox in inboxes if inbox.is_valid()]
+    if not valid_inboxes:
+        raise HTTPException(status_code=410, detail="Inbox has expired")
+    
+    if len(valid_inboxes) == 1:
+        # Record activity (flushed in batches by the activity tracker); with
+        # several recipients we can't tell which inbox is downloading
+        touch_inbox(valid_inboxes[0].id)
     
     try:
-        # Read file with security validation
-        file_content = read_attachment_file(attachment)
+        # Open blob with security validation and stream it in chunks
+        stream = open_attachment_stream(attachment)
         
-        return Response(
-            content=file_content,
+        return StreamingResponse(
+            iter_chunks(stream),
             media_type=attachment.content_type,
             headers={
-                "Content-Disposition": f'attachment; filename="{attachment.filename}"'
+                "Content-Disposition": f'attachment; filename="{attachment.filename}"',
+                "Content-Length": str(attachment.size)
             }
         )
     except HTTPException:
@@ -1,110 +1,210 @@
-from fastapi import APIRouter, Request, HTTPException, Depends
+import io
+import tempfile
+from fastapi import APIRouter, Request, HTTPException
 from fastapi.responses import Response
-from sqlalchemy.orm import Session
-from app.database import get_db
-from app.models import Inbox, Message
-from app.services.email_parser import parse_email
-from app.services.attachment_service import save_attachment
+from app.services.email_parser import parse_email_streaming
+from app.services.ingest import commit_parsed_email, discard_parsed_files, screen_recipients
+from app.services.ingest_writer import ingest_writer
+from app.services.ingest_queue import ingest_spool
 from app.services.websocket_manager import broadcast_new_message
+from app.services.activity_tracker import touch_inbox
+from app.services.admission import inbound_admission
+from app.services.metrics import ingest_stage_seconds, inbound_messages_total, inbound_message_bytes
+from app.services.tracing import Trace, start_trace, stage
 from app.config import settings
 
 router = APIRouter()
 
+# Request bodies up to this size are spooled in memory, larger ones to a temp file
+SPOOL_MEMORY_BYTES = 1024 * 1024
+
+def service_unavailable(detail: str) -> HTTPException:
+    """503 telling mailpipe (and so Postfix) to retry later"""
+    return HTTPException(
+        status_code=503,
+        detail=detail,
+        headers={"Retry-After": str(settings.INGEST_RETRY_AFTER_SECONDS)}
+    )
+
+def rate_limited() -> HTTPException:
+    """503 for mail over an inbox rate limit: mailpipe retries it later"""
+    return service_unavailable("Inbox rate limit exceeded, retry later")
+
+def payload_too_large() -> HTTPException:
+    """413 for emails over MAX_EMAIL_SIZE_MB"""
+    return HTTPException(
+        status_code=413,
+        detail=f"Email size exceeds maximum of {settings.MAX_EMAIL_SIZE_MB}MB"
+    )
+
 @router.post("/mail")
-async def receive_mail(request: Request, db: Session = Depends(get_db)):
+async def receive_mail(request: Request):
     """
     Receive email from Postfix pipe script.
     Accepts multipart/form-data with raw email content.
+    Envelope recipients (Postfix ${recipient}) come as repeated "recipients"
+    form fields, or in an X-Envelope-To header for raw posts; when present
+    they replace the recipients found in the message headers.
+    Mail over an inbox rate limit gets a 503 so it is retried.
+    A W3C traceparent header (sent by mailpipe) continues the sender's
+    trace; X-Postfix-Queue-Id is recorded on it.
+    Answers 503 with Retry-After when overloaded or on unexpected errors.
     """
+    max_size = settings.MAX_EMAIL_SIZE_MB * 1024 * 1024
+    try:
+        declared_size = int(request.headers.get("content-length", ""))
+    except ValueError:
+        # Unknown length (chunked): reserve the largest allowed email
+        declared_size = max_size
+    
+    # Reject oversized requests before reading the body (mailpipe's multipart
+    # posts also carry the extracted attachments, hence the headroom)
+    if declared_size > max_size * 2:
+        raise payload_too_large()
+    
+    # Admission control: bound concurrent requests and in-flight bytes
+    if not inbound_admission.try_acquire(declared_size):
+        inbound_messages_total.inc("rejected_busy")
+        raise service_unavailable("Server busy, retry later")
+    try:
+        with start_trace(
+            "POST /api/inbound/mail",
+            request.headers.get("traceparent"),
+            **{"postfix.queue_id": request.headers.get("x-postfix-queue-id")}
+        ) as trace, ingest_stage_seconds.time("total"):
+            return await process_inbound(request, trace)
+    finally:
+        inbound_admission.release(declared_size)
+
+async def spool_body(request: Request, max_size: int):
+    """Copy the request body into a temp file as it arrives; 413 once it passes max_size"""
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    size = 0
     try:
-        # Read raw email content
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > max_size:
+                raise payload_too_large()
+            body.write(chunk)
+    except BaseException:
+        body.close()
+        raise
+    body.seek(0)
+    return body
+
+async def process_inbound(request: Request, trace: Trace) -> Response:
+    """Read, screen, parse and store one inbound email"""
+    max_size = settings.MAX_EMAIL_SIZE_MB * 1024 * 1024
+    form = None
+    raw_email = None
+    try:
+        # Read raw email content into a (spooled) file; it is never held
+        # in memory as a whole
         content_type = request.headers.get("content-type", "")
         
-        if "multipart/form-data" in content_type:
-            form = await request.form()
-            email_field = form.get("email")
-            if email_field:
-                raw_email = await email_field.read()
+        with stage("read_body"):
+            if "multipart/form-data" in content_type:
+                # Starlette spools uploaded files the same way
+                form = await request.form()
+                envelope_values = [str(value) for value in form.getlist("recipients")]
+                email_field = form.get("email")
+                if email_field:
+                    raw_email = email_field.file
             else:
-                raw_email = await request.body()
-        else:
-            # Direct raw email
-            raw_email = await request.body()
-        
-        if not raw_email:
+                # Direct raw email
+                envelope_values = [request.headers.get("x-envelope-to", "")]
+                raw_email = await spool_body(request, max_size)
+        
+        envelope_recipients = [
+            address.lower()
+            for value in envelope_values
+            for address in value.replace(",", " ").split()
+        ]
+        
+        size = raw_email.seek(0, io.SEEK_END) if raw_email is not None else 0
+        if not size:
             raise HTTPException(status_code=400, detail="No email content received")
+        raw_email.seek(0)
         
-        # Validate size
-        max_size = settings.MAX_EMAIL_SIZE_MB * 1024 * 1024
-        if len(raw_email) > max_size:
-            raise HTTPException(
-                status_code=413,
-                detail=f"Email size exceeds maximum of {settings.MAX_EMAIL_SIZE_MB}MB"
-            )
-        
-        # Parse email
-        parsed = parse_email(raw_email)
-        to_address = parsed["to_address"].lower().strip()
+        inbound_message_bytes.observe(size)
+        trace.set_attribute("message.size", size)
         
-        if not to_address:
-            raise HTTPException(status_code=400, detail="No recipient address found")
-        
-        # Find inbox
-        inbox = db.query(Inbox).filter(Inbox.email == to_address).first()
-        
-        if not inbox:
-            # Inbox doesn't exist - silently accept (Postfix expects 200)
-            return Response(status_code=200, content="OK")
-        
-        if not inbox.is_valid():
-            # Inbox expired - silently accept
-            return Response(status_code=200, content="OK")
-        
-        # Create message record
-        message = Message(
-            inbox_id=inbox.id,
-            from_address=parsed["from_address"],
-            to_address=parsed["to_address"],
-            subject=parsed["subject"],
-            text_content=parsed["text_content"],
-            html_content=parsed["html_content"],
-            raw_message=parsed["raw_message"]
-        )
-        
-        db.add(message)
-        db.flush()  # Get message.id
+        # Validate size
+        if size > max_size:
+            raise payload_too_large()
         
-        # Save attachments
-        for att in parsed["attachments"]:
+        if settings.INGEST_QUEUE_ENABLED:
+            # Accept into the durable spool; workers parse and persist later
             try:
-                await save_attachment(
-                    db=db,
-                    message_id=message.id,
-                    filename=att["filename"],
-                    content_type=att["content_type"],
-                    file_content=att["content"]
-                )
+                await ingest_spool.enqueue(raw_email, envelope_recipients, trace.traceparent)
             except Exception as e:
-                # Log but continue processing
-                print(f"Error saving attachment: {e}")
+                print(f"Error spooling inbound email: {e}")
+                # Not accepted - let the sender retry
+                raise service_unavailable("Could not queue email")
+            inbound_messages_total.inc("queued")
+            return Response(status_code=200, content="OK")
         
-        # Update inbox last activity
-        from datetime import datetime
-        inbox.last_activity = datetime.utcnow()
+        # Header-stage checks: unknown inboxes, redelivery dedup, inbox rate limits
+        recipients, dedup_keys, dropped, limited = screen_recipients(raw_email, envelope_recipients)
+        if limited and not recipients:
+            inbound_messages_total.inc("deferred_rate_limited")
+            raise rate_limited()
+        if dropped and not recipients:
+            # Unknown inbox or already stored - acknowledge without storing
+            return Response(status_code=200, content="OK")
         
-        db.commit()
-        db.refresh(message)
+        # Parse email; attachments are decoded straight into storage
+        with stage("parse"):
+            parsed = parse_email_streaming(raw_email)
+        if recipients:
+            parsed["recipients"] = recipients
+        parsed["dedup_keys"] = dedup_keys
         
-        # Broadcast new message event via WebSocket
-        await broadcast_new_message(inbox.id, message.id)
+        if not parsed["recipients"] and not parsed["to_address"].strip():
+            discard_parsed_files(parsed)
+            raise HTTPException(status_code=400, detail="No recipient address found")
         
-        # Return 200 OK for Postfix
+        try:
+            if settings.INGEST_GROUP_COMMIT:
+                # Hand off to the single writer; returns once the group commit is durable
+                result = await ingest_writer.submit(parsed)
+            else:
+                result = commit_parsed_email(parsed)
+        except Exception:
+            discard_parsed_files(parsed)
+            raise
+        
+        if result:
+            with stage("broadcast"):
+                for inbox_id, message_id in result["deliveries"]:
+                    # Record activity (flushed in batches by the activity tracker)
+                    touch_inbox(inbox_id)
+                    
+                    # Broadcast new message event via WebSocket
+                    await broadcast_new_message(inbox_id, message_id)
+        
+        if limited:
+            if settings.INGEST_DEDUP_ENABLED:
+                # The retry skips the recipients stored now (dedup) and
+                # delivers to the rate-limited ones
+                inbound_messages_total.inc("deferred_rate_limited")
+                raise rate_limited()
+            # A retry would store the email twice for the others
+            inbound_messages_total.inc("dropped_rate_limited")
+        
+        # Return 200 OK for Postfix (also when the inbox expired meanwhile)
         return Response(status_code=200, content="OK")
         
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error processing inbound email: {e}")
-        # Still return 200 to prevent Postfix from retrying
-        return Response(status_code=200, content="OK")
+        print(f"Error processing inbound email (trace {trace.trace_id}): {e}")
+        inbound_messages_total.inc("failed")
+        # Not stored - let Postfix retry (redeliveries are deduplicated)
+        raise service_unavailable("Could not process email")
+    finally:
+        if form is not None:
+            await form.close()
+        elif raw_email is not None:
+            raw_email.close()
 
@@ -1,15 +1,61 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import Response
 from sqlalchemy.orm import Session
-from pydantic import BaseModel, EmailStr
-from app.database import get_db
-from app.models import Inbox
-from datetime import datetime
+from sqlalchemy import desc
+from sqlalchemy.dialects import postgresql, sqlite
+from pydantic import BaseModel, EmailStr, TypeAdapter, field_validator, model_validator
+from app.background import delete_inboxes
+from app.database import get_db, session_for_shard
+from app.models import Inbox, Message, MessageCode
+from app.services.activity_tracker import touch_inbox
+from app.services.ingest import discard_files
+from app.services.websocket_manager import message_waiters
+from app.services.shards import address_shard, group_by_shard
+from app.services.read_routing import get_read_db, pin_client, find_inbox
+from app.config import settings
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+import asyncio
+import secrets
+import string
+import time
 
 router = APIRouter()
 
 class InboxCreate(BaseModel):
     email: EmailStr
 
+class InboxBulkCreate(BaseModel):
+    """Either an explicit list of addresses, or count + domain to generate"""
+    emails: Optional[List[EmailStr]] = None
+    count: Optional[int] = None
+    domain: Optional[str] = None
+    
+    @field_validator("domain")
+    @classmethod
+    def validate_domain(cls, value):
+        if value is None:
+            return value
+        value = value.lower().strip().lstrip("@")
+        # Reuse the email validator to check the domain part
+        TypeAdapter(EmailStr).validate_python(f"probe@{value}")
+        return value
+    
+    @model_validator(mode="after")
+    def validate_mode(self):
+        if self.emails is not None:
+            if self.count is not None or self.domain is not None:
+                raise ValueError("Provide either emails or count/domain, not both")
+            requested = len(self.emails)
+        else:
+            if self.count is None or self.domain is None:
+                raise ValueError("Provide emails, or both count and domain")
+            requested = self.count
+        
+        if requested < 1 or requested > settings.MAX_BULK_INBOXES:
+            raise ValueError(f"Number of inboxes must be between 1 and {settings.MAX_BULK_INBOXES}")
+        return self
+
 class InboxResponse(BaseModel):
     id: str
     email: str
@@ -21,34 +67,141 @@ class InboxResponse(BaseModel):
         from_attributes = True
 
 @router.post("/", response_model=InboxResponse, status_code=201)
-async def create_inbox(inbox_data: InboxCreate, db: Session = Depends(get_db)):
+async def create_inbox(inbox_data: InboxCreate, response: Response):
     """Create a new inbox"""
     email = inbox_data.email.lower().strip()
+    pin_client(response)
     
-    # Check if inbox already exists
-    existing = db.query(Inbox).filter(Inbox.email == email).first()
+    # The address decides the shard
+    db = session_for_shard(address_shard(email))
+    try:
+        return upsert_inbox(db, email)
+    finally:
+        db.close()
+
+def upsert_inbox(db: Session, email: str) -> InboxResponse:
+    """Return the valid inbox for email, replacing an expired one or creating it"""
+    records, _ = upsert_inboxes(db, [email])
+    return records[email]
+
+LOCAL_PART_ALPHABET = string.ascii_lowercase + string.digits
+LOCAL_PART_LENGTH = 12
+
+# Keep IN lists below SQLite's bound-parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+def generate_local_part() -> str:
+    """Generate a random mailbox local-part"""
+    return "".join(secrets.choice(LOCAL_PART_ALPHABET) for _ in range(LOCAL_PART_LENGTH))
+
+def find_existing_inboxes(db: Session, emails: List[str]) -> dict:
+    """Look up inboxes by email in chunked IN queries"""
+    existing = {}
+    for i in range(0, len(emails), LOOKUP_CHUNK_SIZE):
+        chunk = emails[i:i + LOOKUP_CHUNK_SIZE]
+        for inbox in db.query(Inbox).filter(Inbox.email.in_(chunk)).all():
+            existing[inbox.email] = inbox
+    return existing
+
+def find_taken_addresses(emails: List[str]) -> set:
+    """Addresses that already have an inbox, looked up on their shards"""
+    taken = set()
+    for shard, shard_emails in group_by_shard(emails).items():
+        db = session_for_shard(shard)
+        try:
+            taken.update(find_existing_inboxes(db, shard_emails))
+        finally:
+            db.close()
+    return taken
+
+def generate_unique_emails(count: int, domain: str) -> List[str]:
+    """Generate count addresses on domain that collide neither with each other nor with stored inboxes"""
+    emails = set()
+    while len(emails) < count:
+        candidates = set()
+        while len(emails) + len(candidates) < count:
+            candidate = f"{generate_local_part()}@{domain}"
+            if candidate not in emails:
+                candidates.add(candidate)
+        
+        taken = find_taken_addresses(list(candidates))
+        emails.update(candidates - taken)
+    return list(emails)
+
+@router.post("/bulk", response_model=dict, status_code=201)
+async def create_inboxes_bulk(bulk_data: InboxBulkCreate, response: Response):
+    """
+    Create many inboxes in a single transaction per database shard.
+    Existing valid inboxes are returned as-is; expired ones are replaced.
+    """
+    pin_client(response)
+    if bulk_data.emails is not None:
+        # Deduplicate while keeping request order
+        emails = list(dict.fromkeys(e.lower().strip() for e in bulk_data.emails))
+    else:
+        emails = generate_unique_emails(bulk_data.count, bulk_data.domain)
     
-    if existing:
-        if existing.is_valid():
-            # Return existing valid inbox
-            return InboxResponse.from_orm(existing)
-        else:
-            # Delete expired inbox
-            db.delete(existing)
-            db.commit()
+    records = {}
+    created = 0
+    for shard, shard_emails in group_by_shard(emails).items():
+        db = session_for_shard(shard)
+        try:
+            shard_records, shard_created = upsert_inboxes(db, shard_emails)
+        finally:
+            db.close()
+        records.update(shard_records)
+        created += shard_created
+    
+    return {
+        "inboxes": [records[email] for email in emails],
+        "created": created,
+        "existing": len(emails) - created
+    }
+
+def insert_inboxes(db: Session, emails: List[str]) -> set:
+    """
+    Insert inboxes for emails, skipping addresses a concurrent request has
+    just created (ON CONFLICT (email) DO NOTHING). Returns the emails inserted.
+    """
+    now = datetime.utcnow()
+    expires_at = now + timedelta(hours=settings.MAX_INBOX_LIFETIME_HOURS)
+    dialect_insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    statement = dialect_insert(Inbox.__table__)\
+        .on_conflict_do_nothing(index_elements=["email"])\
+        .returning(Inbox.__table__.c.email)
+    rows = [
+        {"email": email, "created_at": now, "last_activity": now, "expires_at": expires_at}
+        for email in emails
+    ]
+    return set(db.execute(statement, rows).scalars())
+
+def upsert_inboxes(db: Session, emails: List[str]) -> Tuple[dict, int]:
+    """Upsert inboxes for emails in one transaction; returns (email -> InboxResponse, number created)"""
+    existing = find_existing_inboxes(db, emails)
+    
+    # Drop expired inboxes (with their messages, contents and search rows,
+    # as cleanup would) so their addresses can be reused
+    expired_ids = [inbox.id for inbox in existing.values() if not inbox.is_valid()]
+    file_paths, _ = delete_inboxes(db, expired_ids)
+    db.flush()
     
-    # Create new inbox
-    inbox = Inbox(email=email)
-    db.add(inbox)
+    # Racing requests may create the same addresses: whichever inserts
+    # first wins and the others return its inbox instead of failing
+    missing = [email for email in emails if email not in existing or not existing[email].is_valid()]
+    created = insert_inboxes(db, missing) if missing else set()
+    inboxes = {**existing, **find_existing_inboxes(db, missing)}
+    
+    # Serialize before commit so attributes aren't reloaded row by row
+    result = {email: InboxResponse.from_orm(inboxes[email]) for email in emails}
     db.commit()
-    db.refresh(inbox)
+    discard_files(file_paths)
     
-    return InboxResponse.from_orm(inbox)
+    return result, len(created)
 
 @router.get("/{inbox_id}", response_model=InboxResponse)
-async def get_inbox(inbox_id: str, db: Session = Depends(get_db)):
+async def get_inbox(inbox_id: str, db: Session = Depends(get_read_db)):
     """Get inbox details"""
-    inbox = db.query(Inbox).filter(Inbox.id == inbox_id).first()
+    inbox = find_inbox(db, inbox_id)
     
     if not inbox:
         raise HTTPException(status_code=404, detail="Inbox not found")
@@ -58,3 +211,99 @@ async def get_inbox(inbox_id: str, db: Session = Depends(get_db)):
     
     return InboxResponse.from_orm(inbox)
 
+def escape_like(value: str) -> str:
+    """Make % and _ typed by the user match literally in a LIKE pattern"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def find_latest_code(db: Session, inbox_id: str, kind: str, since: Optional[datetime],
+                     sender: Optional[str], subject: Optional[str]) -> Optional[dict]:
+    """Newest message in the inbox with an extracted code (or link) matching the filters"""
+    query = db.query(
+        Message.id, Message.content_id, Message.from_address, Message.subject,
+        Message.received_at, MessageCode.value
+    )\
+        .join(MessageCode, MessageCode.content_id == Message.content_id)\
+        .filter(Message.inbox_id == inbox_id)\
+        .filter(MessageCode.kind == kind)
+    if since is not None:
+        query = query.filter(Message.received_at > since)
+    if sender:
+        query = query.filter(Message.from_address.ilike(f"%{escape_like(sender)}%", escape="\\"))
+    if subject:
+        query = query.filter(Message.subject.ilike(f"%{escape_like(subject)}%", escape="\\"))
+    
+    newest_first = [desc(column) for column in Message.inbox_order(inbox_id)]
+    row = query.order_by(*newest_first, MessageCode.position).first()
+    if row is None:
+        return None
+    
+    candidates = [
+        code.value for code in db.query(MessageCode.value)
+        .filter(MessageCode.content_id == row.content_id, MessageCode.kind == kind)
+        .order_by(MessageCode.position)
+        .all()
+    ]
+    return {
+        "message_id": row.id,
+        "kind": kind,
+        "value": row.value,
+        "candidates": candidates,
+        "from_address": row.from_address,
+        "subject": row.subject,
+        "received_at": row.received_at
+    }
+
+@router.get("/{inbox_id}/latest-code", response_model=dict)
+async def get_latest_code(
+    inbox_id: str,
+    response: Response,
+    kind: str = Query("code", pattern="^(code|link)$"),
+    since: Optional[datetime] = None,
+    sender: Optional[str] = Query(None, max_length=200),
+    subject: Optional[str] = Query(None, max_length=200),
+    wait: int = Query(0, ge=0, le=settings.LATEST_CODE_MAX_WAIT_SECONDS),
+    db: Session = Depends(get_db)
+):
+    """
+    Verification code (or link) of the newest matching message, extracted at
+    ingest. With wait > 0 the request long-polls up to wait seconds for such
+    a message to arrive; 204 when there is none.
+    """
+    inbox = db.query(Inbox).filter(Inbox.id == inbox_id).first()
+    if not inbox:
+        raise HTTPException(status_code=404, detail="Inbox not found")
+    
+    if not inbox.is_valid():
+        raise HTTPException(status_code=410, detail="Inbox has expired")
+    
+    # Record activity (flushed in batches by the activity tracker)
+    touch_inbox(inbox.id)
+    
+    if since is not None and since.tzinfo is not None:
+        # received_at is stored as naive UTC
+        since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    deadline = time.monotonic() + wait
+    # Subscribe before the first lookup so mail stored in between still wakes us
+    event = message_waiters.subscribe(inbox_id)
+    try:
+        while True:
+            event.clear()
+            result = find_latest_code(db, inbox_id, kind, since, sender, subject)
+            if result is not None:
+                # The client will likely open the message next, maybe on another worker
+                pin_client(response)
+                return result
+            
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return Response(status_code=204)
+            
+            # Don't hold a pooled connection while waiting
+            db.close()
+            try:
+                await asyncio.wait_for(event.wait(), timeout=min(remaining, settings.LATEST_CODE_POLL_SECONDS))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        message_waiters.unsubscribe(inbox_id, event)
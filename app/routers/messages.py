@@ -1,9 +1,15 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import Response
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import desc, func
+from sqlalchemy.exc import OperationalError
 from pydantic import BaseModel
-from app.database import get_db
-from app.models import Inbox, Message, Attachment
+from app.models import Message, Attachment
+from app.services.activity_tracker import touch_inbox
+from app.services.message_cache import message_cache
+from app.services.inbox_limits import quotas_enabled
+from app.services.search_index import search_inbox
+from app.services.read_routing import get_read_db, find_inbox, use_primary
 from datetime import datetime
 from typing import List, Optional
 
@@ -30,44 +36,54 @@ async def list_messages(
     inbox_id: str,
     page: int = Query(1, ge=1),
     limit: int = Query(20, ge=1, le=100),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """List messages for an inbox"""
     # Verify inbox exists and is valid
-    inbox = db.query(Inbox).filter(Inbox.id == inbox_id).first()
+    inbox = find_inbox(db, inbox_id)
     if not inbox:
         raise HTTPException(status_code=404, detail="Inbox not found")
     
     if not inbox.is_valid():
         raise HTTPException(status_code=410, detail="Inbox has expired")
     
-    # Update last activity
-    inbox.last_activity = datetime.utcnow()
-    db.commit()
+    # Record activity (flushed in batches by the activity tracker)
+    touch_inbox(inbox.id)
     
     # Get messages with pagination
     offset = (page - 1) * limit
-    messages = db.query(Message).filter(Message.inbox_id == inbox_id)\
-        .order_by(desc(Message.received_at))\
+    messages = db.query(Message)\
+        .options(joinedload(Message.content).undefer_group("body"))\
+        .filter(Message.inbox_id == inbox_id)\
+        .order_by(*[desc(column) for column in Message.inbox_order(inbox_id)])\
         .offset(offset)\
         .limit(limit)\
         .all()
     
-    total = db.query(Message).filter(Message.inbox_id == inbox_id).count()
+    # Maintained on ingest/eviction, so no COUNT over a large inbox
+    total = inbox.message_count
+    
+    # Attachment counts for the whole page in one query
+    content_ids = [msg.content_id for msg in messages]
+    attachment_counts = dict(
+        db.query(Attachment.content_id, func.count(Attachment.id))
+        .filter(Attachment.content_id.in_(content_ids))
+        .group_by(Attachment.content_id)
+        .all()
+    ) if content_ids else {}
     
     # Format response
     message_list = []
     for msg in messages:
-        attachment_count = db.query(Attachment).filter(Attachment.message_id == msg.id).count()
         message_list.append({
             "id": msg.id,
             "from_address": msg.from_address,
             "to_address": msg.to_address,
             "subject": msg.subject,
-            "text_content": msg.text_content,
-            "html_content": msg.html_content,
+            "text_content": msg.content.text_content,
+            "html_content": msg.content.html_content,
             "received_at": msg.received_at,
-            "attachment_count": attachment_count
+            "attachment_count": attachment_counts.get(msg.content_id, 0)
         })
     
     return {
@@ -80,24 +96,62 @@ async def list_messages(
         }
     }
 
-@router.get("/{message_id}", response_model=MessageDetailResponse)
-async def get_message(message_id: str, db: Session = Depends(get_db)):
-    """Get a specific message"""
-    message = db.query(Message).filter(Message.id == message_id).first()
+@router.get("/inbox/{inbox_id}/search", response_model=dict)
+async def search_messages(
+    inbox_id: str,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
+    """Full-text search over an inbox's messages, best matches first"""
+    inbox = find_inbox(db, inbox_id)
+    if not inbox:
+        raise HTTPException(status_code=404, detail="Inbox not found")
+    
+    if not inbox.is_valid():
+        raise HTTPException(status_code=410, detail="Inbox has expired")
     
-    if not message:
-        raise HTTPException(status_code=404, detail="Message not found")
+    # Record activity (flushed in batches by the activity tracker)
+    touch_inbox(inbox.id)
     
-    # Get attachments
-    attachments = db.query(Attachment).filter(Attachment.message_id == message_id).all()
+    try:
+        hits = search_inbox(db, inbox_id, q, limit)
+    except OperationalError:
+        # Query the search engine couldn't parse
+        raise HTTPException(status_code=400, detail="Invalid search query")
     
+    # Message metadata for all hits in one query (bodies stay deferred)
+    messages = {
+        msg.id: msg
+        for msg in db.query(Message).filter(Message.id.in_([hit["message_id"] for hit in hits])).all()
+    } if hits else {}
+    
+    results = []
+    for hit in hits:
+        msg = messages.get(hit["message_id"])
+        if msg is None:
+            continue
+        results.append({
+            "id": msg.id,
+            "from_address": msg.from_address,
+            "to_address": msg.to_address,
+            "subject": msg.subject,
+            "received_at": msg.received_at,
+            "snippet": hit["snippet"],
+            "rank": hit["rank"]
+        })
+    
+    return {"query": q, "results": results}
+
+def render_message_detail(message: Message, attachments: List[Attachment]) -> bytes:
+    """Serialize a message and its attachment metadata to detail JSON"""
     return MessageDetailResponse(
         id=message.id,
         from_address=message.from_address,
         to_address=message.to_address,
         subject=message.subject,
-        text_content=message.text_content,
-        html_content=message.html_content,
+        text_content=message.content.text_content,
+        html_content=message.content.html_content,
         received_at=message.received_at,
         attachment_count=len(attachments),
         attachments=[
@@ -109,5 +163,63 @@ async def get_message(message_id: str, db: Session = Depends(get_db)):
             }
             for att in attachments
         ]
-    )
+    ).model_dump_json().encode("utf-8")
+
+def find_message(db: Session, message_id: str) -> Optional[Message]:
+    """Message with its bodies, looked up again on the primary when a replica doesn't have it yet"""
+    query = db.query(Message)\
+        .options(joinedload(Message.content).undefer_group("body"), joinedload(Message.inbox))\
+        .filter(Message.id == message_id)
+    message = query.first()
+    if message is None and use_primary(db):
+        message = query.first()
+    return message
 
+def message_exists(db: Session, message_id: str) -> bool:
+    """True while the message row exists, looked up again on the primary like find_message"""
+    query = db.query(Message.id).filter(Message.id == message_id)
+    if query.first() is not None:
+        return True
+    return use_primary(db) and query.first() is not None
+
+@router.get("/{message_id}", response_model=MessageDetailResponse)
+async def get_message(message_id: str, request: Request, db: Session = Depends(get_read_db)):
+    """Get a specific message"""
+    cached = message_cache.get(message_id)
+    
+    # Quota eviction in another worker doesn't reach this worker's cache
+    if cached is not None and quotas_enabled() and not message_exists(db, message_id):
+        message_cache.invalidate(message_id)
+        cached = None
+    
+    if cached is None:
+        message = find_message(db, message_id)
+        
+        if not message:
+            raise HTTPException(status_code=404, detail="Message not found")
+        
+        if not message.inbox.is_valid():
+            raise HTTPException(status_code=410, detail="Inbox has expired")
+        
+        # Get attachments
+        attachments = db.query(Attachment).filter(Attachment.content_id == message.content_id).all()
+        
+        cached = message_cache.put(message_id, render_message_detail(message, attachments), message.inbox.expires_at)
+    
+    body, etag, expires_at = cached
+    if quotas_enabled():
+        # Messages may be evicted at any time: clients revalidate (cheap 304s)
+        cache_control = "private, no-cache"
+    else:
+        # Messages are immutable, so clients may keep them until the inbox expires
+        max_age = max(0, int((expires_at - datetime.utcnow()).total_seconds()))
+        cache_control = f"private, max-age={max_age}, immutable"
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control
+    }
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    return Response(content=body, media_type="application/json", headers=headers)
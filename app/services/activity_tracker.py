@@ -0,0 +1,79 @@
+"""
+Coalesced inbox last_activity tracking.
+
+Read endpoints record touches in memory; a background task writes them
+back in one batched UPDATE per database shard so reads don't open write
+transactions.
+"""
+import asyncio
+from datetime import datetime
+from typing import Dict
+from sqlalchemy import update, bindparam
+from app.database import session_for_shard, shard_from_id
+from app.models import Inbox
+from app.config import settings
+
+class ActivityTracker:
+    """Collect inbox touches and flush them to the database in batches"""
+
+    def __init__(self):
+        # Map of inbox_id -> most recent activity time
+        self.pending: Dict[str, datetime] = {}
+
+    def touch(self, inbox_id: str, when: datetime = None):
+        """Record activity for an inbox (no database access)"""
+        self.pending[inbox_id] = when or datetime.utcnow()
+
+    def flush(self) -> int:
+        """Write all pending touches in one executemany UPDATE per shard"""
+        if not self.pending:
+            return 0
+
+        pending, self.pending = self.pending, {}
+
+        by_shard: Dict[int, Dict[str, datetime]] = {}
+        for inbox_id, when in pending.items():
+            by_shard.setdefault(shard_from_id(inbox_id), {})[inbox_id] = when
+        return sum(self.flush_shard(shard, touches) for shard, touches in by_shard.items())
+
+    def flush_shard(self, shard: int, pending: Dict[str, datetime]) -> int:
+        db = session_for_shard(shard)
+        try:
+            stmt = (
+                update(Inbox.__table__)
+                .where(Inbox.__table__.c.id == bindparam("b_id"))
+                .values(last_activity=bindparam("b_last_activity"))
+            )
+            db.execute(stmt, [
+                {"b_id": inbox_id, "b_last_activity": when}
+                for inbox_id, when in pending.items()
+            ])
+            db.commit()
+            return len(pending)
+        except Exception as e:
+            db.rollback()
+            # Keep the touches for the next flush unless newer ones arrived
+            for inbox_id, when in pending.items():
+                if inbox_id not in self.pending:
+                    self.pending[inbox_id] = when
+            print(f"Error flushing inbox activity: {e}")
+            return 0
+        finally:
+            db.close()
+
+tracker = ActivityTracker()
+
+def touch_inbox(inbox_id: str):
+    """Record inbox activity to be flushed later"""
+    tracker.touch(inbox_id)
+
+async def flush_activity_periodically():
+    """Periodically flush coalesced inbox activity"""
+    while True:
+        try:
+            await asyncio.sleep(settings.ACTIVITY_FLUSH_INTERVAL_SECONDS)
+            tracker.flush()
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            print(f"Error in activity flush task: {e}")
@@ -0,0 +1,39 @@
+"""
+Admission control for inbound mail.
+
+Each inbound request holds a whole message in memory while it is parsed
+and stored. The controller caps concurrent requests and the total bytes
+they declare; requests over either limit are turned away with 503 and
+Retry-After so mailpipe exits with EX_TEMPFAIL and the mail waits in
+Postfix's queue instead of in our memory.
+"""
+from app.config import settings
+
+class AdmissionController:
+    """Counts in-flight requests and bytes (event-loop only, no locking)"""
+
+    def __init__(self, max_requests: int, max_bytes: int):
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.requests = 0
+        self.bytes = 0
+
+    def try_acquire(self, size: int) -> bool:
+        """Admit a request of size bytes if both limits allow it"""
+        if self.max_requests and self.requests >= self.max_requests:
+            return False
+        # A single request larger than the byte budget is admitted when idle
+        if self.max_bytes and self.requests and self.bytes + size > self.max_bytes:
+            return False
+        self.requests += 1
+        self.bytes += size
+        return True
+
+    def release(self, size: int):
+        self.requests -= 1
+        self.bytes -= size
+
+inbound_admission = AdmissionController(
+    max_requests=settings.INGEST_MAX_CONCURRENT,
+    max_bytes=settings.INGEST_MAX_INFLIGHT_MB * 1024 * 1024
+)
@@ -1,9 +1,9 @@
-import os
-import uuid
 from pathlib import Path
+from typing import BinaryIO
 from fastapi import UploadFile, HTTPException
 from app.config import settings
 from app.models import Attachment
+from app.services.storage import get_storage, new_storage_key, validate_key
 from sqlalchemy.orm import Session
 
 def sanitize_filename(filename: str) -> str:
@@ -28,15 +28,15 @@ def validate_file_size(size: int) -> bool:
     max_size = settings.MAX_ATTACHMENT_SIZE_MB * 1024 * 1024
     return size <= max_size
 
-async def save_attachment(
+def store_attachment(
     db: Session,
-    message_id: str,
+    content_id: str,
     filename: str,
     content_type: str,
     file_content: bytes
 ) -> Attachment:
     """
-    Save attachment to disk and create database record.
+    Write attachment to storage and add its record to the session without committing.
     Security: Validates file size and sanitizes filename.
     """
     # Security: Validate file size
@@ -50,74 +50,113 @@ async def save_attachment(
     # Security: Sanitize filename
     sanitized_filename = sanitize_filename(filename)
     
-    # Generate unique file path
-    file_id = str(uuid.uuid4())
-    file_ext = Path(sanitized_filename).suffix
-    file_path = os.path.join(settings.ATTACHMENTS_PATH, f"{file_id}{file_ext}")
-    
-    # Security: Ensure path is within attachments directory
-    resolved_path = os.path.realpath(file_path)
-    resolved_dir = os.path.realpath(settings.ATTACHMENTS_PATH)
-    
-    if not resolved_path.startswith(resolved_dir):
-        raise HTTPException(status_code=400, detail="Invalid file path")
+    # Generate unique storage key
+    storage_key = new_storage_key(sanitized_filename)
+    storage = get_storage()
     
     try:
-        # Write file to disk
-        with open(file_path, "wb") as f:
-            f.write(file_content)
+        # Write blob to storage
+        storage.put(storage_key, file_content)
         
         # Create database record
         attachment = Attachment(
-            message_id=message_id,
+            content_id=content_id,
             filename=sanitized_filename,
             content_type=content_type,
             size=len(file_content),
-            file_path=file_path
+            file_path=storage_key
         )
         
         db.add(attachment)
+        return attachment
+    except Exception as e:
+        # Clean up blob if database operation fails
+        storage.delete(storage_key)
+        raise HTTPException(status_code=500, detail=f"Failed to save attachment: {str(e)}")
+
+def register_attachment(
+    db: Session,
+    content_id: str,
+    filename: str,
+    content_type: str,
+    file_path: str,
+    size: int
+) -> Attachment:
+    """
+    Add the record for an attachment blob that was already written to storage
+    (e.g. by the streaming parser) without committing.
+    """
+    # Security: Only accept generated storage keys
+    try:
+        validate_key(file_path)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid file path")
+    
+    attachment = Attachment(
+        content_id=content_id,
+        filename=sanitize_filename(filename),
+        content_type=content_type,
+        size=size,
+        file_path=file_path
+    )
+    
+    db.add(attachment)
+    return attachment
+
+async def save_attachment(
+    db: Session,
+    content_id: str,
+    filename: str,
+    content_type: str,
+    file_content: bytes
+) -> Attachment:
+    """
+    Save attachment to storage and create database record.
+    Security: Validates file size and sanitizes filename.
+    """
+    attachment = store_attachment(db, content_id, filename, content_type, file_content)
+    storage_key = attachment.file_path
+    
+    try:
         db.commit()
         db.refresh(attachment)
-        
         return attachment
     except Exception as e:
-        # Clean up file if database operation fails
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        # Clean up blob if database operation fails
+        get_storage().delete(storage_key)
         raise HTTPException(status_code=500, detail=f"Failed to save attachment: {str(e)}")
 
-def read_attachment_file(attachment: Attachment) -> bytes:
+def open_attachment_stream(attachment: Attachment) -> BinaryIO:
     """
-    Read attachment file from disk.
-    Security: Validates file path to prevent directory traversal.
+    Open attachment blob for streaming reads.
+    Security: The storage backend rejects keys/paths outside its root.
     """
     if not attachment or not attachment.file_path:
         raise HTTPException(status_code=404, detail="Attachment not found")
     
-    # Security: Ensure file path is within attachments directory
-    resolved_path = os.path.realpath(attachment.file_path)
-    resolved_dir = os.path.realpath(settings.ATTACHMENTS_PATH)
-    
-    if not resolved_path.startswith(resolved_dir):
+    try:
+        return get_storage().open(attachment.file_path)
+    except ValueError:
         raise HTTPException(status_code=400, detail="Invalid file path")
-    
-    if not os.path.exists(resolved_path):
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Attachment file not found")
-    
-    with open(resolved_path, "rb") as f:
-        return f.read()
+
+def read_attachment_file(attachment: Attachment) -> bytes:
+    """
+    Read attachment blob from storage.
+    Security: Validates file path to prevent directory traversal.
+    """
+    stream = open_attachment_stream(attachment)
+    try:
+        return stream.read()
+    finally:
+        stream.close()
 
 def delete_attachment_file(attachment: Attachment):
-    """Delete attachment file from disk"""
+    """Delete attachment blob from storage"""
     if attachment and attachment.file_path:
         try:
-            resolved_path = os.path.realpath(attachment.file_path)
-            resolved_dir = os.path.realpath(settings.ATTACHMENTS_PATH)
-            
-            if resolved_path.startswith(resolved_dir) and os.path.exists(resolved_path):
-                os.remove(resolved_path)
+            get_storage().delete(attachment.file_path)
         except Exception as e:
             # Log error but don't fail
             print(f"Error deleting attachment file: {e}")
-
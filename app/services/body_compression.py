@@ -0,0 +1,179 @@
+"""
+Transparent compression for stored message bodies.
+
+Values are stored as bytes with a one-byte codec header:
+
+    \\x01  raw UTF-8 (too small to be worth compressing)
+    \\x02  zlib
+    \\x03  zstd
+    \\x04  zstd with a shared dictionary, followed by the 4-byte dictionary id
+
+zstd needs the optional ``zstandard`` package; without it new values fall
+back to zlib. Dictionaries are trained from stored bodies (``python -m
+app.compress_bodies train``) and kept in the compression_dictionaries table
+so every worker uses the same ones. Rows written before compression (plain
+text) are returned unchanged. Raw emails are encoded straight from their
+spool file with compress_stream, so they never sit in memory uncompressed.
+"""
+import io
+import struct
+import threading
+import zlib
+from typing import Dict, Optional
+from sqlalchemy.types import TypeDecorator, LargeBinary
+from app.config import settings
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Read size when encoding from a file
+STREAM_CHUNK = 64 * 1024
+
+RAW = b"\x01"
+ZLIB = b"\x02"
+ZSTD = b"\x03"
+ZSTD_DICT = b"\x04"
+
+_lock = threading.Lock()
+_dictionaries: Dict[int, "zstandard.ZstdCompressionDict"] = {}
+_loaded = False
+
+def load_dictionaries():
+    """(Re)load shared dictionaries from the database"""
+    global _loaded
+    if zstandard is None:
+        _loaded = True
+        return
+
+    from app.database import SessionLocal
+    from app.models import CompressionDictionary
+
+    db = SessionLocal()
+    try:
+        rows = db.query(CompressionDictionary).all()
+        with _lock:
+            for row in rows:
+                if row.id not in _dictionaries:
+                    _dictionaries[row.id] = zstandard.ZstdCompressionDict(row.data)
+            _loaded = True
+    except Exception as e:
+        # Table may not exist yet (before migrations); compress without a dictionary
+        print(f"Could not load compression dictionaries: {e}")
+        _loaded = True
+    finally:
+        db.close()
+
+def register_dictionary(dict_id: int, data: bytes):
+    """Make a dictionary available without going through the app session"""
+    if zstandard is not None:
+        with _lock:
+            _dictionaries[dict_id] = zstandard.ZstdCompressionDict(bytes(data))
+
+def current_dictionary():
+    """Return (id, dictionary) of the newest dictionary, or (None, None)"""
+    if not _loaded:
+        load_dictionaries()
+    if not _dictionaries:
+        return None, None
+    dict_id = max(_dictionaries)
+    return dict_id, _dictionaries[dict_id]
+
+def compress_text(text: str, use_dictionary: bool = True) -> bytes:
+    """Encode a body for storage"""
+    data = text.encode("utf-8")
+    codec = settings.BODY_COMPRESSION
+
+    if codec == "none" or len(data) < settings.BODY_COMPRESSION_MIN_BYTES:
+        return RAW + data
+
+    if codec == "zstd" and zstandard is not None:
+        dict_id, dictionary = current_dictionary() if use_dictionary else (None, None)
+        if dictionary is not None:
+            compressor = zstandard.ZstdCompressor(level=settings.BODY_COMPRESSION_LEVEL, dict_data=dictionary)
+            return ZSTD_DICT + struct.pack(">I", dict_id) + compressor.compress(data)
+        compressor = zstandard.ZstdCompressor(level=settings.BODY_COMPRESSION_LEVEL)
+        return ZSTD + compressor.compress(data)
+
+    return ZLIB + zlib.compress(data, min(settings.BODY_COMPRESSION_LEVEL, 9))
+
+def compress_stream(stream, size: int) -> bytes:
+    """Encode size bytes of a binary file (raw email bytes, not text) for storage"""
+    codec = settings.BODY_COMPRESSION
+
+    if codec == "none" or size < settings.BODY_COMPRESSION_MIN_BYTES:
+        return RAW + stream.read(size)
+
+    if codec == "zstd" and zstandard is not None:
+        dict_id, dictionary = current_dictionary()
+        out = io.BytesIO()
+        if dictionary is not None:
+            out.write(ZSTD_DICT + struct.pack(">I", dict_id))
+            compressor = zstandard.ZstdCompressor(level=settings.BODY_COMPRESSION_LEVEL, dict_data=dictionary)
+        else:
+            out.write(ZSTD)
+            compressor = zstandard.ZstdCompressor(level=settings.BODY_COMPRESSION_LEVEL)
+        # The size goes into the frame header, as compress() does
+        compressor.copy_stream(stream, out, size=size)
+        return out.getvalue()
+
+    compressor = zlib.compressobj(min(settings.BODY_COMPRESSION_LEVEL, 9))
+    chunks = [ZLIB]
+    while size > 0:
+        chunk = stream.read(min(STREAM_CHUNK, size))
+        if not chunk:
+            break
+        size -= len(chunk)
+        chunks.append(compressor.compress(chunk))
+    chunks.append(compressor.flush())
+    return b"".join(chunks)
+
+def decompress_text(value) -> Optional[str]:
+    """Decode a stored body (compressed bytes or legacy plain text)"""
+    if value is None or isinstance(value, str):
+        return value
+
+    value = bytes(value)
+    header, payload = value[:1], value[1:]
+
+    if header == RAW:
+        data = payload
+    elif header == ZLIB:
+        data = zlib.decompress(payload)
+    elif header in (ZSTD, ZSTD_DICT):
+        if zstandard is None:
+            raise RuntimeError("Stored body is zstd-compressed but zstandard is not installed")
+        if header == ZSTD_DICT:
+            (dict_id,) = struct.unpack(">I", payload[:4])
+            payload = payload[4:]
+            if dict_id not in _dictionaries:
+                load_dictionaries()
+            if dict_id not in _dictionaries:
+                raise RuntimeError(f"Unknown compression dictionary {dict_id}")
+            decompressor = zstandard.ZstdDecompressor(dict_data=_dictionaries[dict_id])
+        else:
+            decompressor = zstandard.ZstdDecompressor()
+        data = decompressor.decompress(payload)
+    else:
+        # Legacy row migrated as raw bytes
+        data = value
+
+    return data.decode("utf-8", errors="ignore")
+
+class CompressedText(TypeDecorator):
+    """Text column stored compressed; (de)compression happens on bind/load"""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, bytes):
+            # Already encoded by compress_stream
+            return value
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
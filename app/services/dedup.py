@@ -0,0 +1,93 @@
+"""
+Idempotent ingest.
+
+When mailpipe times out after the backend committed, Postfix delivers the
+same email again. Every stored delivery records a key
+
+    sha256(Message-ID, recipient, sha256(body))
+
+in ingest_dedup_keys (emails without a Message-ID hash the whole raw
+message instead of the body). Redeliveries are recognised from the header
+block and a hash of the raw bytes (read from the spooled file in chunks),
+before any parsing, attachment writes
+or broadcasts. Keys expire with the inbox lifetime.
+"""
+import hashlib
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+from sqlalchemy.orm import Session
+from app.database import session_for_shard
+from app.models import IngestDedupKey
+from app.services.shards import group_by_shard
+from app.config import settings
+
+# Read size when hashing a raw email
+HASH_CHUNK = 64 * 1024
+
+def hash_from(stream, offset: int) -> str:
+    """sha256 of a binary file from offset to its end"""
+    stream.seek(offset)
+    digest = hashlib.sha256()
+    while True:
+        chunk = stream.read(HASH_CHUNK)
+        if not chunk:
+            break
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def compute_dedup_keys(headers, stream, start: int, body_start: int, recipients: List[str]) -> Dict[str, str]:
+    """
+    Map each recipient to its dedup key. stream holds the raw email from
+    offset start, its body from body_start (headers from read_header_block).
+    """
+    message_id = str(headers.get("Message-ID", "")).strip()
+    body_hash = hash_from(stream, body_start if message_id else start)
+    return {
+        recipient: hashlib.sha256(f"{message_id}\n{recipient}\n{body_hash}".encode("utf-8")).hexdigest()
+        for recipient in recipients
+    }
+
+def find_duplicate_keys(db: Session, keys: List[str]) -> set:
+    """Return the keys that were already stored and have not expired"""
+    if not keys:
+        return set()
+    rows = db.query(IngestDedupKey.key)\
+        .filter(IngestDedupKey.key.in_(keys))\
+        .filter(IngestDedupKey.expires_at > datetime.utcnow())\
+        .all()
+    return {row.key for row in rows}
+
+def filter_duplicates(keys: Dict[str, str]) -> Tuple[Dict[str, str], int]:
+    """
+    Header-stage check. Returns the dedup keys of recipients that have not
+    received this email yet, and how many recipients already had it.
+    """
+    if not keys:
+        return {}, 0
+
+    # Keys are stored on the shard of the recipient's inbox
+    duplicates = set()
+    for shard, recipients in group_by_shard(keys).items():
+        db = session_for_shard(shard)
+        try:
+            duplicates |= find_duplicate_keys(db, [keys[recipient] for recipient in recipients])
+        finally:
+            db.close()
+
+    remaining = {recipient: key for recipient, key in keys.items() if key not in duplicates}
+    return remaining, len(keys) - len(remaining)
+
+def record_dedup_key(db: Session, key: str):
+    """Add a dedup key to the ingest transaction"""
+    now = datetime.utcnow()
+    db.add(IngestDedupKey(
+        key=key,
+        created_at=now,
+        expires_at=now + timedelta(hours=settings.MAX_INBOX_LIFETIME_HOURS)
+    ))
+
+def delete_expired_keys(db: Session) -> int:
+    """Remove expired dedup keys (run by cleanup)"""
+    return db.query(IngestDedupKey)\
+        .filter(IngestDedupKey.expires_at < datetime.utcnow())\
+        .delete(synchronize_session=False)
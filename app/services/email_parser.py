@@ -1,7 +1,16 @@
 from email import message_from_bytes
-from email.utils import parseaddr
+from email.parser import BytesHeaderParser
+from email.utils import parseaddr, getaddresses
 from email.header import decode_header
-import base64
+from html import unescape
+from html.parser import HTMLParser
+import binascii
+import io
+import re
+from app.config import settings
+from app.services.body_compression import compress_stream
+from app.services.attachment_service import sanitize_filename
+from app.services.storage import get_storage, new_storage_key
 
 def decode_mime_header(header_value):
     """Decode MIME header values"""
@@ -17,6 +26,136 @@ def decode_mime_header(header_value):
             decoded_string += part
     return decoded_string
 
+def extract_recipients(headers) -> list:
+    """
+    Collect recipient addresses from To, Cc and Delivered-To, lowercased and
+    de-duplicated in order. Bcc recipients only appear in the envelope.
+    """
+    values = []
+    for name in ("To", "Cc", "Delivered-To"):
+        values.extend(str(value) for value in headers.get_all(name, []))
+    
+    recipients = []
+    for _, address in getaddresses(values):
+        address = address.lower().strip()
+        if address and address not in recipients:
+            recipients.append(address)
+    return recipients
+
+def as_binary_stream(source):
+    """Raw email bytes as a file; binary files (e.g. spooled uploads) pass through"""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return source
+
+def read_header_block(stream):
+    """Parse only the top-level headers of a binary file, leaving it at the start of the body"""
+    lines = []
+    while True:
+        line = stream.readline(StreamingEmailParser.MAX_LINE)
+        if not line or line in (b"\r\n", b"\n"):
+            break
+        lines.append(line)
+    return BytesHeaderParser().parsebytes(b"".join(lines))
+
+class HTMLTextExtractor(HTMLParser):
+    """Collect visible text from HTML, skipping scripts and styles"""
+    
+    SKIP = {"script", "style", "head", "title"}
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self.skipping += 1
+    
+    def handle_endtag(self, tag):
+        if tag in self.SKIP and self.skipping:
+            self.skipping -= 1
+    
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+def html_to_text(html: str) -> str:
+    """Plain text of an HTML body, whitespace collapsed"""
+    extractor = HTMLTextExtractor()
+    try:
+        extractor.feed(html)
+        extractor.close()
+    except Exception:
+        # Malformed markup: fall back to stripping tags
+        return re.sub(r"\s+", " ", re.sub(r"<[^>]+>", " ", html)).strip()
+    return re.sub(r"\s+", " ", " ".join(extractor.parts)).strip()
+
+# Verification codes and links, extracted once at ingest
+MAX_CODES = 5
+MAX_LINKS = 10
+CODE_KEYWORD_DISTANCE = 60
+CODE_KEYWORD_RE = re.compile(
+    r"(code|otp|pin|passcode|password|verification|verify|confirm|token|one[- ]time)", re.IGNORECASE
+)
+# Plain 4-8 digit numbers, "123 456" / "123-456", or 6-8 char mixed letter+digit codes
+CODE_RE = re.compile(r"\b(\d{3}[- ]\d{3}|\d{4,8}|(?=[A-Z]*\d)(?=\d*[A-Z])[A-Z\d]{6,8})\b")
+SENTENCE_BREAK_RE = re.compile(r"[.!?](\s|$)|\n")
+YEAR_RE = re.compile(r"(19|20)\d\d")
+URL_RE = re.compile(r"https?://[^\s<>\"'()\[\]]+", re.IGNORECASE)
+HREF_RE = re.compile(r"""href\s*=\s*["']?(https?://[^"'\s>]+)""", re.IGNORECASE)
+LINK_KEYWORD_RE = re.compile(
+    r"(verify|verification|confirm|activat|validat|token|reset|magic|login|log-in|signin|sign-in|auth|otp)",
+    re.IGNORECASE
+)
+IMAGE_LINK_RE = re.compile(r"\.(png|jpe?g|gif|svg|webp|ico)(\?|$)", re.IGNORECASE)
+
+def extract_codes(texts) -> list:
+    """
+    Candidate one-time codes, most likely first: codes in the same sentence
+    as a keyword like "code" or "OTP" ("Your code: 123456", "123456 is your
+    code"), closest first, then other standalone 4-8 digit numbers.
+    """
+    near, other = [], []
+    for value in texts:
+        if not value:
+            continue
+        # Numbers inside URLs are ids and tracking parameters, not codes
+        value = URL_RE.sub(" ", value)
+        keywords = [match.span() for match in CODE_KEYWORD_RE.finditer(value)]
+        for match in CODE_RE.finditer(value):
+            candidate = match.group(1)
+            code = re.sub(r"[- ]", "", candidate)
+            gaps = [
+                value[end:match.start()] if end <= match.start() else value[match.end():start]
+                for start, end in keywords
+                if end <= match.start() or start >= match.end()
+            ]
+            gaps = [len(gap) for gap in gaps if len(gap) <= CODE_KEYWORD_DISTANCE and not SENTENCE_BREAK_RE.search(gap)]
+            if gaps:
+                near.append((min(gaps), code))
+            elif candidate.isdigit() and not YEAR_RE.fullmatch(candidate):
+                other.append(code)
+    near = [code for _, code in sorted(near, key=lambda item: item[0])]
+    return list(dict.fromkeys(near + other))[:MAX_CODES]
+
+def extract_links(text_content: str, html_content: str) -> list:
+    """Links from the text body and HTML hrefs; verification-looking links first"""
+    links = URL_RE.findall(text_content or "")
+    links += [unescape(link) for link in HREF_RE.findall(html_content or "")]
+    links = [link.rstrip(".,;:!?") for link in links]
+    links = [link for link in dict.fromkeys(links) if not IMAGE_LINK_RE.search(link)]
+    links.sort(key=lambda link: not LINK_KEYWORD_RE.search(link))
+    return links[:MAX_LINKS]
+
+def extract_verification(subject: str, text_content: str, html_content: str) -> dict:
+    """Candidate OTP codes and links of an email: {"codes": [...], "links": [...]}"""
+    body = text_content or (html_to_text(html_content) if html_content else "")
+    return {
+        "codes": extract_codes([subject, body]),
+        "links": extract_links(text_content, html_content)
+    }
+
 def parse_email(raw_email: bytes) -> dict:
     """
     Parse raw email bytes into structured format.
@@ -82,10 +221,325 @@ def parse_email(raw_email: bytes) -> dict:
     return {
         "from_address": from_addr,
         "to_address": to_addr,
+        "recipients": extract_recipients(msg),
         "subject": subject,
         "text_content": text_content,
         "html_content": html_content,
+        "verification": extract_verification(subject, text_content, html_content),
         "attachments": attachments,
-        "raw_message": raw_email.decode("utf-8", errors="ignore")
+        "raw_message": raw_email.decode("utf-8", errors="ignore"),
+        # Bytes charged to the inbox quota
+        "size": len(raw_email)
     }
 
+
+class NullSink:
+    """Discard part content"""
+    
+    def write(self, data: bytes):
+        pass
+    
+    def close(self):
+        pass
+
+class TextSink:
+    """Collect a text body in memory and decode it on close"""
+    
+    def __init__(self, encoding: str, charset: str):
+        self.encoding = encoding
+        self.charset = charset
+        self.chunks = []
+        self.text = ""
+    
+    def write(self, data: bytes):
+        self.chunks.append(data)
+    
+    def close(self):
+        payload = b"".join(self.chunks)
+        try:
+            if self.encoding == "base64":
+                payload = binascii.a2b_base64(payload)
+            elif self.encoding == "quoted-printable":
+                payload = binascii.a2b_qp(payload)
+        except (binascii.Error, ValueError):
+            pass
+        try:
+            self.text = payload.decode(self.charset, errors="ignore")
+        except LookupError:
+            self.text = payload.decode("utf-8", errors="ignore")
+
+class AttachmentSink:
+    """
+    Decode a base64 / quoted-printable / raw part in chunks straight into
+    attachment storage.
+    """
+    
+    def __init__(self, encoding: str, file_path: str, max_size: int):
+        self.encoding = encoding
+        self.file_path = file_path
+        self.max_size = max_size
+        self.writer = get_storage().writer(file_path)
+        self.closed = False
+        self.pending = b""
+        self.size = 0
+        self.oversized = False
+    
+    def write(self, data: bytes):
+        if self.encoding == "base64":
+            # Decode whole 4-character groups, carry the rest
+            self.pending += b"".join(data.split())
+            usable = len(self.pending) - len(self.pending) % 4
+            chunk, self.pending = self.pending[:usable], self.pending[usable:]
+            self.emit(self.decode_base64(chunk))
+        elif self.encoding == "quoted-printable":
+            # Decode complete lines so soft line breaks are handled
+            self.pending += data
+            cut = self.pending.rfind(b"\n") + 1
+            if cut:
+                chunk, self.pending = self.pending[:cut], self.pending[cut:]
+                self.emit(binascii.a2b_qp(chunk))
+        else:
+            self.emit(data)
+    
+    def decode_base64(self, chunk: bytes) -> bytes:
+        try:
+            return binascii.a2b_base64(chunk)
+        except binascii.Error:
+            return b""
+    
+    def emit(self, decoded: bytes):
+        if not decoded or self.oversized:
+            return
+        self.size += len(decoded)
+        if self.size > self.max_size:
+            self.oversized = True
+            return
+        self.writer.write(decoded)
+    
+    def close(self):
+        if self.pending:
+            if self.encoding == "base64":
+                self.emit(self.decode_base64(self.pending + b"=" * (-len(self.pending) % 4)))
+            else:
+                self.emit(binascii.a2b_qp(self.pending))
+            self.pending = b""
+        if self.oversized or self.size == 0:
+            # Nothing worth keeping
+            self.writer.abort()
+        else:
+            self.writer.commit()
+        self.closed = True
+    
+    def discard(self):
+        if not self.closed:
+            self.writer.abort()
+            self.closed = True
+        else:
+            get_storage().delete(self.file_path)
+
+class StreamingEmailParser:
+    """
+    Incremental MIME parser built on a boundary scanner.
+    
+    Reads the message line by line and keeps only headers and text/html
+    bodies in memory. Attachment parts are decoded in chunks directly into
+    attachment storage, so memory per message stays bounded regardless of
+    attachment count and size.
+    """
+    
+    MAX_LINE = 64 * 1024
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.text_content = ""
+        self.html_content = ""
+        self.attachments = []
+        self.sinks = []
+    
+    def readline(self) -> bytes:
+        line = self.stream.readline(self.MAX_LINE)
+        if line.endswith(b"\r"):
+            # A long line cut between CR and LF: keep the line break whole,
+            # or the CR would be written as content before a delimiter
+            following = self.stream.read(1)
+            if following == b"\n":
+                line += following
+            elif following:
+                self.stream.seek(-1, io.SEEK_CUR)
+        return line
+    
+    def read_headers(self):
+        """Read a header block up to the blank line"""
+        return read_header_block(self.stream)
+    
+    def match_boundary(self, line: bytes, boundaries):
+        """Return (boundary, is_close) if line is a delimiter for any open boundary"""
+        if not line.startswith(b"--"):
+            return None
+        stripped = line.rstrip(b"\r\n").rstrip(b" \t")
+        for boundary in reversed(boundaries):
+            if stripped == b"--" + boundary:
+                return boundary, False
+            if stripped == b"--" + boundary + b"--":
+                return boundary, True
+        return None
+    
+    def skip_to_boundary(self, boundaries):
+        """Skip preamble/epilogue lines until a delimiter or EOF"""
+        while True:
+            line = self.readline()
+            if not line:
+                return None
+            match = self.match_boundary(line, boundaries)
+            if match:
+                return match
+    
+    def parse_entity(self, headers, boundaries):
+        """
+        Parse the body of an entity whose headers were already read.
+        Returns the delimiter that ended it (or None at EOF).
+        """
+        content_type = headers.get_content_type()
+        boundary = headers.get_boundary()
+        
+        if content_type.startswith("multipart/") and boundary:
+            boundary = boundary.encode("utf-8", errors="ignore")
+            inner = boundaries + [boundary]
+            match = self.skip_to_boundary(inner)
+            while match:
+                found, is_close = match
+                if found != boundary:
+                    # An outer boundary closed this multipart early
+                    return match
+                if is_close:
+                    return self.skip_to_boundary(boundaries)
+                match = self.parse_entity(self.read_headers(), inner)
+            return None
+        
+        sink = self.open_sink(headers)
+        pending_eol = b""
+        match = None
+        at_line_start = True
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            if at_line_start:
+                match = self.match_boundary(line, boundaries)
+                if match:
+                    break
+            # The line break before a delimiter belongs to the delimiter
+            if line.endswith(b"\r\n"):
+                content, eol = line[:-2], b"\r\n"
+            elif line.endswith(b"\n"):
+                content, eol = line[:-1], b"\n"
+            else:
+                content, eol = line, b""
+            sink.write(pending_eol + content)
+            pending_eol = eol
+            at_line_start = bool(eol)
+        
+        if not boundaries:
+            # Single part message: keep the final line break
+            sink.write(pending_eol)
+        sink.close()
+        self.finish_sink(sink, headers)
+        return match
+    
+    def open_sink(self, headers):
+        content_type = headers.get_content_type()
+        content_disposition = str(headers.get("Content-Disposition", ""))
+        encoding = str(headers.get("Content-Transfer-Encoding", "")).strip().lower()
+        
+        if "attachment" in content_disposition:
+            filename = headers.get_filename()
+            if not filename:
+                return NullSink()
+            sink = AttachmentSink(
+                encoding,
+                new_storage_key(sanitize_filename(decode_mime_header(filename))),
+                settings.MAX_ATTACHMENT_SIZE_MB * 1024 * 1024
+            )
+            self.sinks.append(sink)
+            return sink
+        
+        if content_type in ("text/plain", "text/html"):
+            return TextSink(encoding, headers.get_content_charset() or "utf-8")
+        
+        return NullSink()
+    
+    def finish_sink(self, sink, headers):
+        if isinstance(sink, TextSink):
+            if sink.text:
+                if headers.get_content_type() == "text/html":
+                    self.html_content = sink.text
+                else:
+                    self.text_content = sink.text
+        elif isinstance(sink, AttachmentSink):
+            if sink.oversized or sink.size == 0:
+                if sink.oversized:
+                    print(f"Skipping attachment over {settings.MAX_ATTACHMENT_SIZE_MB}MB")
+                return
+            self.attachments.append({
+                "filename": decode_mime_header(headers.get_filename()),
+                "content_type": headers.get_content_type(),
+                "file_path": sink.file_path,
+                "size": sink.size
+            })
+    
+    def parse(self) -> dict:
+        try:
+            headers = self.read_headers()
+            if headers.get_content_type().startswith("multipart/") and headers.get_boundary():
+                self.parse_entity(headers, [])
+            else:
+                # Single part message: non-HTML bodies are treated as text
+                sink = TextSink(
+                    str(headers.get("Content-Transfer-Encoding", "")).strip().lower(),
+                    headers.get_content_charset() or "utf-8"
+                )
+                while True:
+                    chunk = self.stream.read(self.MAX_LINE)
+                    if not chunk:
+                        break
+                    sink.write(chunk)
+                sink.close()
+                if headers.get_content_type() == "text/html":
+                    self.html_content = sink.text
+                else:
+                    self.text_content = sink.text
+        except Exception:
+            # Don't leave half-written attachment files behind
+            for sink in self.sinks:
+                sink.discard()
+            raise
+        
+        subject = decode_mime_header(headers.get("Subject", ""))
+        return {
+            "from_address": parseaddr(headers.get("From", ""))[1] or "unknown@unknown.com",
+            "to_address": parseaddr(headers.get("To", ""))[1] or "",
+            "recipients": extract_recipients(headers),
+            "subject": subject,
+            "text_content": self.text_content,
+            "html_content": self.html_content,
+            "verification": extract_verification(subject, self.text_content, self.html_content),
+            "attachments": self.attachments
+        }
+
+def parse_email_streaming(source) -> dict:
+    """
+    Parse a raw email (bytes, or a binary file positioned at its start)
+    with the streaming parser.
+    Attachments are written to storage while parsing and returned as
+    {"filename", "content_type", "file_path", "size"} instead of content.
+    The raw message is returned already encoded for storage, read from the
+    file again rather than kept in memory.
+    """
+    stream = as_binary_stream(source)
+    start = stream.tell()
+    parsed = StreamingEmailParser(stream).parse()
+    size = stream.seek(0, io.SEEK_END) - start
+    stream.seek(start)
+    parsed["raw_message"] = compress_stream(stream, size)
+    parsed["size"] = size
+    return parsed
@@ -0,0 +1,170 @@
+"""
+Per-inbox flood protection.
+
+- Rate: an in-memory token bucket per recipient address (per worker
+  process) checked before parsing, charged only for existing inboxes and
+  mail that isn't a redelivered copy; mail over the rate is deferred with
+  a temporary failure so the sender retries.
+- Quotas: each inbox keeps a message count and byte total. When an ingest
+  pushes an inbox over INBOX_MAX_MESSAGES or INBOX_MAX_MB, its oldest
+  messages are evicted, together with shared contents and attachment
+  blobs no other inbox still references.
+"""
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+from sqlalchemy.orm import Session
+from app.models import Inbox, Message, MessageContent, MessageCode, Attachment
+from app.services.message_cache import message_cache
+from app.services import search_index
+from app.config import settings
+
+class TokenBucketLimiter:
+    """Token buckets keyed by string, refilled continuously"""
+
+    def __init__(self, rate_per_minute: int, burst: int, max_keys: int = 100000):
+        self.rate = rate_per_minute / 60
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        # key -> (tokens, last update)
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+
+    def allow(self, key: str) -> bool:
+        """Take one token for key; False when the bucket is empty"""
+        if self.rate <= 0:
+            return True
+
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= 1
+            self.buckets[key] = (tokens - 1 if allowed else tokens, now)
+
+            if len(self.buckets) > self.max_keys:
+                self.prune(now)
+            return allowed
+
+    def prune(self, now: float):
+        """Forget buckets that have refilled; they hold no state"""
+        self.buckets = {
+            key: (tokens, updated)
+            for key, (tokens, updated) in self.buckets.items()
+            if tokens + (now - updated) * self.rate < self.burst
+        }
+        if len(self.buckets) > self.max_keys:
+            # Still too many active senders; fail open rather than grow
+            self.buckets.clear()
+
+inbox_rate_limiter = TokenBucketLimiter(
+    rate_per_minute=settings.INBOX_RATE_LIMIT_PER_MINUTE,
+    burst=settings.INBOX_RATE_LIMIT_BURST
+)
+
+def filter_rate_limited(recipients: Iterable[str]) -> List[str]:
+    """Return the recipients still within their ingest rate"""
+    return [recipient for recipient in recipients if inbox_rate_limiter.allow(recipient)]
+
+def quotas_enabled() -> bool:
+    """True when messages can be evicted to keep inboxes under quota"""
+    return bool(settings.INBOX_MAX_MESSAGES or settings.INBOX_MAX_MB)
+
+def charge_inboxes(db: Session, inbox_ids: List[str], size: int):
+    """Count one new message of size bytes against each inbox"""
+    db.query(Inbox).filter(Inbox.id.in_(inbox_ids)).update({
+        Inbox.message_count: Inbox.message_count + 1,
+        Inbox.stored_bytes: Inbox.stored_bytes + size
+    }, synchronize_session=False)
+
+def enforce_quotas(db: Session, inbox_ids: List[str], keep_ids: Iterable[str]) -> List[str]:
+    """
+    Evict the oldest messages of inboxes over quota (never keep_ids).
+    Returns attachment file paths to delete once the transaction commits.
+    """
+    if not quotas_enabled():
+        return []
+    max_messages = settings.INBOX_MAX_MESSAGES
+    max_bytes = settings.INBOX_MAX_MB * 1024 * 1024
+
+    usage = db.query(Inbox.id, Inbox.message_count, Inbox.stored_bytes)\
+        .filter(Inbox.id.in_(inbox_ids))\
+        .all()
+
+    keep_ids = list(keep_ids)
+    file_paths = []
+    for inbox_id, message_count, stored_bytes in usage:
+        excess_count = message_count - max_messages if max_messages else 0
+        excess_bytes = stored_bytes - max_bytes if max_bytes else 0
+        if excess_count > 0 or excess_bytes > 0:
+            file_paths.extend(evict_oldest(db, inbox_id, excess_count, excess_bytes, keep_ids))
+    return file_paths
+
+def evict_oldest(db: Session, inbox_id: str, excess_count: int, excess_bytes: int,
+                 keep_ids: List[str], page_size: int = 200) -> List[str]:
+    """Delete oldest messages until excess_count messages and excess_bytes are freed"""
+    evicted: List[Tuple[str, str]] = []
+    freed = 0
+    offset = 0
+
+    while len(evicted) < excess_count or freed < excess_bytes:
+        rows = db.query(Message.id, Message.content_id, Message.size)\
+            .filter(Message.inbox_id == inbox_id)\
+            .filter(Message.id.notin_(keep_ids))\
+            .order_by(*Message.inbox_order(inbox_id))\
+            .offset(offset)\
+            .limit(page_size)\
+            .all()
+        if not rows:
+            break
+        for message_id, content_id, size in rows:
+            if len(evicted) >= excess_count and freed >= excess_bytes:
+                break
+            evicted.append((message_id, content_id))
+            freed += size or 0
+        offset += len(rows)
+
+    if not evicted:
+        return []
+
+    message_ids = [message_id for message_id, _ in evicted]
+    for message_id in message_ids:
+        message_cache.invalidate(message_id)
+    db.query(Message).filter(Message.id.in_(message_ids)).delete(synchronize_session=False)
+    search_index.delete_messages(db, message_ids)
+    db.query(Inbox).filter(Inbox.id == inbox_id).update({
+        Inbox.message_count: Inbox.message_count - len(evicted),
+        Inbox.stored_bytes: Inbox.stored_bytes - freed
+    }, synchronize_session=False)
+
+    print(f"Inbox {inbox_id} over quota: evicted {len(evicted)} oldest messages ({freed} bytes)")
+    return delete_orphaned_contents(db, {content_id for _, content_id in evicted})
+
+def delete_orphaned_contents(db: Session, content_ids: Iterable[str]) -> List[str]:
+    """
+    Delete contents (and attachment and code rows) no message references anymore.
+    Returns the attachment file paths; the caller removes the blobs.
+    """
+    content_ids = list(content_ids)
+    if not content_ids:
+        return []
+
+    db.flush()
+    orphaned = [
+        row.id for row in db.query(MessageContent.id)
+        .filter(MessageContent.id.in_(content_ids))
+        .filter(~MessageContent.messages.any())
+        .all()
+    ]
+    if not orphaned:
+        return []
+
+    file_paths = [
+        row.file_path for row in db.query(Attachment.file_path)
+        .filter(Attachment.content_id.in_(orphaned))
+        .all()
+    ]
+    db.query(Attachment).filter(Attachment.content_id.in_(orphaned)).delete(synchronize_session=False)
+    db.query(MessageCode).filter(MessageCode.content_id.in_(orphaned)).delete(synchronize_session=False)
+    db.query(MessageContent).filter(MessageContent.id.in_(orphaned)).delete(synchronize_session=False)
+    return file_paths
@@ -0,0 +1,355 @@
+"""
+Shared persistence pipeline for inbound mail.
+
+Everything that stores a parsed email (the HTTP endpoint, the group-commit
+writer, the spool workers) goes through persist_parsed_email so lookup and
+insert rules stay in one place. Callers own the transaction.
+
+Recipients on different database shards get one part (and transaction)
+per shard; see shard_parts.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy.orm import Session
+from app.database import session_for_shard
+from app.models import Inbox, Message, MessageContent, MessageCode
+from app.services.attachment_service import store_attachment, register_attachment
+from app.services.storage import get_storage, new_storage_key, iter_chunks
+from app.services.email_parser import as_binary_stream, read_header_block, extract_recipients
+from app.services.dedup import compute_dedup_keys, filter_duplicates, find_duplicate_keys, record_dedup_key
+from app.services.inbox_limits import filter_rate_limited, charge_inboxes, enforce_quotas
+from app.services.search_index import index_messages, searchable_body
+from app.services.shards import group_by_shard
+from app.services.metrics import inbound_messages_total, attachment_bytes
+from app.services.tracing import stage, current_trace
+from app.config import settings
+
+def persist_parsed_email(db: Session, parsed: dict) -> Optional[dict]:
+    """
+    Add a parsed email and its attachments to the session without committing.
+    The body and attachments are stored once and every valid recipient inbox
+    gets a lightweight Message pointing at them. Returns None when no
+    recipient inbox is known and valid, otherwise a dict with the
+    (inbox_id, message_id) deliveries and the attachment file paths written.
+    Files already written by the streaming parser stay owned by the caller
+    until the transaction commits. Why nothing was stored is left in
+    parsed["drop_reason"] for the metrics.
+    """
+    addresses = recipient_addresses(parsed)
+    
+    with stage("lookup"):
+        # Find all recipient inboxes in one query
+        known = db.query(Inbox).filter(Inbox.email.in_(addresses)).all() if addresses else []
+        inboxes = sorted((inbox for inbox in known if inbox.is_valid()), key=lambda inbox: addresses.index(inbox.email))
+        
+        dedup_keys = parsed.get("dedup_keys") or {}
+        if dedup_keys and inboxes:
+            # Final check inside the transaction (keys added earlier in a group
+            # commit are already flushed): catches copies that raced past the
+            # header-stage check
+            duplicates = find_duplicate_keys(db, [dedup_keys[inbox.email] for inbox in inboxes if inbox.email in dedup_keys])
+            inboxes = [inbox for inbox in inboxes if dedup_keys.get(inbox.email) not in duplicates]
+    
+    if not inboxes:
+        if not known:
+            parsed["drop_reason"] = "dropped_unknown_recipient"
+        elif not any(inbox.is_valid() for inbox in known):
+            parsed["drop_reason"] = "dropped_expired"
+        else:
+            parsed["drop_reason"] = "dropped_duplicate"
+        discard_parsed_files(parsed)
+        return None
+    
+    with stage("store"):
+        messages, content = store_messages(db, parsed, inboxes, dedup_keys)
+    
+    with stage("attachments"):
+        file_paths = store_attachments(db, parsed, content.id)
+    
+    with stage("quota"):
+        # Per-inbox quotas: evict the oldest messages of inboxes now over their limits
+        inbox_ids = [inbox.id for inbox in inboxes]
+        charge_inboxes(db, inbox_ids, parsed["size"])
+        evicted_file_paths = enforce_quotas(db, inbox_ids, keep_ids=[message.id for message in messages])
+    
+    return {
+        "deliveries": [(message.inbox_id, message.id) for message in messages],
+        "file_paths": file_paths,
+        "evicted_file_paths": evicted_file_paths
+    }
+
+def store_messages(db: Session, parsed: dict, inboxes: List[Inbox], dedup_keys: Dict[str, str]) -> Tuple[List[Message], MessageContent]:
+    """Add the shared content, one Message per inbox, dedup keys, search rows and codes"""
+    # Shared content record
+    content = MessageContent(
+        text_content=parsed["text_content"],
+        html_content=parsed["html_content"],
+        raw_message=parsed["raw_message"]
+    )
+    db.add(content)
+    
+    # One message reference per recipient inbox
+    size = parsed["size"]
+    # Sub-second timestamp so same-second messages keep their order for
+    # listing and oldest-first eviction
+    received_at = datetime.utcnow()
+    trace = current_trace.get()
+    messages = [
+        Message(
+            inbox_id=inbox.id,
+            content=content,
+            from_address=parsed["from_address"],
+            to_address=inbox.email,
+            subject=parsed["subject"],
+            size=size,
+            received_at=received_at,
+            trace_id=trace.trace_id if trace else None
+        )
+        for inbox in inboxes
+    ]
+    db.add_all(messages)
+    
+    # Remember the deliveries so a redelivery of this email is dropped
+    for inbox in inboxes:
+        if inbox.email in dedup_keys:
+            record_dedup_key(db, dedup_keys[inbox.email])
+    
+    db.flush()  # Get content.id and message ids
+    
+    # Full-text search rows, committed together with the messages
+    index_messages(
+        db, messages, parsed["subject"], parsed["from_address"],
+        searchable_body(parsed["text_content"], parsed["html_content"])
+    )
+    
+    # OTP codes and links found by the parser, for /latest-code lookups
+    verification = parsed.get("verification") or {}
+    db.add_all(
+        MessageCode(content_id=content.id, kind=kind, value=value, position=position)
+        for kind, key in (("code", "codes"), ("link", "links"))
+        for position, value in enumerate(verification.get(key, []))
+    )
+    
+    return messages, content
+
+def store_attachments(db: Session, parsed: dict, content_id: str) -> List[str]:
+    """Save attachments once for all recipients; returns the files written here"""
+    file_paths = []
+    for att in parsed["attachments"]:
+        try:
+            if "file_path" in att:
+                # Already written to storage by the streaming parser
+                register_attachment(
+                    db=db,
+                    content_id=content_id,
+                    filename=att["filename"],
+                    content_type=att["content_type"],
+                    file_path=att["file_path"],
+                    size=att["size"]
+                )
+                attachment_bytes.observe(att["size"])
+                continue
+            attachment = store_attachment(
+                db=db,
+                content_id=content_id,
+                filename=att["filename"],
+                content_type=att["content_type"],
+                file_content=att["content"]
+            )
+            file_paths.append(attachment.file_path)
+            attachment_bytes.observe(attachment.size)
+        except Exception as e:
+            # Log but continue processing
+            print(f"Error saving attachment: {e}")
+    return file_paths
+
+def screen_recipients(source, recipients: Optional[List[str]] = None) -> Tuple[List[str], Dict[str, str], int, List[str]]:
+    """
+    Header-stage checks, run before any parsing or storage work: recipients
+    without a valid inbox are dropped, then redelivered copies (dedup), and
+    only the remaining recipients are charged against their inbox rate
+    limit. source is the raw email (bytes, or a binary file positioned at
+    its start, where it is left). Recipients default to the header
+    recipients. Returns (recipients to deliver to, their dedup keys, number
+    of recipients dropped, recipients over their rate limit); callers defer
+    the rate-limited ones (tempfail) rather than drop them.
+    """
+    stream = as_binary_stream(source)
+    start = stream.tell()
+    try:
+        with stage("screen"):
+            headers = read_header_block(stream)
+            body_start = stream.tell()
+            recipients = recipients or extract_recipients(headers)
+            
+            valid = valid_inbox_addresses(recipients)
+            candidates = [recipient for recipient in recipients if recipient in valid]
+            if recipients and not candidates:
+                inbound_messages_total.inc("dropped_unknown_recipient")
+            dedup_keys = {}
+            if settings.INGEST_DEDUP_ENABLED and candidates:
+                dedup_keys, _ = filter_duplicates(compute_dedup_keys(headers, stream, start, body_start, candidates))
+                candidates = [recipient for recipient in candidates if recipient in dedup_keys]
+                if not candidates:
+                    inbound_messages_total.inc("dropped_duplicate")
+            
+            allowed = filter_rate_limited(candidates)
+            limited = [recipient for recipient in candidates if recipient not in allowed]
+            dedup_keys = {recipient: dedup_keys[recipient] for recipient in allowed if recipient in dedup_keys}
+    finally:
+        stream.seek(start)
+    
+    return allowed, dedup_keys, len(recipients) - len(candidates), limited
+
+def valid_inbox_addresses(addresses: List[str]) -> Set[str]:
+    """The addresses that have an unexpired inbox, looked up on their shards"""
+    valid = set()
+    now = datetime.utcnow()
+    for shard, shard_addresses in group_by_shard(addresses).items():
+        db = session_for_shard(shard)
+        try:
+            rows = db.query(Inbox.email)\
+                .filter(Inbox.email.in_(shard_addresses))\
+                .filter(Inbox.expires_at > now)\
+                .all()
+        finally:
+            db.close()
+        valid.update(row.email for row in rows)
+    return valid
+
+def record_outcome(parsed: dict, result: Optional[dict]):
+    """Count a committed email as accepted, or why it was dropped"""
+    outcome = "accepted" if result else parsed.get("drop_reason", "dropped_unknown_recipient")
+    inbound_messages_total.inc(outcome)
+    trace = current_trace.get()
+    if trace:
+        trace.set_attribute("ingest.result", outcome)
+
+def recipient_addresses(parsed: dict) -> List[str]:
+    """Normalized recipients: envelope/header recipients, else the To address"""
+    recipients = parsed.get("recipients") or [parsed["to_address"]]
+    addresses = []
+    for recipient in recipients:
+        address = recipient.lower().strip()
+        if address and address not in addresses:
+            addresses.append(address)
+    return addresses
+
+def discard_files(file_paths):
+    """Remove attachment blobs written for a transaction that was rolled back"""
+    storage = get_storage()
+    for file_path in file_paths:
+        try:
+            storage.delete(file_path)
+        except Exception as e:
+            print(f"Error removing attachment file: {e}")
+
+def discard_parsed_files(parsed: dict):
+    """Remove attachment files the streaming parser wrote for an email that won't be stored"""
+    discard_files([att["file_path"] for att in parsed["attachments"] if "file_path" in att])
+
+def copy_parsed_attachments(attachments: List[dict]) -> List[dict]:
+    """The parser's attachment list with its files copied under new storage keys"""
+    storage = get_storage()
+    copies = []
+    try:
+        for att in attachments:
+            if "file_path" not in att:
+                copies.append(att)
+                continue
+            key = new_storage_key(att["filename"])
+            writer = storage.writer(key)
+            try:
+                with storage.open(att["file_path"]) as source:
+                    for chunk in iter_chunks(source):
+                        writer.write(chunk)
+                writer.commit()
+            except Exception:
+                writer.abort()
+                raise
+            copies.append(dict(att, file_path=key))
+    except Exception:
+        discard_parsed_files({"attachments": copies})
+        raise
+    return copies
+
+def shard_parts(parsed: dict) -> List[Tuple[int, dict]]:
+    """
+    Split a parsed email by the shards of its recipients' inboxes. Usually
+    that's one shard and the email itself. Otherwise every part gets its own
+    copy of the attachment files, so cleanup on one shard never removes
+    blobs another still references; the parser's files are then removed
+    once all parts are stored.
+    """
+    groups = group_by_shard(recipient_addresses(parsed))
+    if len(groups) <= 1:
+        return [(next(iter(groups), 0), parsed)]
+    parts = []
+    try:
+        for shard, addresses in groups.items():
+            attachments = copy_parsed_attachments(parsed["attachments"])
+            parts.append((shard, dict(parsed, recipients=addresses, attachments=attachments)))
+    except Exception:
+        for _, part in parts:
+            discard_parsed_files(part)
+        raise
+    return parts
+
+# Most specific first: why an email split across shards was not stored
+DROP_REASONS = ("dropped_duplicate", "dropped_expired", "dropped_unknown_recipient")
+
+def merge_results(parsed: dict, parts: List[Tuple[int, dict]], results: List[Optional[dict]]) -> Optional[dict]:
+    """Combine the per-shard results of one email"""
+    if len(parts) == 1:
+        return results[0]
+    stored = [result for result in results if result]
+    if not stored:
+        reasons = {part.get("drop_reason") for _, part in parts}
+        parsed["drop_reason"] = next((reason for reason in DROP_REASONS if reason in reasons), None)
+        return None
+    return {
+        key: [item for result in stored for item in result[key]]
+        for key in ("deliveries", "file_paths", "evicted_file_paths")
+    }
+
+def commit_shard_part(shard: int, parsed: dict) -> Optional[dict]:
+    """Persist (part of) a parsed email in a session on its shard and commit it"""
+    db = session_for_shard(shard)
+    result = None
+    try:
+        result = persist_parsed_email(db, parsed)
+        if result:
+            with stage("commit"):
+                db.commit()
+            discard_files(result["evicted_file_paths"])
+        return result
+    except Exception:
+        db.rollback()
+        if result:
+            discard_files(result["file_paths"])
+        raise
+    finally:
+        db.close()
+
+def commit_parsed_email(parsed: dict) -> Optional[dict]:
+    """
+    Persist a parsed email and commit it (one transaction per shard). If a
+    later shard fails, earlier ones stay committed; the redelivery is then
+    dropped there by dedup.
+    """
+    parts = shard_parts(parsed)
+    results = []
+    try:
+        for shard, part in parts:
+            results.append(commit_shard_part(shard, part))
+    except Exception:
+        if len(parts) > 1:
+            for _, part in parts[len(results):]:
+                discard_parsed_files(part)
+        raise
+    if len(parts) > 1:
+        # Every part stored its own copies
+        discard_parsed_files(parsed)
+    result = merge_results(parsed, parts, results)
+    record_outcome(parsed, result)
+    return result
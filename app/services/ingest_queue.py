@@ -0,0 +1,323 @@
+"""
+Durable accept-then-process ingest queue.
+
+The inbound endpoint only writes the raw email into a spool directory and
+acknowledges. A pool of workers parses and persists spooled emails in the
+background, retrying failures with backoff and moving emails that keep
+failing to a dead-letter directory.
+
+Spool layout:
+    tmp/          partially written files (never processed)
+    ready/        accepted emails, named <time_ns>-<uuid>.<attempts>.eml
+    processing/   one directory per worker process, holding the emails it
+                  claimed and a .lock file it keeps flock'ed while alive
+    dead/         emails that exhausted their retries
+
+Every worker process lists ready/ when it starts, so emails are claimed
+with an atomic rename into the process's own processing/ directory before
+they are parsed: exactly one process gets each email. Claims of a process
+that died (its lock can be taken) go back to ready/ on the next start.
+
+Envelope recipients, when given, are written as a first line
+``RCPT <address> <address> ...`` ahead of the raw email, followed by the
+accepting request's trace as ``TRACE <traceparent>``.
+"""
+import asyncio
+import fcntl
+import os
+import shutil
+import time
+import uuid
+from typing import BinaryIO, List, Optional, Tuple
+from app.services.email_parser import parse_email_streaming
+from app.services.ingest import commit_parsed_email, discard_parsed_files, screen_recipients
+from app.services.ingest_writer import ingest_writer
+from app.services.activity_tracker import touch_inbox
+from app.services.websocket_manager import broadcast_new_message
+from app.services.metrics import inbound_messages_total
+from app.services.tracing import start_trace, stage, SPAN_KIND_CONSUMER
+from app.config import settings
+
+def fsync_directory(path: str):
+    """Make a rename inside a directory durable"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        # Not supported on every platform (e.g. Windows)
+        pass
+    finally:
+        os.close(fd)
+
+class IngestSpool:
+    """Spool directory plus the worker pool that drains it"""
+
+    def __init__(self, spool_path: str, workers: int, max_attempts: int, retry_delay: int):
+        self.tmp_dir = os.path.join(spool_path, "tmp")
+        self.ready_dir = os.path.join(spool_path, "ready")
+        self.processing_dir = os.path.join(spool_path, "processing")
+        self.dead_dir = os.path.join(spool_path, "dead")
+        # This process's claim directory and its held lock (set by start)
+        self.claim_dir: Optional[str] = None
+        self.lock_fd: Optional[int] = None
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+
+    def ensure_directories(self):
+        for path in (self.tmp_dir, self.ready_dir, self.processing_dir, self.dead_dir):
+            os.makedirs(path, exist_ok=True)
+
+    def open_claim_dir(self):
+        """Create this process's claim directory and hold its lock for the process lifetime"""
+        self.claim_dir = os.path.join(self.processing_dir, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        os.makedirs(self.claim_dir)
+        self.lock_fd = os.open(os.path.join(self.claim_dir, ".lock"), os.O_CREAT | os.O_RDWR, 0o600)
+        fcntl.flock(self.lock_fd, fcntl.LOCK_EX)
+
+    def recover_stale_claims(self):
+        """Move emails claimed by processes that are gone back to ready/"""
+        for entry in os.listdir(self.processing_dir):
+            claim_dir = os.path.join(self.processing_dir, entry)
+            if claim_dir == self.claim_dir or not os.path.isdir(claim_dir):
+                continue
+            try:
+                fd = os.open(os.path.join(claim_dir, ".lock"), os.O_CREAT | os.O_RDWR, 0o600)
+            except OSError:
+                continue
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # Owner still running
+                    continue
+                try:
+                    names = os.listdir(claim_dir)
+                except FileNotFoundError:
+                    # Recovered by another process starting at the same time
+                    continue
+                for name in names:
+                    if name != ".lock":
+                        os.replace(os.path.join(claim_dir, name), os.path.join(self.ready_dir, name))
+                        print(f"Ingest: recovered {name} from a stopped worker")
+                shutil.rmtree(claim_dir, ignore_errors=True)
+            finally:
+                os.close(fd)
+        fsync_directory(self.ready_dir)
+
+    def claim(self, path: str) -> Optional[str]:
+        """Atomically take a ready/ email for this process; None if another process took it"""
+        claimed = os.path.join(self.claim_dir, os.path.basename(path))
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return None
+        return claimed
+
+    def write(self, raw_email, recipients: Optional[List[str]] = None,
+              traceparent: Optional[str] = None, attempts: int = 0,
+              target_dir: Optional[str] = None) -> str:
+        """Durably write an email (bytes or a binary file) into ready/ (or target_dir) and return its path"""
+        self.ensure_directories()
+        target_dir = target_dir or self.ready_dir
+        name = f"{time.time_ns()}-{uuid.uuid4().hex}.{attempts}.eml"
+        tmp_path = os.path.join(self.tmp_dir, name)
+        ready_path = os.path.join(target_dir, name)
+
+        with open(tmp_path, "wb") as f:
+            if recipients:
+                f.write(("RCPT " + " ".join(recipients) + "\n").encode("utf-8"))
+            if traceparent:
+                f.write(f"TRACE {traceparent}\n".encode("ascii"))
+            if isinstance(raw_email, (bytes, bytearray)):
+                f.write(raw_email)
+            else:
+                shutil.copyfileobj(raw_email, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        # Atomic publish: workers never see a partial file
+        os.replace(tmp_path, ready_path)
+        fsync_directory(target_dir)
+        return ready_path
+
+    async def enqueue(self, raw_email, recipients: Optional[List[str]] = None,
+                      traceparent: Optional[str] = None) -> str:
+        """Accept an email: write it to the spool and hand it to the workers"""
+        self.start()
+        loop = asyncio.get_running_loop()
+        path = await loop.run_in_executor(None, self.write, raw_email, recipients, traceparent)
+        self.queue.put_nowait(path)
+        return path
+
+    def start(self):
+        """Recover spooled emails and start the worker pool"""
+        if self.tasks:
+            return
+        self.ensure_directories()
+        self.open_claim_dir()
+        self.recover_stale_claims()
+        self.queue = asyncio.Queue()
+
+        # Emails accepted before a restart are processed first, oldest first
+        for name in sorted(os.listdir(self.ready_dir)):
+            self.queue.put_nowait(os.path.join(self.ready_dir, name))
+
+        self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop workers; unprocessed emails stay in the spool for the next start"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queue = None
+        if self.claim_dir is not None:
+            # Emails claimed but not finished go back for the next start
+            for name in os.listdir(self.claim_dir):
+                if name != ".lock":
+                    os.replace(os.path.join(self.claim_dir, name), os.path.join(self.ready_dir, name))
+            os.close(self.lock_fd)
+            shutil.rmtree(self.claim_dir, ignore_errors=True)
+            self.claim_dir = None
+            self.lock_fd = None
+
+    async def worker(self):
+        """Process spooled emails until cancelled"""
+        while True:
+            path = await self.queue.get()
+            try:
+                path = self.claim(path)
+                if path is None:
+                    # Another worker process claimed it
+                    continue
+                await self.process(path)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self.handle_failure(path, e)
+            finally:
+                self.queue.task_done()
+
+    async def process(self, path: str):
+        """Parse, persist and broadcast one spooled email, then remove it"""
+        with open(path, "rb") as raw_email:
+            recipients, traceparent = self.read_envelope(raw_email)
+            # Continues the trace of the request that accepted the email
+            with start_trace("ingest.spool", traceparent, SPAN_KIND_CONSUMER, **{"spool.file": os.path.basename(path)}):
+                await self.process_email(path, recipients, raw_email, traceparent)
+
+    async def process_email(self, path: str, recipients: List[str], raw_email: BinaryIO,
+                            traceparent: Optional[str] = None):
+        """Screen, parse and store; blocking steps use to_thread so they keep the current trace"""
+        start = raw_email.tell()
+        # Unknown inboxes, dedup (e.g. a retried attempt that was stored) and inbox rate limits
+        recipients, dedup_keys, dropped, limited = await asyncio.to_thread(screen_recipients, raw_email, recipients)
+        if not recipients and (dropped or limited):
+            if limited:
+                raw_email.seek(start)
+                await self.defer(path, raw_email, limited, traceparent)
+            else:
+                print(f"Ingest: dropping {os.path.basename(path)}, no inbox or already delivered")
+            os.remove(path)
+            return
+
+        with stage("parse"):
+            parsed = await asyncio.to_thread(parse_email_streaming, raw_email)
+        if recipients:
+            parsed["recipients"] = recipients
+        parsed["dedup_keys"] = dedup_keys
+
+        result = None
+        try:
+            if not parsed["recipients"] and not parsed["to_address"].strip():
+                print(f"Ingest: dropping {os.path.basename(path)}, no recipient address found")
+                discard_parsed_files(parsed)
+            elif settings.INGEST_GROUP_COMMIT:
+                result = await ingest_writer.submit(parsed)
+            else:
+                result = await asyncio.to_thread(commit_parsed_email, parsed)
+        except Exception:
+            # The next attempt parses the spooled file again
+            discard_parsed_files(parsed)
+            raise
+
+        if limited:
+            raw_email.seek(start)
+            await self.defer(path, raw_email, limited, traceparent)
+        os.remove(path)
+
+        if result:
+            with stage("broadcast"):
+                for inbox_id, message_id in result["deliveries"]:
+                    touch_inbox(inbox_id)
+                    await broadcast_new_message(inbox_id, message_id)
+
+    async def defer(self, path: str, raw_email: BinaryIO, recipients: List[str], traceparent: Optional[str]):
+        """
+        Spool a copy for recipients over their inbox rate limit and retry it
+        with backoff, like a failed attempt (moved to dead/ after max_attempts)
+        """
+        name = os.path.basename(path)
+        attempts = int(name.rsplit(".", 2)[1]) + 1
+        if attempts >= self.max_attempts:
+            inbound_messages_total.inc("dropped_rate_limited")
+            await asyncio.to_thread(self.write, raw_email, recipients, traceparent, attempts, self.dead_dir)
+            print(f"Ingest: moved {name} to dead-letter for {len(recipients)} rate-limited recipients after {attempts} attempts")
+            return
+
+        inbound_messages_total.inc("deferred_rate_limited")
+        retry_path = await asyncio.to_thread(self.write, raw_email, recipients, traceparent, attempts)
+        delay = self.retry_delay * (2 ** (attempts - 1))
+        print(f"Ingest: {len(recipients)} recipients of {name} over their rate limit, retrying in {delay}s")
+        asyncio.get_running_loop().call_later(delay, self.requeue, retry_path)
+
+    def read_envelope(self, f: BinaryIO) -> Tuple[List[str], Optional[str]]:
+        """Read the envelope recipients and traceparent (if recorded), leaving f at the raw email"""
+        recipients, traceparent = [], None
+        line = f.readline()
+        if line.startswith(b"RCPT "):
+            recipients = line.decode("utf-8", errors="ignore").split()[1:]
+            line = f.readline()
+        if line.startswith(b"TRACE "):
+            traceparent = line[6:].decode("ascii", errors="ignore").strip()
+            line = f.readline()
+        f.seek(f.tell() - len(line))
+        return recipients, traceparent
+
+    async def handle_failure(self, path: str, error: Exception):
+        """Schedule a retry with backoff, or move the email to dead/"""
+        inbound_messages_total.inc("failed")
+        name = os.path.basename(path)
+        stem, attempts, ext = name.rsplit(".", 2)
+        attempts = int(attempts) + 1
+
+        try:
+            if attempts >= self.max_attempts:
+                os.replace(path, os.path.join(self.dead_dir, name))
+                print(f"Ingest: moved {name} to dead-letter after {attempts} attempts: {error}")
+                return
+
+            # Record the attempt in the file name so it survives restarts
+            retry_path = os.path.join(self.ready_dir, f"{stem}.{attempts}.{ext}")
+            os.replace(path, retry_path)
+        except OSError as e:
+            print(f"Ingest: could not reschedule {name}: {e}")
+            return
+
+        print(f"Ingest: attempt {attempts} for {name} failed, retrying: {error}")
+        delay = self.retry_delay * (2 ** (attempts - 1))
+        asyncio.get_running_loop().call_later(delay, self.requeue, retry_path)
+
+    def requeue(self, path: str):
+        if self.queue is not None:
+            self.queue.put_nowait(path)
+
+ingest_spool = IngestSpool(
+    spool_path=settings.INGEST_SPOOL_PATH,
+    workers=settings.INGEST_WORKERS,
+    max_attempts=settings.INGEST_MAX_ATTEMPTS,
+    retry_delay=settings.INGEST_RETRY_DELAY_SECONDS
+)
@@ -0,0 +1,175 @@
+"""
+Group-commit ingest writer.
+
+Request handlers hand parsed emails to a single writer task through an
+asyncio queue. The writer collects a batch (bounded by size and wait time),
+persists it in one transaction with one commit per database shard, and
+then resolves each handler's future, so a handler only returns once its
+message is durable.
+"""
+import asyncio
+from typing import List, Optional, Tuple
+from app.database import session_for_shard
+from app.services.ingest import (
+    persist_parsed_email, discard_files, discard_parsed_files, record_outcome, shard_parts, merge_results
+)
+from app.services.tracing import stage, use_trace, current_trace
+from app.config import settings
+
+class IngestWriter:
+    """Single writer that persists queued emails in group commits"""
+
+    def __init__(self, max_batch: int, max_wait_ms: int):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the writer task on the running event loop"""
+        if self.task is None or self.task.done():
+            self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Flush queued emails and stop the writer task"""
+        if self.task is None:
+            return
+        await self.queue.join()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def submit(self, parsed: dict) -> Optional[dict]:
+        """Queue a parsed email and wait until it has been committed"""
+        self.start()
+        # The writer thread records this email's spans on the submitter's trace
+        parsed.setdefault("trace", current_trace.get())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((parsed, future))
+        return await future
+
+    async def collect_batch(self) -> List[Tuple[dict, asyncio.Future]]:
+        """Wait for one item, then gather more until the batch is full or the wait expires"""
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+
+        while len(batch) < self.max_batch:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def run(self):
+        """Writer loop"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.collect_batch()
+            try:
+                results = await loop.run_in_executor(
+                    None, self.flush, [parsed for parsed, _ in batch]
+                )
+                for (_, future), result in zip(batch, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def flush(self, batch: List[dict]) -> list:
+        """
+        Persist a batch with a single commit per shard. Returns each email's
+        result, or the exception that failed it.
+        """
+        results: list = [None] * len(batch)
+        email_parts = []
+        by_shard = {}
+        for index, parsed in enumerate(batch):
+            try:
+                with use_trace(parsed.get("trace")):
+                    parts = shard_parts(parsed)
+            except Exception as e:
+                results[index] = e
+                parts = []
+            email_parts.append(parts)
+            for position, (shard, part) in enumerate(parts):
+                by_shard.setdefault(shard, []).append((index, position, part))
+
+        part_results = [[None] * len(parts) for parts in email_parts]
+        for shard, items in by_shard.items():
+            for (index, position, _), result in zip(items, self.flush_shard(shard, [part for _, _, part in items])):
+                part_results[index][position] = result
+
+        for index, (parsed, parts) in enumerate(zip(batch, email_parts)):
+            if not parts:
+                continue
+            failed = [result for result in part_results[index] if isinstance(result, Exception)]
+            if len(parts) > 1:
+                # Split emails stored copies; the failed parts' copies are unused
+                for (_, part), result in zip(parts, part_results[index]):
+                    if isinstance(result, Exception):
+                        discard_parsed_files(part)
+                if not failed:
+                    discard_parsed_files(parsed)
+            if failed:
+                results[index] = failed[0]
+                continue
+            results[index] = merge_results(parsed, parts, part_results[index])
+            with use_trace(parsed.get("trace")):
+                record_outcome(parsed, results[index])
+        return results
+
+    def flush_shard(self, shard: int, batch: List[dict]) -> list:
+        """
+        Persist emails for one shard with a single commit. If the group
+        commit fails, fall back to committing items one by one so a bad
+        email only fails its own request.
+        """
+        db = session_for_shard(shard)
+        file_paths = []
+        try:
+            results = []
+            for parsed in batch:
+                with use_trace(parsed.get("trace")):
+                    result = persist_parsed_email(db, parsed)
+                if result:
+                    file_paths.extend(result["file_paths"])
+                results.append(result)
+            # Every email in the batch waited for this commit
+            with stage("commit", [parsed.get("trace") for parsed in batch]):
+                db.commit()
+            for result in results:
+                if result:
+                    discard_files(result["evicted_file_paths"])
+            return results
+        except Exception as e:
+            db.rollback()
+            discard_files(file_paths)
+            if len(batch) == 1:
+                return [e]
+            print(f"Group commit of {len(batch)} emails failed, retrying individually: {e}")
+        finally:
+            db.close()
+
+        return [self.flush_shard(shard, [parsed])[0] for parsed in batch]
+
+ingest_writer = IngestWriter(
+    max_batch=settings.INGEST_BATCH_MAX_SIZE,
+    max_wait_ms=settings.INGEST_BATCH_MAX_WAIT_MS
+)
@@ -0,0 +1,432 @@
+"""
+LMTP listener (RFC 2033) inside the backend process.
+
+Postfix delivers straight to it over a unix or TCP socket (virtual_transport
+= lmtp:...), replacing the pipe spawn of mailpipe.py and the multipart HTTP
+POST. Received mail goes through the same pipeline as the HTTP endpoint:
+header screening, streaming parse, persistence (group-commit writer or
+spool), then activity and WebSocket notifications.
+
+Unknown or expired inboxes are refused at RCPT time (550). After DATA every
+accepted recipient gets its own reply, as LMTP requires: 250 when stored
+(or dropped as a redelivered copy, like the HTTP endpoint), 451 for
+recipients over their inbox rate limit, and 4xx for all of them when the
+backend is busy or failed, so Postfix retries.
+"""
+import asyncio
+import fcntl
+import os
+import socket
+import tempfile
+from typing import List, Optional, Set, Tuple
+from app.database import session_for_shard
+from app.models import Inbox
+from app.services.email_parser import parse_email_streaming
+from app.services.ingest import commit_parsed_email, discard_parsed_files, screen_recipients
+from app.services.ingest_writer import ingest_writer
+from app.services.ingest_queue import ingest_spool
+from app.services.shards import address_shard
+from app.services.activity_tracker import touch_inbox
+from app.services.websocket_manager import broadcast_new_message
+from app.services.admission import inbound_admission
+from app.services.metrics import ingest_stage_seconds, inbound_messages_total, inbound_message_bytes
+from app.services.tracing import Trace, start_trace, stage, postfix_queue_id
+from app.config import settings
+
+# Lines of non-conforming mail can exceed the 998 characters RFC 5322 allows
+MAX_LINE = 1024 * 1024
+MAX_RECIPIENTS = 100
+IDLE_TIMEOUT_SECONDS = 300
+# Message data up to this size is spooled in memory, larger ones to a temp file
+SPOOL_MEMORY_BYTES = 1024 * 1024
+# The Postfix Received header is looked for in this much of the message
+QUEUE_ID_SCAN_BYTES = 64 * 1024
+RATE_LIMITED_REPLY = "451 4.7.1 Inbox rate limit exceeded, try again later"
+# How often workers that don't hold the listener lock try to take it over
+LOCK_RETRY_SECONDS = 5
+
+class LMTPError(Exception):
+    """Client sent something the session can't recover from"""
+
+def parse_path(argument: str, keyword: str) -> Optional[tuple]:
+    """'FROM:<a@b> SIZE=10' -> ('a@b', {'SIZE': '10'}); None when malformed"""
+    if not argument.upper().startswith(keyword + ":"):
+        return None
+    rest = argument[len(keyword) + 1:].strip()
+    if rest.startswith("<"):
+        end = rest.find(">")
+        if end < 0:
+            return None
+        address, params = rest[1:end], rest[end + 1:]
+    else:
+        address, _, params = rest.partition(" ")
+    options = {}
+    for param in params.split():
+        name, _, value = param.partition("=")
+        options[name.upper()] = value
+    return address.strip().lower(), options
+
+def find_valid_inbox(address: str) -> bool:
+    """True when address belongs to a known, unexpired inbox"""
+    db = session_for_shard(address_shard(address))
+    try:
+        inbox = db.query(Inbox).filter(Inbox.email == address).first()
+        return inbox is not None and inbox.is_valid()
+    finally:
+        db.close()
+
+class LMTPSession:
+    """One client connection"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, hostname: str):
+        self.reader = reader
+        self.writer = writer
+        self.hostname = hostname
+        self.max_size = settings.MAX_EMAIL_SIZE_MB * 1024 * 1024
+        self.greeted = False
+        self.reset()
+
+    def reset(self):
+        self.mail_from: Optional[str] = None
+        self.declared_size = 0
+        self.recipients: List[str] = []
+
+    async def reply(self, *lines: str):
+        self.writer.write("".join(f"{line}\r\n" for line in lines).encode("utf-8"))
+        await self.writer.drain()
+
+    async def readline(self) -> bytes:
+        try:
+            line = await asyncio.wait_for(self.reader.readline(), timeout=IDLE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            await self.reply("421 4.4.2 Idle timeout, closing connection")
+            raise LMTPError("idle timeout")
+        except (asyncio.LimitOverrunError, ValueError):
+            await self.reply("500 5.5.6 Line too long")
+            raise LMTPError("line too long")
+        if not line:
+            raise LMTPError("connection closed")
+        return line
+
+    async def run(self):
+        await self.reply(f"220 {self.hostname} LMTP TempMail ready")
+        while True:
+            line = (await self.readline()).decode("utf-8", errors="ignore").rstrip("\r\n")
+            command, _, argument = line.partition(" ")
+            command = command.upper()
+
+            if command == "LHLO":
+                self.greeted = True
+                self.reset()
+                await self.reply(
+                    f"250-{self.hostname}",
+                    "250-PIPELINING",
+                    "250-ENHANCEDSTATUSCODES",
+                    "250-8BITMIME",
+                    f"250 SIZE {self.max_size}"
+                )
+            elif command in ("HELO", "EHLO"):
+                await self.reply("500 5.5.1 This is an LMTP server, use LHLO")
+            elif command == "MAIL":
+                await self.mail(argument)
+            elif command == "RCPT":
+                await self.rcpt(argument)
+            elif command == "DATA":
+                await self.data()
+            elif command == "RSET":
+                self.reset()
+                await self.reply("250 2.0.0 OK")
+            elif command == "NOOP":
+                await self.reply("250 2.0.0 OK")
+            elif command == "VRFY":
+                await self.reply("252 2.5.0 Cannot VRFY, send some mail")
+            elif command == "QUIT":
+                await self.reply("221 2.0.0 Bye")
+                return
+            else:
+                await self.reply("500 5.5.2 Command not recognized")
+
+    async def mail(self, argument: str):
+        if not self.greeted:
+            await self.reply("503 5.5.1 Send LHLO first")
+            return
+        if self.mail_from is not None:
+            await self.reply("503 5.5.1 Sender already given")
+            return
+        path = parse_path(argument, "FROM")
+        if path is None:
+            await self.reply("501 5.5.4 Syntax: MAIL FROM:<address>")
+            return
+        address, options = path
+        try:
+            declared_size = int(options.get("SIZE", "0"))
+        except ValueError:
+            declared_size = 0
+        if declared_size > self.max_size:
+            await self.reply(f"552 5.3.4 Message exceeds maximum of {settings.MAX_EMAIL_SIZE_MB}MB")
+            return
+        self.mail_from = address
+        self.declared_size = declared_size
+        await self.reply("250 2.1.0 OK")
+
+    async def rcpt(self, argument: str):
+        if self.mail_from is None:
+            await self.reply("503 5.5.1 Send MAIL first")
+            return
+        path = parse_path(argument, "TO")
+        if path is None or "@" not in path[0]:
+            await self.reply("501 5.5.4 Syntax: RCPT TO:<address>")
+            return
+        if len(self.recipients) >= MAX_RECIPIENTS:
+            await self.reply("452 4.5.3 Too many recipients")
+            return
+
+        address = path[0]
+        loop = asyncio.get_running_loop()
+        try:
+            valid = await loop.run_in_executor(None, find_valid_inbox, address)
+        except Exception as e:
+            print(f"LMTP: inbox lookup failed: {e}")
+            await self.reply("451 4.3.0 Temporary lookup failure")
+            return
+        if not valid:
+            await self.reply("550 5.1.1 Mailbox unavailable")
+            return
+        # Kept once per accepted RCPT: LMTP answers DATA once for each
+        self.recipients.append(address)
+        await self.reply("250 2.1.5 OK")
+
+    async def data(self):
+        if not self.recipients:
+            await self.reply("503 5.5.1 No valid recipients")
+            return
+
+        # Same admission budget as the HTTP endpoint
+        reserved = self.declared_size or self.max_size
+        if not inbound_admission.try_acquire(reserved):
+            inbound_messages_total.inc("rejected_busy")
+            await self.reply("451 4.3.2 Server busy, retry later")
+            self.reset()
+            return
+        raw_email = None
+        limited = set()
+        try:
+            await self.reply("354 Start mail input; end with <CRLF>.<CRLF>")
+            with ingest_stage_seconds.time("read_body"):
+                raw_email, size = await self.read_data()
+            if raw_email is None:
+                status = f"552 5.3.4 Message exceeds maximum of {settings.MAX_EMAIL_SIZE_MB}MB"
+            else:
+                inbound_message_bytes.observe(size)
+                queue_id = postfix_queue_id(raw_email.read(QUEUE_ID_SCAN_BYTES))
+                raw_email.seek(0)
+                with start_trace(
+                    "LMTP DATA",
+                    **{"postfix.queue_id": queue_id, "message.size": size}
+                ) as trace, ingest_stage_seconds.time("total"):
+                    status, limited = await self.deliver(raw_email, trace)
+        finally:
+            if raw_email is not None:
+                raw_email.close()
+            inbound_admission.release(reserved)
+
+        # One reply per accepted recipient (the others are stored in one
+        # transaction, so they share the outcome)
+        await self.reply(*[
+            RATE_LIMITED_REPLY if recipient in limited else status
+            for recipient in self.recipients
+        ])
+        self.reset()
+
+    async def read_data(self):
+        """
+        Spool the dot-terminated message into a temp file as it arrives.
+        Returns (file positioned at its start, size), or (None, size) after
+        draining a message larger than MAX_EMAIL_SIZE_MB.
+        """
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+        size = 0
+        try:
+            while True:
+                line = await self.readline()
+                if line in (b".\r\n", b".\n"):
+                    break
+                if line.startswith(b"."):
+                    line = line[1:]
+                size += len(line)
+                if size <= self.max_size:
+                    body.write(line)
+        except BaseException:
+            body.close()
+            raise
+        if size > self.max_size:
+            body.close()
+            return None, size
+        body.seek(0)
+        return body, size
+
+    async def deliver(self, raw_email, trace: Trace) -> Tuple[str, Set[str]]:
+        """
+        Run the ingest pipeline. Returns the reply for the accepted
+        recipients and the recipients to defer for their inbox rate limit.
+        """
+        recipients = list(dict.fromkeys(self.recipients))
+        try:
+            if settings.INGEST_QUEUE_ENABLED:
+                # Durably spooled counts as delivered
+                await ingest_spool.enqueue(raw_email, recipients, trace.traceparent)
+                inbound_messages_total.inc("queued")
+                return "250 2.0.0 Queued", set()
+
+            # Unknown inboxes, redelivery dedup and inbox rate limits (to_thread keeps the current trace)
+            allowed, dedup_keys, dropped, limited = await asyncio.to_thread(screen_recipients, raw_email, recipients)
+            if limited:
+                inbound_messages_total.inc("deferred_rate_limited")
+            if not allowed:
+                return "250 2.0.0 OK", set(limited)
+
+            with stage("parse"):
+                parsed = await asyncio.to_thread(parse_email_streaming, raw_email)
+            parsed["recipients"] = allowed
+            parsed["dedup_keys"] = dedup_keys
+            try:
+                if settings.INGEST_GROUP_COMMIT:
+                    result = await ingest_writer.submit(parsed)
+                else:
+                    result = await asyncio.to_thread(commit_parsed_email, parsed)
+            except Exception:
+                discard_parsed_files(parsed)
+                raise
+        except Exception as e:
+            print(f"LMTP: error processing email (trace {trace.trace_id}): {e}")
+            inbound_messages_total.inc("failed")
+            # Not stored - Postfix keeps it queued and retries
+            return "451 4.3.0 Could not process email", set()
+
+        with stage("broadcast"):
+            for inbox_id, message_id in (result or {}).get("deliveries", []):
+                touch_inbox(inbox_id)
+                await broadcast_new_message(inbox_id, message_id)
+
+        # Recipients dropped by screening or expired since RCPT are
+        # acknowledged like the HTTP endpoint does
+        return "250 2.0.0 OK", set(limited)
+
+class LMTPServer:
+    """
+    asyncio server accepting LMTP sessions on a unix socket or TCP port.
+
+    Every uvicorn worker calls start(), but only the one holding the
+    listener lock file binds the socket: the others would fail with
+    EADDRINUSE on TCP, or replace the listening worker's unix socket. They
+    retry the lock periodically and take over if the listening worker exits.
+    """
+
+    def __init__(self, host: str, port: int, socket_path: str, lock_path: str = ""):
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.lock_path = lock_path or self.default_lock_path()
+        self.hostname = socket.getfqdn()
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.lock_fd: Optional[int] = None
+        self.lock_task: Optional[asyncio.Task] = None
+
+    def default_lock_path(self) -> str:
+        if self.socket_path:
+            return self.socket_path + ".lock"
+        return os.path.join(tempfile.gettempdir(), f"tempmail-lmtp-{self.port}.lock")
+
+    def acquire_lock(self) -> bool:
+        """Take the listener lock without blocking; held until stop()"""
+        fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self.lock_fd = fd
+        return True
+
+    def release_lock(self):
+        if self.lock_fd is not None:
+            os.close(self.lock_fd)
+            self.lock_fd = None
+
+    async def start(self):
+        if self.server is not None or self.lock_task is not None:
+            return
+        if self.acquire_lock():
+            await self.listen()
+        else:
+            print(f"LMTP: another worker holds {self.lock_path}, standing by")
+            self.lock_task = asyncio.create_task(self.wait_for_lock())
+
+    async def wait_for_lock(self):
+        """Take over the listener once the worker holding the lock is gone"""
+        while True:
+            await asyncio.sleep(LOCK_RETRY_SECONDS)
+            try:
+                if self.acquire_lock():
+                    await self.listen()
+                    self.lock_task = None
+                    return
+            except Exception as e:
+                print(f"LMTP: could not take over the listener: {e}")
+                await self.close_server()
+                self.release_lock()
+
+    async def listen(self):
+        if self.socket_path:
+            # Left behind by a listener that exited; we hold the lock, so
+            # no other worker is serving it
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.server = await asyncio.start_unix_server(self.handle, path=self.socket_path, limit=MAX_LINE)
+            # Postfix connects as its own user
+            os.chmod(self.socket_path, 0o666)
+            print(f"LMTP: listening on unix:{self.socket_path}")
+        else:
+            self.server = await asyncio.start_server(self.handle, self.host, self.port, limit=MAX_LINE)
+            print(f"LMTP: listening on {self.host}:{self.port}")
+
+    async def close_server(self):
+        if self.server is None:
+            return
+        self.server.close()
+        await self.server.wait_closed()
+        self.server = None
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    async def stop(self):
+        if self.lock_task is not None:
+            self.lock_task.cancel()
+            try:
+                await self.lock_task
+            except asyncio.CancelledError:
+                pass
+            self.lock_task = None
+        await self.close_server()
+        self.release_lock()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await LMTPSession(reader, writer, self.hostname).run()
+        except (LMTPError, ConnectionError):
+            pass
+        except Exception as e:
+            print(f"LMTP: session error: {e}")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+lmtp_server = LMTPServer(
+    host=settings.LMTP_HOST,
+    port=settings.LMTP_PORT,
+    socket_path=settings.LMTP_SOCKET,
+    lock_path=settings.LMTP_LOCK_PATH
+)
@@ -0,0 +1,238 @@
+"""
+Maintenance scheduler with leader election.
+
+Periodic jobs (expired-inbox cleanup and anything registered later) run in
+one worker per deployment. Every worker runs the scheduler, but only the
+elected leader runs jobs; the others stand by and take over when the
+leader goes away.
+
+- Postgres: a session-level advisory lock held on a dedicated connection.
+  The server drops it as soon as the leader's connection dies.
+- SQLite (and anything else): a row in maintenance_leases renewed every
+  third of MAINTENANCE_LEASE_SECONDS. A dead leader's lease runs out and
+  the next worker to renew takes it.
+
+Leadership is renewed from a thread, so a job that blocks the event loop
+doesn't lose the lease.
+"""
+import asyncio
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+from sqlalchemy import insert, or_, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from app.models import MaintenanceLease
+from app.config import settings
+
+LEASE_NAME = "maintenance"
+# How often the job loop checks for due jobs
+TICK_SECONDS = 1
+
+def holder_id() -> str:
+    """Identifies this worker in the lease table and logs"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class LeaseElection:
+    """Leader = holder of an unexpired row in maintenance_leases"""
+
+    def __init__(self, engine: Engine, name: str, lease_seconds: int):
+        self.engine = engine
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.holder = holder_id()
+        self.table = MaintenanceLease.__table__
+
+    def try_acquire(self) -> bool:
+        """Take or renew the lease; True while this worker holds it"""
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                update(self.table)
+                .where(self.table.c.name == self.name)
+                .where(or_(self.table.c.holder == self.holder, self.table.c.expires_at < now))
+                .values(holder=self.holder, expires_at=expires_at)
+            )
+            if result.rowcount == 1:
+                return True
+        # No row yet (first start), or another worker holds it
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(
+                    insert(self.table).values(name=self.name, holder=self.holder, expires_at=expires_at)
+                )
+            return True
+        except IntegrityError:
+            return False
+
+    def release(self):
+        """Expire our lease so another worker takes over without waiting"""
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(self.table)
+                .where(self.table.c.name == self.name)
+                .where(self.table.c.holder == self.holder)
+                .values(expires_at=datetime.utcnow())
+            )
+
+class AdvisoryLockElection:
+    """Leader = holder of a Postgres session-level advisory lock"""
+
+    def __init__(self, engine: Engine, name: str):
+        self.engine = engine
+        self.key = zlib.crc32(f"tempmail:{name}".encode())
+        self.holder = holder_id()
+        self.connection = None
+
+    def try_acquire(self) -> bool:
+        if self.connection is not None:
+            # The lock lives as long as the session that took it
+            try:
+                self.connection.execute(text("SELECT 1"))
+                self.connection.commit()
+                return True
+            except Exception as e:
+                print(f"Maintenance: lost advisory lock connection: {e}")
+                self.discard_connection()
+                return False
+
+        connection = self.engine.connect()
+        try:
+            held = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": self.key}).scalar()
+            connection.commit()
+        except Exception:
+            connection.close()
+            raise
+        if held:
+            self.connection = connection
+        else:
+            connection.close()
+        return bool(held)
+
+    def release(self):
+        if self.connection is None:
+            return
+        try:
+            self.connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.key})
+            self.connection.commit()
+            self.connection.close()
+        except Exception:
+            self.discard_connection()
+        self.connection = None
+
+    def discard_connection(self):
+        # Don't return a connection in an unknown lock state to the pool
+        try:
+            self.connection.invalidate()
+            self.connection.close()
+        except Exception:
+            pass
+        self.connection = None
+
+def create_election(engine: Engine, lease_seconds: int):
+    if engine.dialect.name == "postgresql":
+        return AdvisoryLockElection(engine, LEASE_NAME)
+    return LeaseElection(engine, LEASE_NAME, lease_seconds)
+
+class Job:
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        # Set when this worker becomes leader (first run one interval later)
+        self.next_run: Optional[float] = None
+
+class MaintenanceScheduler:
+    """Runs registered periodic jobs while this worker is the maintenance leader"""
+
+    def __init__(self, lease_seconds: int):
+        self.lease_seconds = lease_seconds
+        self.election = None
+        self.jobs: List[Job] = []
+        self.is_leader = False
+        self.task: Optional[asyncio.Task] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+
+    def add_job(self, name: str, interval_seconds: float, func: Callable[[], Awaitable]):
+        """Register an async job to run every interval_seconds on the leader"""
+        self.jobs.append(Job(name, interval_seconds, func))
+
+    def start(self, engine: Engine):
+        if self.task is not None:
+            return
+        self.election = create_election(engine, self.lease_seconds)
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.elect, name="maintenance-election", daemon=True)
+        self.thread.start()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        self.stopping.set()
+        await asyncio.to_thread(self.thread.join)
+        self.thread = None
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                await asyncio.to_thread(self.election.release)
+            except Exception as e:
+                print(f"Maintenance: error releasing leadership: {e}")
+
+    def elect(self):
+        """Election thread: take or renew leadership every third of the lease"""
+        while not self.stopping.is_set():
+            try:
+                leader = self.election.try_acquire()
+            except Exception as e:
+                # Without the database we can't tell, so assume someone else leads
+                print(f"Maintenance: leader election failed: {e}")
+                leader = False
+            if leader != self.is_leader:
+                state = "is now" if leader else "is no longer"
+                print(f"Maintenance: {self.election.holder} {state} the leader")
+            self.is_leader = leader
+            self.stopping.wait(self.lease_seconds / 3)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.sleep(TICK_SECONDS)
+                if not self.is_leader:
+                    for job in self.jobs:
+                        job.next_run = None
+                    continue
+
+                now = time.monotonic()
+                for job in self.jobs:
+                    if job.next_run is None:
+                        job.next_run = now + job.interval
+                    elif now >= job.next_run and self.is_leader:
+                        await self.run_job(job)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"Error in maintenance scheduler: {e}")
+
+    async def run_job(self, job: Job):
+        try:
+            await job.func()
+        except Exception as e:
+            print(f"Error in maintenance job {job.name}: {e}")
+        finally:
+            job.next_run = time.monotonic() + job.interval
+
+maintenance = MaintenanceScheduler(settings.MAINTENANCE_LEASE_SECONDS)
@@ -0,0 +1,69 @@
+"""
+Pre-rendered message detail cache.
+
+Messages never change after ingest, so the detail JSON is serialized once
+and kept in a size-bounded LRU. Entries expire with their inbox: cleanup
+runs in one worker only, so the other workers can't rely on its
+invalidation. The group-commit writer thread invalidates entries while
+the event loop reads them, so every access holds the lock.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional, Tuple
+from app.config import settings
+
+class MessageCache:
+    """LRU of message_id -> (json bytes, etag, inbox expires_at), bounded by total bytes"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.entries: "OrderedDict[str, Tuple[bytes, str, datetime]]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, message_id: str) -> Optional[Tuple[bytes, str, datetime]]:
+        """Return cached (body, etag, expires_at) and mark it as recently used; None once the inbox expired"""
+        with self.lock:
+            entry = self.entries.get(message_id)
+            if entry is None:
+                return None
+            if entry[2] <= datetime.utcnow():
+                self.remove(message_id)
+                return None
+            self.entries.move_to_end(message_id)
+            return entry
+
+    def put(self, message_id: str, body: bytes, expires_at: datetime) -> Tuple[bytes, str, datetime]:
+        """Store a rendered body until its inbox expires and return (body, etag, expires_at)"""
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        entry = (body, etag, expires_at)
+
+        # Bodies larger than the whole cache are served but not kept
+        if len(body) > self.max_bytes:
+            return entry
+
+        with self.lock:
+            self.remove(message_id)
+            self.entries[message_id] = entry
+            self.current_bytes += len(body)
+
+            while self.current_bytes > self.max_bytes:
+                _, (old_body, _, _) = self.entries.popitem(last=False)
+                self.current_bytes -= len(old_body)
+
+        return entry
+
+    def invalidate(self, message_id: str):
+        """Drop a message from the cache"""
+        with self.lock:
+            self.remove(message_id)
+
+    def remove(self, message_id: str):
+        # Caller holds the lock
+        entry = self.entries.pop(message_id, None)
+        if entry is not None:
+            self.current_bytes -= len(entry[0])
+
+message_cache = MessageCache(settings.MESSAGE_CACHE_MAX_MB * 1024 * 1024)
@@ -0,0 +1,177 @@
+"""
+Prometheus metrics, served as text by GET /metrics.
+
+A small in-process registry (counters, gauges, histograms with labels) in
+the Prometheus text exposition format, so no client library is needed.
+Values are per worker process; run one uvicorn worker per scrape target.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Seconds: sub-millisecond header checks up to multi-second commits of large mail
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Bytes: 1KB .. 25MB
+SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(8)) + (25 * 1024 * 1024,)
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+
+    def key(self, labels: Tuple[str, ...]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(label) for label in labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self.lock:
+            values = dict(self.values)
+        return self.header() + [
+            f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+class Gauge(Metric):
+    """Gauge read from a callback at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], Optional[float]]):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def collect(self) -> List[str]:
+        try:
+            value = self.callback()
+        except Exception:
+            value = None
+        if value is None:
+            return []
+        return self.header() + [f"{self.name} {format_value(value)}"]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> (per-bucket counts, sum)
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key) or ([0] * len(self.buckets), 0.0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, *labels: str):
+        """Observe the duration of the with-block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def collect(self) -> List[str]:
+        with self.lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+        lines = self.header()
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = format_labels(self.labelnames, key, f'le="{format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+# Ingest
+ingest_stage_seconds = registry.register(Histogram(
+    "tempmail_ingest_stage_seconds",
+    "Time spent in each inbound mail stage (read_body, screen, parse, lookup, store, "
+    "attachments, quota, commit, broadcast, total)",
+    ("stage",)
+))
+inbound_messages_total = registry.register(Counter(
+    "tempmail_inbound_messages_total",
+    "Inbound emails by outcome",
+    ("result",)
+))
+inbound_message_bytes = registry.register(Histogram(
+    "tempmail_inbound_message_bytes", "Size of inbound raw emails", buckets=SIZE_BUCKETS
+))
+attachment_bytes = registry.register(Histogram(
+    "tempmail_attachment_bytes", "Size of stored attachments", buckets=SIZE_BUCKETS
+))
+
+# Cleanup
+cleanup_seconds = registry.register(Histogram(
+    "tempmail_cleanup_duration_seconds", "Duration of expired-inbox cleanup batches"
+))
+cleanup_deleted_total = registry.register(Counter(
+    "tempmail_cleanup_deleted_total", "Rows removed by cleanup", ("kind",)
+))
+
+def register_gauge(name: str, documentation: str, callback: Callable[[], Optional[float]]):
+    """Add a gauge evaluated at scrape time"""
+    registry.register(Gauge(name, documentation, callback))
+
+def render_metrics() -> str:
+    return registry.render()
@@ -0,0 +1,423 @@
+"""
+Append-only pack-file storage for small attachments.
+
+Small blobs are appended to rolling segment files instead of getting a
+file each. Every segment has an append-only index next to it:
+
+    <segment>.pack   concatenated blob bytes
+    <segment>.idx    one record per line:
+                       A <key> <offset> <length>   blob added
+                       D <key>                     blob deleted
+                       S <unix time>               segment sealed
+
+Segments are named ``<created ms>-<pid>`` so each worker process appends
+only to its own segments; other processes pick up new index records
+lazily on lookup misses. Reads are served from ``mmap`` slices. A process
+keeps the segment it appends to flock'ed until it is sealed, so
+maintenance only touches sealed segments and those of processes that died.
+Every process seals its own segment once it is PACK_SEGMENT_MAX_MINUTES
+old (maintain_local), so idle workers don't pin their segments.
+
+An attachment never outlives its inbox, so a segment is fully dead
+MAX_INBOX_LIFETIME_HOURS after its last write and is dropped whole;
+sealed segments that are mostly dead earlier are compacted. Cleanup I/O
+is therefore proportional to segments, not attachments. Blobs larger
+than PACK_MAX_BLOB_KB go to the wrapped backend.
+"""
+import fcntl
+import mmap
+import os
+import threading
+import time
+from typing import BinaryIO, Dict, Optional, Tuple
+from app.services.storage import StorageBackend, StorageWriter, validate_key
+
+class MemoryviewReader:
+    """Read-only stream over an mmap slice"""
+
+    def __init__(self, view: memoryview):
+        self.view = view
+        self.position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = len(self.view) - self.position
+        chunk = self.view[self.position:self.position + size]
+        self.position += len(chunk)
+        return chunk.tobytes()
+
+    def close(self):
+        self.view.release()
+
+class PackWriter(StorageWriter):
+    """Buffer small blobs in memory; spill to the wrapped backend once too large"""
+
+    def __init__(self, storage: "PackStorage", key: str):
+        self.storage = storage
+        self.key = key
+        self.chunks = []
+        self.size = 0
+        self.spilled: Optional[StorageWriter] = None
+
+    def write(self, data: bytes):
+        if self.spilled is not None:
+            self.spilled.write(data)
+            return
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.size > self.storage.max_blob_size:
+            self.spilled = self.storage.base.writer(self.key)
+            for chunk in self.chunks:
+                self.spilled.write(chunk)
+            self.chunks = []
+
+    def commit(self):
+        if self.spilled is not None:
+            self.spilled.commit()
+        else:
+            self.storage.append(self.key, b"".join(self.chunks))
+            self.chunks = []
+
+    def abort(self):
+        if self.spilled is not None:
+            self.spilled.abort()
+        self.chunks = []
+
+class PackStorage(StorageBackend):
+    """Pack small blobs into rolling segment files, delegate the rest"""
+
+    def __init__(self, base: StorageBackend, pack_dir: str, max_blob_size: int,
+                 segment_max_size: int, segment_max_age: int, lifetime: int,
+                 compact_dead_ratio: float):
+        self.base = base
+        self.pack_dir = pack_dir
+        self.max_blob_size = max_blob_size
+        self.segment_max_size = segment_max_size
+        self.segment_max_age = segment_max_age
+        self.lifetime = lifetime
+        self.compact_dead_ratio = compact_dead_ratio
+
+        self.lock = threading.RLock()
+        # key -> (segment, offset, length)
+        self.index: Dict[str, Tuple[str, int, int]] = {}
+        # segment -> {"live", "dead", "sealed_at"}
+        self.segments: Dict[str, dict] = {}
+        # segment -> bytes of its .idx already applied
+        self.idx_offsets: Dict[str, int] = {}
+        self.maps: Dict[str, mmap.mmap] = {}
+
+        self.active: Optional[str] = None
+        self.active_file = None
+        self.active_size = 0
+        self.active_opened_at = 0.0
+
+        os.makedirs(pack_dir, exist_ok=True)
+        self.refresh()
+
+    # Paths
+
+    def pack_path(self, segment: str) -> str:
+        return os.path.join(self.pack_dir, f"{segment}.pack")
+
+    def idx_path(self, segment: str) -> str:
+        return os.path.join(self.pack_dir, f"{segment}.idx")
+
+    def append_index(self, segment: str, record: str, create: bool = False):
+        """Append a record; FileNotFoundError if the segment is gone (unless creating it)"""
+        # O_APPEND keeps short records from different processes intact
+        flags = os.O_WRONLY | os.O_APPEND | (os.O_CREAT if create else 0)
+        fd = os.open(self.idx_path(segment), flags, 0o644)
+        try:
+            os.write(fd, record.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+    # Index maintenance
+
+    def refresh(self, full: bool = False):
+        """Apply index records written since the last refresh (by any process)"""
+        with self.lock:
+            if full:
+                self.index.clear()
+                self.segments.clear()
+                self.idx_offsets.clear()
+                self.close_maps()
+
+            names = sorted(
+                name[:-4] for name in os.listdir(self.pack_dir) if name.endswith(".idx")
+            )
+            for segment in names:
+                self.apply_index(segment)
+
+            # Forget segments removed by another process
+            for segment in set(self.segments) - set(names):
+                self.forget_segment(segment)
+
+    def apply_index(self, segment: str):
+        offset = self.idx_offsets.get(segment, 0)
+        try:
+            with open(self.idx_path(segment), "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        # Only complete lines; a partial record is re-read next time
+        end = data.rfind(b"\n") + 1
+        self.idx_offsets[segment] = offset + end
+        info = self.segments.setdefault(segment, {"live": 0, "dead": 0, "sealed_at": None})
+
+        for line in data[:end].decode("utf-8", errors="ignore").splitlines():
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == "A" and len(parts) == 4:
+                key, start, length = parts[1], int(parts[2]), int(parts[3])
+                previous = self.index.get(key)
+                if previous:
+                    self.mark_dead(previous[0], previous[2])
+                self.index[key] = (segment, start, length)
+                info["live"] += length
+            elif parts[0] == "D" and len(parts) == 2:
+                location = self.index.get(parts[1])
+                if location and location[0] == segment:
+                    del self.index[parts[1]]
+                    self.mark_dead(segment, location[2])
+            elif parts[0] == "S" and len(parts) == 2:
+                info["sealed_at"] = float(parts[1])
+
+    def mark_dead(self, segment: str, length: int):
+        info = self.segments.get(segment)
+        if info:
+            info["live"] -= length
+            info["dead"] += length
+
+    def forget_segment(self, segment: str):
+        self.segments.pop(segment, None)
+        self.idx_offsets.pop(segment, None)
+        mapped = self.maps.pop(segment, None)
+        if mapped is not None:
+            try:
+                mapped.close()
+            except BufferError:
+                # Still referenced by an open reader; released with it
+                pass
+        for key in [k for k, loc in self.index.items() if loc[0] == segment]:
+            del self.index[key]
+
+    def close_maps(self):
+        for segment in list(self.maps):
+            mapped = self.maps.pop(segment)
+            try:
+                mapped.close()
+            except BufferError:
+                pass
+
+    def locate(self, key: str) -> Optional[Tuple[str, int, int]]:
+        """Find a packed blob, picking up other processes' index records if needed"""
+        with self.lock:
+            location = self.index.get(key)
+            if location is None:
+                self.refresh()
+                location = self.index.get(key)
+            return location
+
+    # Writing
+
+    def roll_if_needed(self, incoming: int):
+        now = time.time()
+        if self.active is not None and (
+            self.active_size + incoming > self.segment_max_size
+            or now - self.active_opened_at > self.segment_max_age
+        ):
+            self.seal_active()
+
+        if self.active is None:
+            created = int(now * 1000)
+            # A segment sealed within the same millisecond must not be reopened
+            while os.path.exists(self.idx_path(f"{created:015d}-{os.getpid()}")):
+                created += 1
+            self.active = f"{created:015d}-{os.getpid()}"
+            self.active_file = open(self.pack_path(self.active), "ab")
+            # Held until sealed; locked before the .idx makes the segment visible
+            fcntl.flock(self.active_file.fileno(), fcntl.LOCK_EX)
+            self.active_size = self.active_file.tell()
+            self.active_opened_at = now
+            self.segments.setdefault(self.active, {"live": 0, "dead": 0, "sealed_at": None})
+            self.append_index(self.active, "", create=True)
+
+    def seal_active(self):
+        if self.active is None:
+            return
+        sealed_at = time.time()
+        self.append_index(self.active, f"S {sealed_at}\n")
+        # Closing releases the lock, after the segment is marked sealed
+        self.active_file.close()
+        self.segments[self.active]["sealed_at"] = sealed_at
+        self.active = None
+        self.active_file = None
+
+    def append(self, key: str, data: bytes):
+        """Append a blob to the active segment and index it"""
+        validate_key(key)
+        with self.lock:
+            self.roll_if_needed(len(data))
+            offset = self.active_size
+            self.active_file.write(data)
+            self.active_file.flush()
+            self.active_size += len(data)
+            self.append_index(self.active, f"A {key} {offset} {len(data)}\n")
+            self.apply_index(self.active)
+
+    # StorageBackend interface
+
+    def writer(self, key: str) -> StorageWriter:
+        validate_key(key)
+        return PackWriter(self, key)
+
+    def mapping(self, segment: str, needed: int) -> mmap.mmap:
+        mapped = self.maps.get(segment)
+        if mapped is None or len(mapped) < needed:
+            if segment == self.active:
+                self.active_file.flush()
+            with open(self.pack_path(segment), "rb") as f:
+                new_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if mapped is not None:
+                try:
+                    mapped.close()
+                except BufferError:
+                    pass
+            self.maps[segment] = mapped = new_map
+        return mapped
+
+    def open(self, key: str) -> BinaryIO:
+        if key not in self.index:
+            try:
+                return self.base.open(key)
+            except FileNotFoundError:
+                # Possibly packed by another worker process
+                if self.locate(key) is None:
+                    raise
+
+        for attempt in range(2):
+            with self.lock:
+                location = self.index.get(key)
+                if location is None:
+                    break
+                segment, offset, length = location
+                try:
+                    mapped = self.mapping(segment, offset + length)
+                    return MemoryviewReader(memoryview(mapped)[offset:offset + length])
+                except FileNotFoundError:
+                    # Segment was compacted or dropped by another process
+                    self.refresh(full=True)
+        raise FileNotFoundError(key)
+
+    def delete(self, key: str):
+        with self.lock:
+            location = self.index.get(key)
+            if location is None:
+                # Possibly packed by another process since the last refresh
+                self.refresh()
+                location = self.index.get(key)
+            if location is None:
+                self.base.delete(key)
+                return
+
+            for attempt in range(2):
+                try:
+                    self.append_index(location[0], f"D {key}\n")
+                except FileNotFoundError:
+                    # Segment compacted or dropped by another process: the
+                    # blob moved to another segment, or is gone with it
+                    self.refresh(full=True)
+                    location = self.index.get(key)
+                    if location is None:
+                        return
+                    continue
+                self.apply_index(location[0])
+                return
+
+    def stat(self, key: str) -> Optional[int]:
+        location = self.index.get(key)
+        if location is None:
+            size = self.base.stat(key)
+            if size is not None:
+                return size
+            location = self.locate(key)
+        return location[2] if location else None
+
+    def maintain(self):
+        """Drop expired segments and compact sealed segments that are mostly dead"""
+        now = time.time()
+        dropped = 0
+        compacted = 0
+
+        with self.lock:
+            self.refresh()
+            self.seal_if_idle()
+
+            for segment, info in sorted(self.segments.items()):
+                if segment == self.active:
+                    continue
+
+                owner_lock = None
+                if info["sealed_at"] is None:
+                    # Unsealed segment of another process: only once that
+                    # process is gone and its lock is free
+                    owner_lock = self.lock_abandoned(segment)
+                    if owner_lock is None:
+                        continue
+                try:
+                    last_write = info["sealed_at"] or os.path.getmtime(self.pack_path(segment))
+                    total = info["live"] + info["dead"]
+                    if now - last_write > self.lifetime or info["live"] <= 0:
+                        self.drop_segment(segment)
+                        dropped += 1
+                    elif total and info["dead"] / total >= self.compact_dead_ratio:
+                        self.compact_segment(segment)
+                        compacted += 1
+                finally:
+                    if owner_lock is not None:
+                        os.close(owner_lock)
+
+        return dropped, compacted
+
+    def maintain_local(self):
+        """Seal this process's segment once it is too old, even without new writes"""
+        with self.lock:
+            self.seal_if_idle()
+
+    def seal_if_idle(self):
+        if self.active is not None and time.time() - self.active_opened_at > self.segment_max_age:
+            self.seal_active()
+
+    def lock_abandoned(self, segment: str) -> Optional[int]:
+        """Lock an unsealed segment whose writer has exited; None while it is still held"""
+        try:
+            fd = os.open(self.pack_path(segment), os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def drop_segment(self, segment: str):
+        self.forget_segment(segment)
+        for path in (self.idx_path(segment), self.pack_path(segment)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def compact_segment(self, segment: str):
+        """Move live blobs into the active segment, then drop the old one"""
+        live = [(key, loc) for key, loc in self.index.items() if loc[0] == segment]
+        with open(self.pack_path(segment), "rb") as f:
+            for key, (_, offset, length) in live:
+                f.seek(offset)
+                self.append(key, f.read(length))
+        self.drop_segment(segment)
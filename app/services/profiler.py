@@ -0,0 +1,73 @@
+"""
+Sampling profiler for the live worker.
+
+A background thread samples the Python stacks of every thread (the event
+loop, the threadpool, the ingest writer) at a fixed interval for a given
+number of seconds. Stacks are aggregated in the collapsed format used by
+flamegraph.pl, speedscope and most flamegraph viewers:
+
+    thread:MainThread;run (asyncio/runners.py:118);...;persist_parsed_email (app/services/ingest.py:36) 42
+
+Nothing runs between profiles; sampling costs one sys._current_frames()
+walk per interval while it runs.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Leaf frames of threads parked waiting for work (event loop selector, idle pool threads)
+IDLE_LEAVES = ("select", "wait")
+
+class ProfilerBusy(Exception):
+    """Another profile is already running in this worker"""
+
+def frame_label(code, lineno: int) -> str:
+    filename = code.co_filename
+    if filename.startswith(REPO_ROOT + os.sep):
+        filename = os.path.relpath(filename, REPO_ROOT)
+    else:
+        # Library code: keep the package-relative tail
+        filename = "/".join(filename.replace(os.sep, "/").split("/")[-2:])
+    return f"{code.co_name} ({filename}:{lineno})"
+
+class SamplingProfiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def profile(self, seconds: float, interval: float, include_idle: bool = False) -> Dict:
+        """Sample all threads; blocks for `seconds` (run it off the event loop)"""
+        if not self.lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            stacks: Counter = Counter()
+            own_id = threading.get_ident()
+            samples = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    if not include_idle and frame.f_code.co_name in IDLE_LEAVES:
+                        continue
+                    frames = []
+                    while frame is not None:
+                        frames.append(frame_label(frame.f_code, frame.f_lineno))
+                        frame = frame.f_back
+                    frames.append(f"thread:{names.get(thread_id, thread_id)}")
+                    stacks[";".join(reversed(frames))] += 1
+                samples += 1
+                time.sleep(interval)
+            return {"samples": samples, "interval": interval, "stacks": stacks}
+        finally:
+            self.lock.release()
+
+def collapsed(profile: Dict) -> str:
+    """Collapsed-stack text, one "frame;frame;... count" line per distinct stack"""
+    return "".join(f"{stack} {count}\n" for stack, count in profile["stacks"].most_common())
+
+profiler = SamplingProfiler()
@@ -0,0 +1,128 @@
+"""
+Slow-query capture.
+
+SQLAlchemy cursor events time every statement; only those slower than
+SLOW_QUERY_MS are logged and kept (with bound parameters and the calling
+route) in a ring buffer served by GET /api/admin/slow-queries. This
+replaces engine echo, which logged every statement.
+
+The calling route comes from RequestContextMiddleware. Work outside a
+request (writer thread, spool workers, cleanup) is labelled with its
+ingest trace name, or "background".
+"""
+import time
+import threading
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.services.metrics import registry, Counter
+from app.services.tracing import current_trace
+from app.config import settings
+
+MAX_STATEMENT_CHARS = 2000
+MAX_PARAMETER_CHARS = 200
+MAX_PARAMETER_ROWS = 5
+
+# ASGI scope of the request being served
+current_scope: ContextVar[Optional[dict]] = ContextVar("current_scope", default=None)
+
+slow_queries_total = registry.register(Counter(
+    "tempmail_db_slow_queries_total", "SQL statements slower than SLOW_QUERY_MS", ("route",)
+))
+
+class RequestContextMiddleware:
+    """Make the ASGI scope available to code running for the request (including threadpool calls)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        token = current_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_scope.reset(token)
+
+def calling_route() -> Tuple[str, Optional[str]]:
+    """(route name, request path) of the code running the statement"""
+    scope = current_scope.get()
+    if scope is not None:
+        # The router stores the matched endpoint in the scope
+        endpoint = scope.get("endpoint")
+        path = f"{scope.get('method', 'WS')} {scope.get('path', '')}"
+        return (endpoint.__name__ if endpoint is not None else path), path
+    trace = current_trace.get()
+    if trace is not None:
+        return trace.root.name, None
+    return "background", None
+
+def shorten(value, limit: int) -> str:
+    text = repr(value)
+    return text if len(text) <= limit else text[:limit] + f"... ({len(text)} chars)"
+
+def format_parameters(parameters, executemany: bool):
+    if executemany:
+        rows = list(parameters or [])
+        shown = [format_parameters(row, False) for row in rows[:MAX_PARAMETER_ROWS]]
+        return {"rows": len(rows), "first": shown}
+    if isinstance(parameters, dict):
+        return {key: shorten(value, MAX_PARAMETER_CHARS) for key, value in parameters.items()}
+    return [shorten(value, MAX_PARAMETER_CHARS) for value in (parameters or ())]
+
+class SlowQueryLog:
+    """Statements over the threshold, newest last"""
+
+    def __init__(self, threshold_ms: int, size: int):
+        self.threshold = threshold_ms / 1000
+        self.entries = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def install(self, engine: Engine):
+        if self.threshold <= 0:
+            return
+        event.listen(engine, "before_cursor_execute", self.before_execute)
+        event.listen(engine, "after_cursor_execute", self.after_execute)
+
+    def before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Kept on the per-statement execution context, so failed statements leave nothing behind
+        if context is not None:
+            context.query_started = time.perf_counter()
+
+    def after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "query_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        if elapsed < self.threshold:
+            return
+        route, path = calling_route()
+        entry = {
+            "at": datetime.utcnow().isoformat() + "Z",
+            "duration_ms": round(elapsed * 1000, 2),
+            "route": route,
+            "path": path,
+            "shard": context.execution_options.get("shard_id", 0),
+            "replica": context.execution_options.get("replica", False),
+            "statement": statement[:MAX_STATEMENT_CHARS],
+            "parameters": format_parameters(parameters, executemany),
+        }
+        with self.lock:
+            self.entries.append(entry)
+        slow_queries_total.inc(route)
+        print(f"Slow query ({entry['duration_ms']} ms, {path or route}): {' '.join(statement.split())[:300]}")
+
+    def recent(self, limit: int) -> List[dict]:
+        with self.lock:
+            return list(self.entries)[-limit:][::-1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+slow_query_log = SlowQueryLog(settings.SLOW_QUERY_MS, settings.SLOW_QUERY_LOG_SIZE)
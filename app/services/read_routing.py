@@ -0,0 +1,131 @@
+"""
+Read routing to replica databases.
+
+Read-only endpoints (inbox details, message lists and search, message
+detail, attachment downloads) take their session from get_read_db, which
+picks one of the shard's replicas (DATABASE_REPLICA_URLS) when it has any.
+Everything else, including verification-code long polls, stays on the
+primary through database.get_db.
+
+Replicas lag the primary, so reads go to the primary for
+READ_REPLICA_PIN_SECONDS after a write the reader is likely to look for:
+
+- a client that created inboxes, or got a code from latest-code, gets a
+  short-lived cookie (any worker);
+- an inbox that just received mail is pinned in the worker that stored it.
+
+Pins of other workers aren't visible, so clients also pass the id of the
+newest message they were told about (the WebSocket new_message event) as
+?seen=<message_id>; a replica that doesn't have that message yet hands the
+read to the primary.
+
+A row the replica doesn't have yet (an inbox created moments ago, a message
+announced over the WebSocket) is looked up again on the primary with
+use_primary before answering 404.
+"""
+import random
+import time
+from typing import Dict, Optional
+from fastapi import Request, Response
+from sqlalchemy.orm import Session
+from app.database import engines, replica_sessions, session_for_shard, shard_for_path
+from app.models import Inbox, Message
+from app.services.metrics import registry, Counter
+from app.config import settings
+
+PIN_COOKIE = "tempmail_read_pin"
+# Query parameter with the id of the newest message the client knows of
+SEEN_PARAM = "seen"
+# Expired pins are dropped once this many inboxes are pinned
+PIN_PRUNE_SIZE = 10000
+
+replica_reads_total = registry.register(Counter(
+    "tempmail_db_reads_total",
+    "Read-only requests by database: replica, primary_pinned (recent writes), primary_fallback (row missing on the replica)",
+    ("target",)
+))
+
+class InboxPins:
+    """Inboxes whose reads go to the primary until a deadline (this worker only)"""
+
+    def __init__(self, seconds: int):
+        self.seconds = seconds
+        # Map of inbox_id -> monotonic deadline
+        self.deadlines: Dict[str, float] = {}
+
+    def pin(self, inbox_id: str):
+        if self.seconds <= 0:
+            return
+        now = time.monotonic()
+        if len(self.deadlines) >= PIN_PRUNE_SIZE:
+            self.deadlines = {key: deadline for key, deadline in self.deadlines.items() if deadline > now}
+        self.deadlines[inbox_id] = now + self.seconds
+
+    def is_pinned(self, inbox_id: str) -> bool:
+        deadline = self.deadlines.get(inbox_id)
+        return deadline is not None and deadline > time.monotonic()
+
+inbox_pins = InboxPins(settings.READ_REPLICA_PIN_SECONDS)
+
+def pin_client(response: Response):
+    """Send this client's reads to the primary for the pin window (after its writes)"""
+    if settings.READ_REPLICA_PIN_SECONDS <= 0 or not any(replica_sessions):
+        return
+    until = time.time() + settings.READ_REPLICA_PIN_SECONDS
+    response.set_cookie(
+        PIN_COOKIE, f"{until:.3f}", max_age=settings.READ_REPLICA_PIN_SECONDS,
+        httponly=True, samesite="lax"
+    )
+
+def client_pinned(request: Request) -> bool:
+    try:
+        return float(request.cookies.get(PIN_COOKIE, "0")) > time.time()
+    except ValueError:
+        return False
+
+def get_read_db(request: Request):
+    """Dependency for read-only routes: a replica session unless the reader may need recent writes"""
+    shard = shard_for_path(request.path_params)
+    sessions = replica_sessions[shard]
+    inbox_id = request.path_params.get("inbox_id")
+
+    if not sessions:
+        db = session_for_shard(shard)
+    elif client_pinned(request) or (inbox_id is not None and inbox_pins.is_pinned(inbox_id)):
+        replica_reads_total.inc("primary_pinned")
+        db = session_for_shard(shard)
+    else:
+        replica_reads_total.inc("replica")
+        db = random.choice(sessions)()
+        seen = request.query_params.get(SEEN_PARAM)
+        if inbox_id is not None and seen and not has_message(db, inbox_id, seen):
+            # The client heard of a message this replica hasn't received yet
+            use_primary(db)
+    try:
+        yield db
+    finally:
+        db.close()
+
+def has_message(db: Session, inbox_id: str, message_id: str) -> bool:
+    row = db.query(Message.id).filter(Message.id == message_id, Message.inbox_id == inbox_id).first()
+    return row is not None
+
+def use_primary(db: Session) -> bool:
+    """
+    Point a replica session at its shard's primary, to look again for a
+    row the replica doesn't have yet. False when db already reads the primary.
+    """
+    if not db.info.get("replica"):
+        return False
+    replica_reads_total.inc("primary_fallback")
+    db.close()
+    db.bind = engines[db.info["shard"]]
+    db.info["replica"] = False
+    return True
+
+def find_inbox(db: Session, inbox_id: str) -> Optional[Inbox]:
+    """Inbox by id, looked up again on the primary when a replica doesn't have it yet"""
+    inbox = db.query(Inbox).filter(Inbox.id == inbox_id).first()
+    if inbox is None and use_primary(db):
+        inbox = db.query(Inbox).filter(Inbox.id == inbox_id).first()
+    return inbox
@@ -0,0 +1,166 @@
+"""
+Full-text search index over inbox messages.
+
+One row per message (per recipient inbox) with subject, sender and body
+text (HTML bodies are converted to text). Backed by:
+
+- SQLite: an FTS5 virtual table. inbox_id and message_id are indexed
+  columns too, so "this inbox" and deletes are index lookups (MATCH)
+  rather than scans.
+- PostgreSQL: a table with a generated tsvector column and a GIN index.
+
+Rows are written in the ingest transaction and removed by eviction and
+expiry cleanup, so the index never outlives the messages.
+"""
+import html
+from typing import Iterable, List
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.services.email_parser import html_to_text
+
+MAX_BODY_CHARS = 100_000
+
+# Snippets mark matches with these private-use characters, so the message
+# text can be HTML-escaped before the marks become <b> tags
+MATCH_START = "\ue000"
+MATCH_END = "\ue001"
+
+SQLITE_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5(
+        message_id, inbox_id, subject, from_address, body,
+        tokenize = 'unicode61'
+    )
+    """
+]
+
+POSTGRES_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS message_search (
+        message_id VARCHAR PRIMARY KEY,
+        inbox_id VARCHAR NOT NULL,
+        subject TEXT,
+        from_address TEXT,
+        body TEXT,
+        document tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', coalesce(subject, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(from_address, '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(body, '')), 'C')
+        ) STORED
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_message_search_document ON message_search USING GIN (document)",
+    "CREATE INDEX IF NOT EXISTS ix_message_search_inbox_id ON message_search (inbox_id)",
+]
+
+def searchable_body(text_content: str, html_content: str) -> str:
+    body = text_content or (html_to_text(html_content) if html_content else "")
+    return body[:MAX_BODY_CHARS]
+
+def dialect(db: Session) -> str:
+    return db.get_bind().dialect.name
+
+def create_search_index(bind):
+    """Create the index table for the connected database (idempotent)"""
+    statements = POSTGRES_SCHEMA if bind.dialect.name == "postgresql" else SQLITE_SCHEMA
+    for statement in statements:
+        bind.execute(text(statement))
+
+def fts_phrase(value: str) -> str:
+    """Quote a value as an FTS5 phrase"""
+    return '"' + value.replace('"', '""') + '"'
+
+def fts_query(query: str) -> str:
+    """User query -> FTS5 query: every term must match; a trailing * means prefix"""
+    terms = []
+    for term in query.split():
+        prefix = term.endswith("*")
+        term = term.rstrip("*")
+        if term:
+            terms.append(fts_phrase(term) + ("*" if prefix else ""))
+    return " ".join(terms)
+
+def without_marks(value: str) -> str:
+    """Drop match-mark characters from indexed text so only real matches become <b>"""
+    return value.replace(MATCH_START, "").replace(MATCH_END, "")
+
+def index_messages(db: Session, messages: Iterable, subject: str, from_address: str, body: str):
+    """Add index rows for newly stored messages (same transaction)"""
+    rows = [
+        {
+            "message_id": message.id,
+            "inbox_id": message.inbox_id,
+            "subject": without_marks(subject or ""),
+            "from_address": from_address or "",
+            "body": without_marks(body or "")
+        }
+        for message in messages
+    ]
+    if rows:
+        db.execute(text(
+            "INSERT INTO message_search (message_id, inbox_id, subject, from_address, body) "
+            "VALUES (:message_id, :inbox_id, :subject, :from_address, :body)"
+        ), rows)
+
+def delete_messages(db: Session, message_ids: List[str]):
+    """Remove index rows of deleted messages"""
+    if not message_ids:
+        return
+    if dialect(db) == "postgresql":
+        db.execute(text("DELETE FROM message_search WHERE message_id = ANY(:ids)"), {"ids": list(message_ids)})
+        return
+    db.execute(
+        text("DELETE FROM message_search WHERE rowid IN "
+             "(SELECT rowid FROM message_search WHERE message_search MATCH :match)"),
+        [{"match": "message_id:" + fts_phrase(message_id)} for message_id in message_ids]
+    )
+
+def delete_inbox(db: Session, inbox_id: str):
+    """Remove all index rows of an inbox"""
+    if dialect(db) == "postgresql":
+        db.execute(text("DELETE FROM message_search WHERE inbox_id = :inbox_id"), {"inbox_id": inbox_id})
+        return
+    db.execute(
+        text("DELETE FROM message_search WHERE rowid IN "
+             "(SELECT rowid FROM message_search WHERE message_search MATCH :match)"),
+        {"match": "inbox_id:" + fts_phrase(inbox_id)}
+    )
+
+def search_inbox(db: Session, inbox_id: str, query: str, limit: int) -> List[dict]:
+    """Ranked matches in one inbox: [{"message_id", "rank", "snippet"}], best first"""
+    if dialect(db) == "postgresql":
+        rows = db.execute(text(
+            "SELECT message_id, ts_rank(document, q) AS rank, "
+            "ts_headline('simple', coalesce(subject, '') || ' ' || coalesce(body, ''), q, "
+            ":options) AS snippet "
+            "FROM message_search, websearch_to_tsquery('simple', :query) q "
+            "WHERE inbox_id = :inbox_id AND document @@ q "
+            "ORDER BY rank DESC LIMIT :limit"
+        ), {
+            "query": query, "inbox_id": inbox_id, "limit": limit,
+            "options": f"StartSel={MATCH_START}, StopSel={MATCH_END}, MaxWords=20, MinWords=8"
+        }).fetchall()
+    else:
+        match = fts_query(query)
+        if not match:
+            return []
+        rows = db.execute(text(
+            "SELECT message_id, -bm25(message_search, 0, 0, 10.0, 5.0, 1.0) AS rank, "
+            "snippet(message_search, 4, :start, :end, '…', 16) AS snippet "
+            "FROM message_search WHERE message_search MATCH :match "
+            "ORDER BY rank DESC LIMIT :limit"
+        ), {
+            "match": f"inbox_id:{fts_phrase(inbox_id)} AND {{subject from_address body}}: ({match})",
+            "limit": limit, "start": MATCH_START, "end": MATCH_END
+        }).fetchall()
+
+    return [
+        {"message_id": row.message_id, "rank": float(row.rank), "snippet": highlight(row.snippet)}
+        for row in rows
+    ]
+
+def highlight(snippet: str) -> str:
+    """HTML-escape a snippet (untrusted message text) and turn the match marks into <b> tags"""
+    if not snippet:
+        return snippet
+    return html.escape(snippet).replace(MATCH_START, "<b>").replace(MATCH_END, "</b>")
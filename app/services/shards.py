@@ -0,0 +1,75 @@
+"""
+Shard routing for inbox data.
+
+Every inbox lives on one database shard, chosen by a hash of its address.
+Its messages, contents, attachments, codes, search rows and dedup keys live
+on the same shard, and their ids carry the shard number, so requests by id
+go straight to the right database (database.get_db).
+
+Shard 0 is the main database. While inboxes created there before sharding
+was enabled (DATABASE_SHARDS_SINCE) can still be valid, addresses are
+looked up on shard 0 first.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List
+from sqlalchemy import func
+from app.database import engines, SessionLocal, session_for_shard, shard_for_email, legacy_inboxes_possible
+from app.models import Inbox
+
+# Keep IN lists below SQLite's bound-parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+def shard_count() -> int:
+    return len(engines)
+
+def address_shards(addresses: Iterable[str]) -> Dict[str, int]:
+    """Map each address to the shard holding (or that will hold) its inbox"""
+    shards = {address: shard_for_email(address) for address in addresses}
+    if not legacy_inboxes_possible():
+        return shards
+
+    moved = [address for address, shard in shards.items() if shard != 0]
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        for i in range(0, len(moved), LOOKUP_CHUNK_SIZE):
+            legacy = db.query(Inbox.email)\
+                .filter(Inbox.email.in_(moved[i:i + LOOKUP_CHUNK_SIZE]))\
+                .filter(Inbox.expires_at > now)\
+                .all()
+            for row in legacy:
+                shards[row.email] = 0
+    finally:
+        db.close()
+    return shards
+
+def address_shard(address: str) -> int:
+    return address_shards([address])[address]
+
+def group_by_shard(addresses: Iterable[str]) -> Dict[int, List[str]]:
+    """Addresses grouped by shard, keeping their order"""
+    groups: Dict[int, List[str]] = {}
+    for address, shard in address_shards(addresses).items():
+        groups.setdefault(shard, []).append(address)
+    return groups
+
+def shard_stats() -> List[dict]:
+    """Row counts per shard"""
+    stats = []
+    for shard, shard_engine in enumerate(engines):
+        db = session_for_shard(shard)
+        try:
+            inboxes, messages, stored_bytes = db.query(
+                func.count(Inbox.id), func.coalesce(func.sum(Inbox.message_count), 0),
+                func.coalesce(func.sum(Inbox.stored_bytes), 0)
+            ).one()
+            stats.append({
+                "shard": shard,
+                "database": shard_engine.url.render_as_string(hide_password=True),
+                "inboxes": inboxes,
+                "messages": messages,
+                "stored_bytes": stored_bytes
+            })
+        finally:
+            db.close()
+    return stats
@@ -0,0 +1,287 @@
+"""
+Attachment storage backends.
+
+Attachments are addressed by a storage key (``<uuid><ext>``) stored in
+``Attachment.file_path``. Backends implement put / open-stream / delete /
+stat for those keys:
+
+- LocalShardedStorage: files under ATTACHMENTS_PATH in a two-level
+  hash-sharded layout (``ab/cd/<key>``) so no directory grows unbounded.
+- S3Storage: an S3-compatible bucket (AWS, MinIO, ...). Requires boto3.
+- PackStorage (PACK_SMALL_ATTACHMENTS): wraps either of the above and
+  appends small blobs to local segment files (see pack_storage.py).
+
+Rows written before sharding hold a filesystem path instead of a key; the
+local backend still serves and deletes those, and ``python -m
+app.migrate_storage`` moves them into the configured backend.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import BinaryIO, Optional
+from app.config import settings
+
+KEY_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+CHUNK_SIZE = 64 * 1024
+
+def new_storage_key(filename: str) -> str:
+    """Generate a unique storage key keeping the (sanitized) file extension"""
+    return f"{uuid.uuid4()}{Path(filename).suffix}"
+
+def is_legacy_path(key: str) -> bool:
+    """Rows from the flat layout store a filesystem path instead of a key"""
+    return "/" in key or "\\" in key
+
+def validate_key(key: str):
+    if not key or not KEY_PATTERN.match(key) or ".." in key:
+        raise ValueError(f"Invalid storage key: {key!r}")
+
+class StorageWriter(ABC):
+    """Incremental writer; data becomes visible only after commit()"""
+
+    @abstractmethod
+    def write(self, data: bytes):
+        """Append data to the blob"""
+
+    @abstractmethod
+    def commit(self):
+        """Make the blob visible under its key"""
+
+    @abstractmethod
+    def abort(self):
+        """Discard everything written"""
+
+class StorageBackend(ABC):
+    """Interface for attachment blob storage"""
+
+    @abstractmethod
+    def writer(self, key: str) -> StorageWriter:
+        """Start writing a blob under key"""
+
+    def put(self, key: str, data: bytes):
+        """Store a complete blob"""
+        writer = self.writer(key)
+        try:
+            writer.write(data)
+            writer.commit()
+        except Exception:
+            writer.abort()
+            raise
+
+    @abstractmethod
+    def open(self, key: str) -> BinaryIO:
+        """Open a blob for streaming reads; raises FileNotFoundError if missing"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Delete a blob; missing blobs are ignored"""
+
+    @abstractmethod
+    def stat(self, key: str) -> Optional[int]:
+        """Return the blob size, or None if it does not exist"""
+
+    def maintain(self):
+        """Periodic housekeeping, run by expiry cleanup"""
+        pass
+
+    def maintain_local(self):
+        """Periodic housekeeping of this process's own state, run by every worker"""
+        pass
+
+class LocalFileWriter(StorageWriter):
+    """Write to a temp file next to the target and rename on commit"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        self.file = os.fdopen(fd, "wb")
+
+    def write(self, data: bytes):
+        self.file.write(data)
+
+    def commit(self):
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+class LocalShardedStorage(StorageBackend):
+    """Local filesystem with a two-level hash-sharded directory layout"""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, key: str) -> str:
+        """Resolve a key (or a legacy path) to a filesystem path inside root"""
+        if is_legacy_path(key):
+            path = key
+        else:
+            validate_key(key)
+            digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+            path = os.path.join(self.root, digest[:2], digest[2:4], key)
+
+        # Security: Ensure path is within the storage root
+        resolved_path = os.path.realpath(path)
+        resolved_dir = os.path.realpath(self.root)
+        if not resolved_path.startswith(resolved_dir + os.sep):
+            raise ValueError(f"Invalid storage path: {key!r}")
+        return resolved_path
+
+    def writer(self, key: str) -> StorageWriter:
+        return LocalFileWriter(self.path_for(key))
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.path_for(key), "rb")
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path_for(key))
+        except FileNotFoundError:
+            pass
+
+    def stat(self, key: str) -> Optional[int]:
+        try:
+            return os.stat(self.path_for(key)).st_size
+        except FileNotFoundError:
+            return None
+
+class S3Writer(StorageWriter):
+    """Buffer in a spooled temp file, upload on commit"""
+
+    def __init__(self, storage: "S3Storage", key: str):
+        self.storage = storage
+        self.key = key
+        self.buffer = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+
+    def write(self, data: bytes):
+        self.buffer.write(data)
+
+    def commit(self):
+        self.buffer.seek(0)
+        try:
+            self.storage.client.upload_fileobj(
+                self.buffer, self.storage.bucket, self.storage.object_name(self.key)
+            )
+        finally:
+            self.buffer.close()
+
+    def abort(self):
+        self.buffer.close()
+
+class S3Storage(StorageBackend):
+    """S3-compatible object storage (AWS S3, MinIO, ...)"""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None,
+                 access_key_id: Optional[str] = None, secret_access_key: Optional[str] = None,
+                 region: Optional[str] = None):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)")
+
+        self.ClientError = ClientError
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            aws_access_key_id=access_key_id or None,
+            aws_secret_access_key=secret_access_key or None,
+            region_name=region or None
+        )
+
+    def object_name(self, key: str) -> str:
+        validate_key(key)
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def is_missing(self, error) -> bool:
+        code = error.response.get("Error", {}).get("Code")
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    def writer(self, key: str) -> StorageWriter:
+        return S3Writer(self, key)
+
+    def open(self, key: str) -> BinaryIO:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.object_name(key))
+        except self.ClientError as e:
+            if self.is_missing(e):
+                raise FileNotFoundError(key)
+            raise
+        return response["Body"]
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.object_name(key))
+
+    def stat(self, key: str) -> Optional[int]:
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=self.object_name(key))
+        except self.ClientError as e:
+            if self.is_missing(e):
+                return None
+            raise
+        return response["ContentLength"]
+
+def create_storage() -> StorageBackend:
+    """Build the backend selected by STORAGE_BACKEND, optionally packing small blobs"""
+    base = create_base_storage()
+    if not settings.PACK_SMALL_ATTACHMENTS:
+        return base
+
+    from app.services.pack_storage import PackStorage
+    return PackStorage(
+        base=base,
+        pack_dir=settings.PACK_PATH,
+        max_blob_size=settings.PACK_MAX_BLOB_KB * 1024,
+        segment_max_size=settings.PACK_SEGMENT_MAX_MB * 1024 * 1024,
+        segment_max_age=settings.PACK_SEGMENT_MAX_MINUTES * 60,
+        # Attachments never outlive their inbox; allow one cleanup pass of slack
+        lifetime=settings.MAX_INBOX_LIFETIME_HOURS * 3600 + settings.CLEANUP_INTERVAL_MINUTES * 60,
+        compact_dead_ratio=settings.PACK_COMPACT_DEAD_RATIO
+    )
+
+def create_base_storage() -> StorageBackend:
+    if settings.STORAGE_BACKEND == "local":
+        return LocalShardedStorage(settings.ATTACHMENTS_PATH)
+    if settings.STORAGE_BACKEND == "s3":
+        return S3Storage(
+            bucket=settings.S3_BUCKET,
+            prefix=settings.S3_PREFIX,
+            endpoint_url=settings.S3_ENDPOINT_URL,
+            access_key_id=settings.S3_ACCESS_KEY_ID,
+            secret_access_key=settings.S3_SECRET_ACCESS_KEY,
+            region=settings.S3_REGION
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {settings.STORAGE_BACKEND}")
+
+_storage: Optional[StorageBackend] = None
+
+def get_storage() -> StorageBackend:
+    """Return the process-wide storage backend"""
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
+
+def iter_chunks(stream: BinaryIO, chunk_size: int = CHUNK_SIZE):
+    """Yield a blob stream in chunks and close it"""
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        stream.close()
@@ -0,0 +1,174 @@
+"""
+Trace correlation for inbound mail.
+
+Each inbound email gets a trace: mailpipe starts it and passes it in a W3C
+`traceparent` header (with the Postfix queue id in X-Postfix-Queue-Id);
+otherwise the endpoint, LMTP session or spool worker starts one. The ingest
+stages record spans on the current trace, the trace id is stored on every
+Message row and sent with the WebSocket event.
+
+Finished traces are appended to TRACE_EXPORT_PATH as OTLP/JSON lines (one
+ExportTraceServiceRequest per line), the format the OpenTelemetry
+Collector's otlpjsonfile receiver reads.
+"""
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, List, Optional
+from app.services.metrics import ingest_stage_seconds
+from app.config import settings
+
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+# "by mx.example.com (Postfix) with ESMTP id 4Xyz1abc2" in Postfix's Received header
+POSTFIX_QUEUE_ID_RE = re.compile(rb"\(Postfix\)\s+with\s+\S+\s+id\s+([0-9A-Za-z]+)")
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CONSUMER = 5
+
+current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+def new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+def parse_traceparent(value: Optional[str]) -> Optional[tuple]:
+    """(trace_id, parent span id) from a W3C traceparent header, None if invalid"""
+    match = TRACEPARENT_RE.match((value or "").strip().lower())
+    if not match or match.group(1) == "0" * 32:
+        return None
+    return match.group(1), match.group(2)
+
+def postfix_queue_id(raw_email: bytes) -> Optional[str]:
+    """Queue id from the newest Postfix Received header, if any"""
+    headers = raw_email.split(b"\r\n\r\n", 1)[0].split(b"\n\n", 1)[0]
+    match = POSTFIX_QUEUE_ID_RE.search(b" ".join(headers.split()))
+    return match.group(1).decode() if match else None
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "kind", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str], kind: int = SPAN_KIND_INTERNAL,
+                 start_ns: Optional[int] = None, end_ns: Optional[int] = None, attributes: dict = None):
+        self.name = name
+        self.span_id = new_id(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = end_ns
+        self.attributes = attributes or {}
+
+    def to_otlp(self, trace_id: str) -> dict:
+        span = {
+            "traceId": trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [
+                {"key": key, "value": {"intValue": str(value)} if isinstance(value, int) else {"stringValue": str(value)}}
+                for key, value in self.attributes.items() if value is not None
+            ],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+class Trace:
+    """The spans one process records for one inbound email, exported when the root span ends"""
+
+    def __init__(self, name: str, traceparent: Optional[str] = None, kind: int = SPAN_KIND_SERVER, **attributes):
+        parent = parse_traceparent(traceparent)
+        self.trace_id = parent[0] if parent else new_id(16)
+        self.root = Span(name, parent[1] if parent else None, kind, attributes=attributes)
+        self.spans: List[Span] = [self.root]
+
+    @property
+    def traceparent(self) -> str:
+        """Header value for work continued elsewhere (e.g. a spool worker)"""
+        return f"00-{self.trace_id}-{self.root.span_id}-01"
+
+    def set_attribute(self, key: str, value):
+        self.root.attributes[key] = value
+
+    def add_span(self, name: str, start_ns: int, end_ns: int, **attributes):
+        # list.append is atomic; stages of one trace may run in executor threads
+        self.spans.append(Span(name, self.root.span_id, start_ns=start_ns, end_ns=end_ns, attributes=attributes))
+
+    def finish(self):
+        self.root.end_ns = time.time_ns()
+        exporter.export(self)
+
+class FileExporter:
+    """Append traces to a file as OTLP/JSON lines"""
+
+    def __init__(self, path: str, service_name: str = "tempmail"):
+        self.path = path
+        self.service_name = service_name
+        self.lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        if not self.path:
+            return
+        line = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{
+                "scope": {"name": "tempmail.ingest"},
+                "spans": [span.to_otlp(trace.trace_id) for span in trace.spans],
+            }],
+        }]}, separators=(",", ":"))
+        try:
+            with self.lock, open(self.path, "a") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"Error exporting trace {trace.trace_id}: {e}")
+
+exporter = FileExporter(settings.TRACE_EXPORT_PATH)
+
+@contextmanager
+def start_trace(name: str, traceparent: Optional[str] = None, kind: int = SPAN_KIND_SERVER, **attributes):
+    """Make a new trace current for the with-block and export it at the end"""
+    trace = Trace(name, traceparent, kind, **attributes)
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    except Exception as e:
+        trace.set_attribute("error", str(e) or type(e).__name__)
+        raise
+    finally:
+        current_trace.reset(token)
+        trace.finish()
+
+@contextmanager
+def use_trace(trace: Optional[Trace]):
+    """Make an existing trace current (e.g. per email in a group commit)"""
+    token = current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        current_trace.reset(token)
+
+@contextmanager
+def stage(name: str, traces: Optional[Iterable[Optional[Trace]]] = None):
+    """
+    Time an ingest stage: observed in the stage histogram and recorded as a
+    span on the given traces (default: the current one).
+    """
+    start_ns = time.time_ns()
+    try:
+        yield
+    finally:
+        end_ns = time.time_ns()
+        ingest_stage_seconds.observe((end_ns - start_ns) / 1e9, name)
+        for trace in (traces if traces is not None else (current_trace.get(),)):
+            if trace is not None:
+                trace.add_span(name, start_ns, end_ns)
+
+def current_trace_id() -> Optional[str]:
+    trace = current_trace.get()
+    return trace.trace_id if trace else None
@@ -1,6 +1,10 @@
 from fastapi import WebSocket
-from typing import Dict, List
+from typing import Dict, List, Set
+import asyncio
 import json
+import time
+from app.services.tracing import current_trace_id
+from app.services.read_routing import inbox_pins
 
 class ConnectionManager:
     """Manage WebSocket connections and broadcast messages"""
@@ -46,13 +50,44 @@ class ConnectionManager:
         for connection in disconnected:
             self.disconnect(connection, inbox_id)
 
+class MessageWaiters:
+    """Wake long-polling requests when mail for their inbox is stored in this process"""
+    
+    def __init__(self):
+        # Map of inbox_id -> events of waiting requests
+        self.waiters: Dict[str, Set[asyncio.Event]] = {}
+    
+    def subscribe(self, inbox_id: str) -> asyncio.Event:
+        event = asyncio.Event()
+        self.waiters.setdefault(inbox_id, set()).add(event)
+        return event
+    
+    def unsubscribe(self, inbox_id: str, event: asyncio.Event):
+        events = self.waiters.get(inbox_id)
+        if events is not None:
+            events.discard(event)
+            if not events:
+                del self.waiters[inbox_id]
+    
+    def notify(self, inbox_id: str):
+        for event in self.waiters.get(inbox_id, ()):
+            event.set()
+
 manager = ConnectionManager()
+message_waiters = MessageWaiters()
 
 async def broadcast_new_message(inbox_id: str, message_id: str):
-    """Broadcast new message event to WebSocket subscribers"""
+    """Broadcast new message event to WebSocket subscribers and long-poll waiters"""
+    # Subscribers will fetch the new message; replicas may not have it yet
+    inbox_pins.pin(inbox_id)
+    message_waiters.notify(inbox_id)
     await manager.broadcast_to_inbox(inbox_id, {
         "event": "new_message",
         "inbox_id": inbox_id,
-        "message_id": message_id
+        "message_id": message_id,
+        # Epoch seconds when the broadcast started (right after the commit)
+        "sent_at": time.time(),
+        # Ingest trace, to match client-side delivery times with the server's spans
+        "trace_id": current_trace_id()
     })
 
@@ -0,0 +1 @@
+"""Ingest and read-path benchmarks (python -m benchmarks --help)"""
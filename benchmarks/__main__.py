@@ -0,0 +1,160 @@
+"""
+Benchmark suite.
+
+Usage:
+    python -m benchmarks micro [--sizes 1KB,1MB] [--iterations N] [--output results.json]
+    python -m benchmarks load [--workloads inbound,list,download] [--requests N] [--concurrency N]
+    python -m benchmarks all --output results.json
+    python -m benchmarks websocket [--clients N] [--inboxes N] [--rate N] [--duration S] [--url URL]
+    python -m benchmarks corpus DIRECTORY
+    python -m benchmarks compare old.json new.json [--threshold 0.1]
+
+micro, load and all run against a throwaway working directory (its own
+SQLite database and storage), never the real one, and report throughput,
+p50/p99 latency and peak RSS as JSON. websocket spawns its own uvicorn
+server on such a directory unless --url points at a running one. compare
+exits non-zero when a
+benchmark's throughput or p99 regressed by more than the threshold.
+"""
+import argparse
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Benchmark defaults; the real environment can still override them
+BENCH_ENV = {
+    # The corpus is replayed many times; dedup would skip all but the first copy
+    "INGEST_DEDUP_ENABLED": "false",
+    "INBOX_RATE_LIMIT_PER_MINUTE": "0",
+    # Keep the seeded 10k-message inbox intact
+    "INBOX_MAX_MESSAGES": "0",
+    "INBOX_MAX_MB": "0",
+    "MAX_BULK_INBOXES": "1000",
+}
+
+def split_list(value: str):
+    return [item.strip() for item in value.split(",") if item.strip()] if value else None
+
+def main():
+    parser = argparse.ArgumentParser(description="TempMail ingest and read-path benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--seed", type=int, default=42, help="Corpus and workload seed")
+    common.add_argument("--sizes", help="Size buckets, e.g. 1KB,10KB,100KB,1MB,10MB")
+    common.add_argument("--profiles", help="Corpus profiles, e.g. plain,alternative,nested,charset")
+    common.add_argument("--output", default="-", help="JSON report path (- for stdout)")
+    common.add_argument("--workdir", help="Working directory for the database and storage (default: temporary)")
+
+    micro_args = argparse.ArgumentParser(add_help=False)
+    micro_args.add_argument("--iterations", type=int, default=50, help="Samples per microbenchmark")
+    micro_args.add_argument("--max-seconds", type=float, default=5.0, help="Time cap per microbenchmark")
+
+    load_args = argparse.ArgumentParser(add_help=False)
+    load_args.add_argument("--workloads", default="inbound,list,download", help="inbound,list,download")
+    load_args.add_argument("--requests", type=int, default=200, help="Requests per load benchmark")
+    load_args.add_argument("--concurrency", type=int, default=16, help="Requests in flight")
+    load_args.add_argument("--inbox-messages", type=int, default=10000, help="Messages in the listed inbox")
+
+    subparsers.add_parser("micro", parents=[common, micro_args], help="Parser and attachment microbenchmarks")
+    subparsers.add_parser("load", parents=[common, load_args], help="In-process load against the ASGI app")
+    subparsers.add_parser("all", parents=[common, micro_args, load_args], help="micro and load")
+
+    websocket_parser = subparsers.add_parser(
+        "websocket", parents=[common], help="WebSocket fan-out load against a uvicorn server"
+    )
+    websocket_parser.add_argument("--url", help="Existing server (default: spawn one)")
+    websocket_parser.add_argument("--server-pid", type=int, help="PID of --url's server, for memory figures")
+    websocket_parser.add_argument("--clients", type=int, default=1000, help="WebSocket subscribers")
+    websocket_parser.add_argument("--inboxes", type=int, default=100, help="Inboxes the clients are spread over")
+    websocket_parser.add_argument("--rate", type=float, default=20, help="Inbound emails per second")
+    websocket_parser.add_argument("--duration", type=float, default=10, help="Seconds of inbound load")
+    websocket_parser.add_argument("--connect-concurrency", type=int, default=200, help="Handshakes in flight")
+
+    corpus_parser = subparsers.add_parser("corpus", help="Write the synthetic corpus as .eml files")
+    corpus_parser.add_argument("directory")
+    corpus_parser.add_argument("--seed", type=int, default=42)
+    corpus_parser.add_argument("--sizes")
+    corpus_parser.add_argument("--profiles")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two JSON reports")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative regression")
+
+    args = parser.parse_args()
+
+    from benchmarks.corpus import generate_corpus
+    from benchmarks.report import compare, run_metadata, write_report
+
+    if args.command == "compare":
+        sys.exit(1 if compare(args.old, args.new, args.threshold) else 0)
+
+    if args.command == "websocket":
+        from benchmarks.websocket_load import run_websocket
+        report = {"meta": run_metadata({
+            name: value for name, value in vars(args).items() if name != "output"
+        })}
+        workdir = args.workdir or tempfile.mkdtemp(prefix="tempmail-bench-")
+        try:
+            # Progress (and anything the app prints) stays off the JSON on stdout
+            with contextlib.redirect_stdout(sys.stderr):
+                report["websocket"] = run_websocket(
+                    args.url, args.clients, args.inboxes, args.rate, args.duration,
+                    args.connect_concurrency, args.seed, workdir, REPO_ROOT, BENCH_ENV, args.server_pid
+                )
+        finally:
+            if not args.workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+        write_report(report, args.output)
+        return
+
+    corpus = generate_corpus(seed=args.seed, sizes=split_list(args.sizes), profiles=split_list(args.profiles))
+
+    if args.command == "corpus":
+        os.makedirs(args.directory, exist_ok=True)
+        for number, email in enumerate(corpus):
+            with open(os.path.join(args.directory, f"{number:03d}-{email['name']}.eml"), "wb") as f:
+                f.write(email["raw"])
+        print(f"Wrote {len(corpus)} emails to {args.directory}")
+        return
+
+    report = {"meta": run_metadata({
+        name: value for name, value in vars(args).items() if name != "output"
+    })}
+
+    # The app keeps its database and storage relative to the working directory
+    output = args.output if args.output == "-" else os.path.abspath(args.output)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="tempmail-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    for name, value in BENCH_ENV.items():
+        os.environ.setdefault(name, value)
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(workdir)
+
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            from app.database import engine
+            engine.echo = False
+
+            if args.command in ("micro", "all"):
+                from benchmarks.micro import run_micro
+                report["micro"] = run_micro(corpus, args.iterations, args.max_seconds, args.seed)
+            if args.command in ("load", "all"):
+                from benchmarks.load import run_load
+                report["load"] = run_load(
+                    corpus, args.requests, args.concurrency, args.inbox_messages,
+                    args.seed, split_list(args.workloads)
+                )
+    finally:
+        os.chdir(REPO_ROOT)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    write_report(report, output)
+
+if __name__ == "__main__":
+    main()
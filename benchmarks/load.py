@@ -0,0 +1,246 @@
+"""
+In-process load driver against the ASGI app (no sockets, no HTTP client).
+
+Workloads:
+    inbound     POST /api/inbound/mail with corpus emails
+    list        GET /api/messages/inbox/{id} pages of an inbox holding
+                `inbox_messages` (default 10k) messages
+    download    GET /api/attachments/{id} for attachments stored by inbound
+
+Requests run `concurrency` at a time on one event loop, the way a single
+uvicorn worker would serve them.
+"""
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from benchmarks.report import summarize
+
+class ASGIClient:
+    """Minimal ASGI caller: one request in, status and body length out"""
+
+    def __init__(self, app):
+        self.app = app
+        self.lifespan_task: Optional[asyncio.Task] = None
+        self.lifespan_receive: Optional[asyncio.Queue] = None
+        self.lifespan_send: Optional[asyncio.Queue] = None
+
+    async def startup(self):
+        self.lifespan_receive = asyncio.Queue()
+        self.lifespan_send = asyncio.Queue()
+        scope = {"type": "lifespan", "asgi": {"version": "3.0"}}
+        self.lifespan_task = asyncio.create_task(
+            self.app(scope, self.lifespan_receive.get, self.lifespan_send.put)
+        )
+        await self.lifespan_receive.put({"type": "lifespan.startup"})
+        message = await self.lifespan_send.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"App startup failed: {message}")
+
+    async def shutdown(self):
+        await self.lifespan_receive.put({"type": "lifespan.shutdown"})
+        await self.lifespan_send.get()
+        await self.lifespan_task
+
+    async def request(self, method: str, path: str, body: bytes = b"", headers: dict = None,
+                      query: str = "", keep_body: bool = False) -> Tuple[int, int, bytes]:
+        """Returns (status, response body length, body if keep_body)"""
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": query.encode(),
+            "headers": [
+                (name.lower().encode(), str(value).encode())
+                for name, value in {"host": "bench", "content-length": len(body), **(headers or {})}.items()
+            ],
+            "client": ("127.0.0.1", 50000),
+            "server": ("bench", 80),
+        }
+        request_sent = False
+        response_done = asyncio.Event()
+        status = 0
+        length = 0
+        chunks = []
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await response_done.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status, length
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                length += len(chunk)
+                if keep_body:
+                    chunks.append(chunk)
+                if not message.get("more_body", False):
+                    response_done.set()
+
+        await self.app(scope, receive, send)
+        response_done.set()
+        return status, length, b"".join(chunks)
+
+async def drive(requests: List, concurrency: int, ok_status=(200,)) -> dict:
+    """Run request coroutine factories `concurrency` at a time and summarize them"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    total_bytes = 0
+    errors = 0
+
+    async def run(make_request, size):
+        nonlocal total_bytes, errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                status, length, _ = await make_request()
+            except Exception as e:
+                status, length = None, 0
+                print(f"  error: {e}")
+            latencies.append(time.perf_counter() - started)
+            if status not in ok_status:
+                errors += 1
+            total_bytes += size or length
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(make_request, size) for make_request, size in requests))
+    return summarize(latencies, time.perf_counter() - started, total_bytes=total_bytes, errors=errors)
+
+async def create_inboxes(client: ASGIClient, count: int) -> List[dict]:
+    status, _, body = await client.request(
+        "POST", "/api/inboxes/bulk",
+        body=json.dumps({"count": count, "domain": "bench.example"}).encode(),
+        headers={"content-type": "application/json"},
+        keep_body=True
+    )
+    if status != 201:
+        raise RuntimeError(f"Could not create inboxes: {status} {body[:200]!r}")
+    return json.loads(body)["inboxes"]
+
+def seed_inbox_messages(inbox_id: str, count: int, seed: int, batch_size: int = 1000):
+    """Insert count small messages straight into the database (not via ingest)"""
+    from sqlalchemy import insert
+    from app.database import SessionLocal
+    from app.models import Inbox, Message, MessageContent, generate_uuid
+
+    rng = random.Random(seed)
+    db = SessionLocal()
+    try:
+        start = datetime.utcnow() - timedelta(hours=1)
+        for offset in range(0, count, batch_size):
+            contents, messages = [], []
+            for number in range(offset, min(offset + batch_size, count)):
+                content_id = generate_uuid()
+                text = f"Message {number}: your code is {rng.randint(100000, 999999)}\n" * 4
+                contents.append({
+                    "id": content_id, "text_content": text, "html_content": f"<p>{text}</p>",
+                    "raw_message": text, "created_at": start
+                })
+                messages.append({
+                    "id": generate_uuid(), "inbox_id": inbox_id, "content_id": content_id,
+                    "from_address": "sender@bench.example", "to_address": "list@bench.example",
+                    "subject": f"Seeded message {number}", "size": len(text),
+                    "received_at": start + timedelta(milliseconds=number)
+                })
+            db.execute(insert(MessageContent), contents)
+            db.execute(insert(Message), messages)
+        db.query(Inbox).filter(Inbox.id == inbox_id).update({Inbox.message_count: count})
+        db.commit()
+    finally:
+        db.close()
+
+def stored_attachments(limit: int) -> List[Tuple[str, int]]:
+    from app.database import SessionLocal
+    from app.models import Attachment
+
+    db = SessionLocal()
+    try:
+        return [(row.id, row.size) for row in db.query(Attachment.id, Attachment.size).limit(limit).all()]
+    finally:
+        db.close()
+
+async def run_load_async(corpus: List[dict], requests: int, concurrency: int,
+                         inbox_messages: int, seed: int, workloads: List[str]) -> dict:
+    from app.main import app
+
+    client = ASGIClient(app)
+    await client.startup()
+    rng = random.Random(seed)
+    results = {}
+    try:
+        inboxes = await create_inboxes(client, 50)
+
+        if "inbound" in workloads:
+            # Per size bucket, so small and large mail are reported separately
+            for size_label in dict.fromkeys(email["size_label"] for email in corpus):
+                emails = [email for email in corpus if email["size_label"] == size_label]
+                batch = []
+                for number in range(requests):
+                    email = emails[number % len(emails)]
+                    recipient = inboxes[number % len(inboxes)]["email"]
+                    batch.append((
+                        lambda raw=email["raw"], recipient=recipient: client.request(
+                            "POST", "/api/inbound/mail", body=raw,
+                            headers={"content-type": "message/rfc822", "x-envelope-to": recipient}
+                        ),
+                        len(email["raw"])
+                    ))
+                name = f"inbound/{size_label}"
+                print(f"load {name}")
+                results[name] = await drive(batch, concurrency)
+
+        if "list" in workloads:
+            list_inbox = (await create_inboxes(client, 1))[0]
+            print(f"load: seeding {inbox_messages} messages")
+            seed_inbox_messages(list_inbox["id"], inbox_messages, seed)
+            pages = max(inbox_messages // 20, 1)
+            for name, choose_page in (("list/first_page", lambda: 1),
+                                      ("list/random_page", lambda: rng.randint(1, pages))):
+                batch = [
+                    (lambda page=choose_page(): client.request(
+                        "GET", f"/api/messages/inbox/{list_inbox['id']}", query=f"page={page}&limit=20"
+                    ), 0)
+                    for _ in range(requests)
+                ]
+                print(f"load {name}")
+                results[name] = await drive(batch, concurrency)
+
+        if "download" in workloads:
+            attachments = stored_attachments(limit=requests)
+            if not attachments:
+                print("load download: no attachments stored (run with the inbound workload)")
+            else:
+                batch = [
+                    (lambda attachment_id=attachments[number % len(attachments)][0]: client.request(
+                        "GET", f"/api/attachments/{attachment_id}"
+                    ), 0)
+                    for number in range(requests)
+                ]
+                print("load download")
+                results["download"] = await drive(batch, concurrency)
+    finally:
+        await client.shutdown()
+    return results
+
+def run_load(corpus: List[dict], requests: int = 200, concurrency: int = 16, inbox_messages: int = 10000,
+             seed: int = 42, workloads: List[str] = None) -> dict:
+    from app.database import engine
+    # SQL echo would dominate every measurement
+    engine.echo = False
+    return asyncio.run(run_load_async(
+        corpus, requests, concurrency, inbox_messages, seed, workloads or ["inbound", "list", "download"]
+    ))
@@ -0,0 +1,108 @@
+"""
+Microbenchmarks for the parsing and attachment hot paths:
+
+    email_parser.parse_email            full in-memory parse
+    email_parser.parse_email_streaming  streaming parse used by ingest
+    mailpipe.parse_email                the Postfix pipe script's read + header parse
+    attachment_service.save_attachment  blob write + attachment row commit
+
+Each case runs until it has `iterations` samples or `max_seconds` elapsed.
+"""
+import asyncio
+import io
+import logging
+import random
+import time
+from typing import Callable, List
+
+from benchmarks.report import summarize
+from benchmarks.corpus import KB, MB
+
+ATTACHMENT_SIZES = {"1KB": 1 * KB, "100KB": 100 * KB, "1MB": 1 * MB, "4MB": 4 * MB}
+
+def measure(fn: Callable, iterations: int, max_seconds: float, size: int = 0) -> dict:
+    """Call fn repeatedly and summarize per-call latency"""
+    latencies: List[float] = []
+    errors = 0
+    started = time.perf_counter()
+    while len(latencies) < iterations and time.perf_counter() - started < max_seconds:
+        call_started = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            errors += 1
+            if errors == 1:
+                print(f"  error: {e}")
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+    return summarize(latencies, elapsed, total_bytes=size * len(latencies), errors=errors)
+
+def run_micro(corpus: List[dict], iterations: int = 50, max_seconds: float = 5.0, seed: int = 42) -> dict:
+    from app.services.email_parser import parse_email, parse_email_streaming
+    from app.services.ingest import discard_parsed_files
+    import mailpipe
+
+    # One log line per parsed email would dominate the measurement
+    mailpipe.logger.setLevel(logging.WARNING)
+
+    def streaming(raw: bytes):
+        # Attachments are written to storage while parsing; remove them again
+        discard_parsed_files(parse_email_streaming(raw))
+
+    def pipe(raw: bytes):
+        raw_email, _, _ = mailpipe.parse_email(io.BytesIO(raw))
+        if raw_email is None:
+            raise RuntimeError("mailpipe.parse_email failed")
+
+    results = {}
+    for email in corpus:
+        raw = email["raw"]
+        cases = {
+            "email_parser.parse_email": lambda: parse_email(raw),
+            "email_parser.parse_email_streaming": lambda: streaming(raw),
+            "mailpipe.parse_email": lambda: pipe(raw),
+        }
+        for case, fn in cases.items():
+            name = f"{case}/{email['name']}"
+            print(f"micro {name}")
+            results[name] = measure(fn, iterations, max_seconds, size=len(raw))
+
+    results.update(run_save_attachment(iterations, max_seconds, seed))
+    return results
+
+def run_save_attachment(iterations: int, max_seconds: float, seed: int) -> dict:
+    from app.database import Base, SessionLocal, engine
+    from app.models import MessageContent, Attachment
+    from app.services.attachment_service import save_attachment
+    from app.services.ingest import discard_files
+
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(seed)
+    loop = asyncio.new_event_loop()
+    db = SessionLocal()
+    results = {}
+    try:
+        content = MessageContent(text_content="", html_content="", raw_message="")
+        db.add(content)
+        db.commit()
+
+        for label, size in ATTACHMENT_SIZES.items():
+            data = rng.randbytes(size)
+            name = f"attachment_service.save_attachment/{label}"
+            print(f"micro {name}")
+            results[name] = measure(
+                lambda: loop.run_until_complete(
+                    save_attachment(db, content.id, "report.pdf", "application/pdf", data)
+                ),
+                iterations, max_seconds, size=size
+            )
+
+        # Remove what the benchmark wrote
+        attachments = db.query(Attachment).filter(Attachment.content_id == content.id).all()
+        discard_files([attachment.file_path for attachment in attachments])
+        db.delete(content)
+        db.commit()
+    finally:
+        db.close()
+        loop.close()
+    return results
@@ -0,0 +1,110 @@
+"""
+Result summaries, JSON reports and run-to-run comparison.
+"""
+import json
+import math
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from typing import List, Optional
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of values (fraction in 0..1)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(fraction * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far, in MB"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(peak / divisor, 1)
+
+def summarize(latencies: List[float], elapsed: float, total_bytes: int = 0, errors: int = 0) -> dict:
+    """Throughput and latency figures for one benchmark (latencies in seconds)"""
+    count = len(latencies)
+    return {
+        "count": count,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(count / elapsed, 2) if elapsed > 0 else 0.0,
+        "mb_per_s": round(total_bytes / elapsed / (1024 * 1024), 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 3),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+def run_metadata(args: dict) -> dict:
+    return {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "args": args
+    }
+
+def write_report(report: dict, path: str):
+    if path == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {path}")
+
+def compare(old_path: str, new_path: str, threshold: float = 0.10) -> int:
+    """
+    Print throughput and p99 changes between two reports.
+    Returns the number of benchmarks that regressed by more than threshold.
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    regressions = 0
+    print(f"{'benchmark':<52} {'throughput':>12} {'p99':>12}")
+    for section in ("micro", "load"):
+        for name, result in new.get(section, {}).items():
+            before = old.get(section, {}).get(name)
+            if not before:
+                print(f"{section}/{name:<46} {'new':>12}")
+                continue
+            throughput = change(before["throughput_per_s"], result["throughput_per_s"])
+            p99 = change(before["p99_ms"], result["p99_ms"])
+            regressed = (throughput is not None and throughput < -threshold) or \
+                        (p99 is not None and p99 > threshold)
+            regressions += regressed
+            print(f"{section}/{name:<46} {format_change(throughput):>12} {format_change(p99):>12}"
+                  f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def change(before: float, after: float) -> Optional[float]:
+    if not before:
+        return None
+    return (after - before) / before
+
+def format_change(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:+.1%}"
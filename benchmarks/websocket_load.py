@@ -0,0 +1,301 @@
+"""
+WebSocket fan-out load harness.
+
+Opens `clients` WebSocket subscribers on /ws/messages/{inbox_id}, spread
+round-robin over `inboxes` inboxes, then posts mail to
+/api/inbound/mail at `rate` messages per second for `duration` seconds and
+measures:
+
+    delivery     broadcast start (just after the ingest commit) to client
+                 receipt, from the event's sent_at; received vs expected
+    connections  connect latency, failed connects, connections dropped
+                 while the run was in progress
+    memory       server RSS growth per open connection (spawned server on
+                 Linux, or --server-pid)
+    ingest       achieved post rate and POST latency
+
+Without --url a uvicorn server is spawned on a throwaway working directory
+with the benchmark settings (no dedup, rate limits or quotas); against an
+existing server those limits apply. Needs the websockets package.
+"""
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+from benchmarks.report import percentile, peak_rss_mb
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+def raise_open_file_limit():
+    """Every client holds a socket; use the hard limit (inherited by a spawned server)"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def process_rss_mb(pid: int) -> Optional[float]:
+    """Current RSS of another process (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(workdir: str, repo_root: str, env: Dict[str, str]) -> tuple:
+    """Spawn uvicorn on a free port; returns (process, base url)"""
+    port = free_port()
+    log = open(os.path.join(workdir, "server.log"), "wb")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=workdir,
+        env={**os.environ, **env, "PYTHONPATH": repo_root},
+        stdout=log,
+        stderr=subprocess.STDOUT
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited early, see {log.name}")
+        try:
+            if requests.get(f"{url}/health", timeout=1).status_code == 200:
+                return process, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Server did not become healthy within 30s")
+
+def create_inboxes(url: str, count: int) -> List[dict]:
+    inboxes = []
+    while len(inboxes) < count:
+        batch = min(count - len(inboxes), 1000)
+        response = requests.post(
+            f"{url}/api/inboxes/bulk", json={"count": batch, "domain": "bench.example"}, timeout=60
+        )
+        response.raise_for_status()
+        inboxes.extend(response.json()["inboxes"])
+    return inboxes
+
+def build_email(recipient: str, number: int) -> bytes:
+    return (
+        f"From: load@bench.example\r\n"
+        f"To: {recipient}\r\n"
+        f"Subject: WebSocket load {number}\r\n"
+        f"Message-ID: <ws-{number}-{uuid.uuid4().hex}@bench.example>\r\n"
+        f"\r\n"
+        f"Your code is {100000 + number % 900000}\r\n"
+    ).encode()
+
+class Subscriber:
+    """One WebSocket client recording when events arrive"""
+
+    def __init__(self, harness: "WebSocketHarness", inbox_id: str):
+        self.harness = harness
+        self.inbox_id = inbox_id
+        self.connected = asyncio.Event()
+        self.websocket = None
+
+    async def run(self):
+        import websockets
+
+        harness = self.harness
+        ws_url = harness.url.replace("http", "ws", 1) + f"/ws/messages/{self.inbox_id}"
+        try:
+            async with harness.connect_slots:
+                started = time.perf_counter()
+                self.websocket = await websockets.connect(ws_url, open_timeout=30, max_size=None)
+        except Exception:
+            harness.failed_connects += 1
+            self.connected.set()
+            return
+        harness.connect_latencies.append(time.perf_counter() - started)
+        self.connected.set()
+
+        try:
+            async for raw in self.websocket:
+                received = time.time()
+                event = json.loads(raw)
+                if event.get("event") == "new_message":
+                    harness.received += 1
+                    if "sent_at" in event:
+                        harness.delivery_latencies.append(received - event["sent_at"])
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if not harness.stopping:
+                harness.dropped += 1
+
+    async def close(self):
+        if self.websocket is not None:
+            await self.websocket.close()
+
+class WebSocketHarness:
+    def __init__(self, url: str, clients: int, inboxes: int, rate: float, duration: float,
+                 connect_concurrency: int, seed: int, server_pid: Optional[int]):
+        self.url = url
+        self.clients = clients
+        self.inbox_count = inboxes
+        self.rate = rate
+        self.duration = duration
+        self.seed = seed
+        self.server_pid = server_pid
+        self.connect_slots = asyncio.Semaphore(connect_concurrency)
+        self.connect_latencies: List[float] = []
+        self.delivery_latencies: List[float] = []
+        self.post_latencies: List[float] = []
+        self.failed_connects = 0
+        self.dropped = 0
+        self.received = 0
+        self.expected = 0
+        self.post_errors = 0
+        self.stopping = False
+
+    def post(self, recipient: str, number: int) -> bool:
+        started = time.perf_counter()
+        try:
+            response = requests.post(
+                f"{self.url}/api/inbound/mail", data=build_email(recipient, number),
+                headers={"Content-Type": "message/rfc822", "X-Envelope-To": recipient}, timeout=30
+            )
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        self.post_latencies.append(time.perf_counter() - started)
+        return ok
+
+    async def drive_ingest(self, inboxes: List[dict], subscribers: Dict[str, int]) -> float:
+        """Post at the target rate; returns the elapsed time"""
+        loop = asyncio.get_running_loop()
+        rng = random.Random(self.seed)
+        executor = ThreadPoolExecutor(max_workers=32)
+        pending = []
+        total = int(self.rate * self.duration)
+        started = time.monotonic()
+
+        async def send(inbox: dict, number: int):
+            if await loop.run_in_executor(executor, self.post, inbox["email"], number):
+                self.expected += subscribers.get(inbox["id"], 0)
+            else:
+                self.post_errors += 1
+
+        for number in range(total):
+            # Fixed schedule, so a slow server shows up as latency, not a lower rate
+            delay = started + number / self.rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            pending.append(asyncio.create_task(send(rng.choice(inboxes), number)))
+        await asyncio.gather(*pending)
+        executor.shutdown()
+        return time.monotonic() - started
+
+    async def run(self) -> dict:
+        inboxes = create_inboxes(self.url, self.inbox_count)
+        subscribers: Dict[str, int] = {}
+        clients = []
+        for number in range(self.clients):
+            inbox_id = inboxes[number % len(inboxes)]["id"]
+            subscribers[inbox_id] = subscribers.get(inbox_id, 0) + 1
+            clients.append(Subscriber(self, inbox_id))
+
+        rss_before = process_rss_mb(self.server_pid) if self.server_pid else None
+        print(f"websocket: connecting {self.clients} clients to {len(inboxes)} inboxes")
+        connect_started = time.perf_counter()
+        tasks = [asyncio.create_task(client.run()) for client in clients]
+        await asyncio.gather(*(client.connected.wait() for client in clients))
+        connect_seconds = time.perf_counter() - connect_started
+        # Let the server finish registering connections before measuring
+        await asyncio.sleep(1)
+        rss_connected = process_rss_mb(self.server_pid) if self.server_pid else None
+        connected = len(self.connect_latencies)
+
+        print(f"websocket: {connected} connected, posting {self.rate}/s for {self.duration}s")
+        ingest_seconds = await self.drive_ingest(inboxes, subscribers)
+        # Deliveries still in flight
+        await asyncio.sleep(2)
+
+        self.stopping = True
+        await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        posts = len(self.post_latencies)
+        per_connection_kb = None
+        if rss_before is not None and rss_connected is not None and connected:
+            per_connection_kb = round((rss_connected - rss_before) * 1024 / connected, 2)
+        return {
+            "connections": {
+                "requested": self.clients,
+                "connected": connected,
+                "failed_connects": self.failed_connects,
+                "dropped": self.dropped,
+                "subscribers_per_inbox": round(self.clients / len(inboxes), 2),
+                "connect_seconds": round(connect_seconds, 3),
+                "connect_p50_ms": round(percentile(self.connect_latencies, 0.50) * 1000, 3),
+                "connect_p99_ms": round(percentile(self.connect_latencies, 0.99) * 1000, 3)
+            },
+            "delivery": {
+                "expected": self.expected,
+                "received": self.received,
+                "missing": max(self.expected - self.received, 0),
+                "p50_ms": round(percentile(self.delivery_latencies, 0.50) * 1000, 3),
+                "p99_ms": round(percentile(self.delivery_latencies, 0.99) * 1000, 3),
+                "max_ms": round(max(self.delivery_latencies, default=0.0) * 1000, 3)
+            },
+            "ingest": {
+                "posts": posts,
+                "errors": self.post_errors,
+                "target_rate_per_s": self.rate,
+                "achieved_rate_per_s": round(posts / ingest_seconds, 2) if ingest_seconds else 0.0,
+                "post_p50_ms": round(percentile(self.post_latencies, 0.50) * 1000, 3),
+                "post_p99_ms": round(percentile(self.post_latencies, 0.99) * 1000, 3)
+            },
+            "memory": {
+                "server_rss_before_mb": rss_before,
+                "server_rss_connected_mb": rss_connected,
+                "server_kb_per_connection": per_connection_kb,
+                "harness_peak_rss_mb": peak_rss_mb()
+            }
+        }
+
+def run_websocket(url: Optional[str], clients: int, inboxes: int, rate: float, duration: float,
+                  connect_concurrency: int, seed: int, workdir: str, repo_root: str,
+                  env: Dict[str, str], server_pid: Optional[int] = None) -> dict:
+    raise_open_file_limit()
+    process = None
+    if url is None:
+        process, url = start_server(workdir, repo_root, env)
+        server_pid = process.pid
+    try:
+        harness = WebSocketHarness(url, clients, inboxes, rate, duration, connect_concurrency, seed, server_pid)
+        return asyncio.run(harness.run())
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
@@ -32,9 +32,9 @@ function InboxView() {
   }, [inboxId])
 
   // Fetch messages
-  const fetchMessages = useCallback(async () => {
+  const fetchMessages = useCallback(async (seenMessageId) => {
     try {
-      const data = await getMessages(inboxId, pagination.page, pagination.limit)
+      const data = await getMessages(inboxId, pagination.page, pagination.limit, seenMessageId)
       setMessages(data.messages || [])
       setPagination(data.pagination || pagination)
     } catch (err) {
@@ -74,7 +74,7 @@ function InboxView() {
     const handleNewMessage = (data) => {
       console.log('New message received via WebSocket:', data)
       // Refresh messages when new message arrives
-      fetchMessages()
+      fetchMessages(data.message_id)
     }
 
     websocketManager.connect(inboxId, handleNewMessage)
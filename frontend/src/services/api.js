@@ -19,9 +19,11 @@ export const getInbox = async (inboxId) => {
   return response.data
 }
 
-export const getMessages = async (inboxId, page = 1, limit = 20) => {
+// seen: id of the newest message announced over the WebSocket, so a
+// lagging read replica doesn't answer without it
+export const getMessages = async (inboxId, page = 1, limit = 20, seen) => {
   const response = await api.get(`/api/messages/inbox/${inboxId}`, {
-    params: { page, limit },
+    params: { page, limit, seen },
   })
   return response.data
 }
@@ -6,19 +6,28 @@ Reads RFC822 email from stdin and forwards to FastAPI backend.
 
 import sys
 import os
+import re
+import json
 import tempfile
 import logging
 import logging.handlers
 import requests
-from email import message_from_file
+from email import message_from_bytes
 from email.utils import parseaddr
 from email.header import decode_header
 from io import BytesIO
 from pathlib import Path
 from typing import List, Tuple, Optional
+from contextlib import contextmanager
 import time
 import shutil
 
+try:
+    import fcntl
+except ImportError:
+    # Windows: metrics files are written without locking
+    fcntl = None
+
 # Configuration
 BACKEND_URL = os.getenv("MAILPIPE_BACKEND_URL", "http://localhost:8000")
 ENDPOINT = f"{BACKEND_URL}/api/inbound/mail"
@@ -26,7 +35,13 @@ MAX_EMAIL_SIZE = int(os.getenv("MAX_EMAIL_SIZE_MB", "10")) * 1024 * 1024  # 10MB
 MAX_ATTACHMENT_SIZE = int(os.getenv("MAX_ATTACHMENT_SIZE_MB", "5")) * 1024 * 1024  # 5MB default
 MAX_RETRIES = 3
 RETRY_DELAY = 2  # seconds
+# Longest Retry-After we wait out in-process; longer waits are left to Postfix's queue
+MAX_RETRY_WAIT = int(os.getenv("MAILPIPE_MAX_RETRY_WAIT", "10"))  # seconds
 TEMP_DIR = os.getenv("TEMP_DIR", "/tmp/mailpipe")
+# node_exporter textfile collector directory; empty disables metrics
+METRICS_DIR = os.getenv("MAILPIPE_METRICS_DIR", "")
+# Append each run's trace as an OTLP/JSON line; empty disables export
+TRACE_EXPORT_PATH = os.getenv("MAILPIPE_TRACE_EXPORT_PATH", "")
 
 # Ensure temp directory exists
 os.makedirs(TEMP_DIR, mode=0o700, exist_ok=True)
@@ -45,11 +60,195 @@ try:
 except Exception:
     handler = logging.StreamHandler(sys.stderr)
 
-formatter = logging.Formatter("%(name)s[%(process)d]: %(levelname)s: %(message)s")
+
+
+class TraceContextFilter(logging.Filter):
+    """Prefix log lines with the Postfix queue id (like Postfix's own) and the trace id"""
+    
+    def filter(self, record):
+        queue_id = f"{tracer.queue_id}: " if tracer.queue_id else ""
+        record.trace_context = f"{queue_id}trace={tracer.trace_id} "
+        return True
+
+
+formatter = logging.Formatter("%(name)s[%(process)d]: %(levelname)s: %(trace_context)s%(message)s")
 handler.setFormatter(formatter)
+handler.addFilter(TraceContextFilter())
 logger.addHandler(handler)
 
 
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(8)) + (25 * 1024 * 1024,)
+
+# name -> (type, help, buckets)
+METRIC_FAMILIES = {
+    "mailpipe_stage_seconds": ("histogram", "Time spent in each mailpipe stage (read, attachments, send, total)", LATENCY_BUCKETS),
+    "mailpipe_messages_total": ("counter", "Emails piped by outcome (delivered, deferred, rejected, failed)", None),
+    "mailpipe_message_bytes": ("histogram", "Size of piped raw emails", SIZE_BUCKETS),
+    "mailpipe_attachment_bytes": ("histogram", "Size of extracted attachments", SIZE_BUCKETS),
+}
+
+
+class TextfileMetrics:
+    """
+    Prometheus metrics for the node_exporter textfile collector.
+    Every mailpipe run is a separate process, so samples are added to the
+    totals already in METRICS_DIR/mailpipe.prom under a file lock and the
+    file is replaced atomically.
+    """
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        # "name{labels}" -> value, in exposition order
+        self.samples = {}
+    
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = name + self.format_labels(labels)
+        self.samples[key] = self.samples.get(key, 0) + amount
+    
+    def observe(self, name: str, value: float, **labels):
+        for bound in METRIC_FAMILIES[name][2] + (float("inf"),):
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            self.inc(f"{name}_bucket", 1 if value <= bound else 0, **labels, le=le)
+        self.inc(f"{name}_sum", value, **labels)
+        self.inc(f"{name}_count", 1, **labels)
+    
+    @staticmethod
+    def format_labels(labels: dict) -> str:
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+    
+    @staticmethod
+    def family(key: str) -> str:
+        name = key.split("{", 1)[0]
+        for suffix in ("_bucket", "_sum", "_count"):
+            if name.endswith(suffix) and name[:-len(suffix)] in METRIC_FAMILIES:
+                return name[:-len(suffix)]
+        return name
+    
+    def write(self):
+        """Merge this run's samples into the .prom file"""
+        if not self.directory or not self.samples:
+            return
+        path = os.path.join(self.directory, "mailpipe.prom")
+        with open(path + ".lock", "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            totals = {}
+            try:
+                with open(path) as f:
+                    for line in f:
+                        if line.strip() and not line.startswith("#"):
+                            key, _, value = line.rstrip("\n").rpartition(" ")
+                            totals[key] = float(value)
+            except (OSError, ValueError):
+                # Missing or unreadable: start from zero
+                totals = {}
+            for key, value in self.samples.items():
+                totals[key] = totals.get(key, 0) + value
+            
+            lines = []
+            for name, (kind, help_text, _) in METRIC_FAMILIES.items():
+                keys = [key for key in totals if self.family(key) == name]
+                if keys:
+                    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                    lines += [f"{key} {format_number(totals[key])}" for key in keys]
+            
+            # The collector must never see a partial file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, path)
+
+
+def format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+metrics = TextfileMetrics(METRICS_DIR)
+
+
+# "by mx.example.com (Postfix) with ESMTP id 4Xyz1abc2" in Postfix's Received header
+POSTFIX_QUEUE_ID_RE = re.compile(rb"\(Postfix\)\s+with\s+\S+\s+id\s+([0-9A-Za-z]+)")
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+
+
+class Tracer:
+    """
+    The trace of one mailpipe run. Stages are recorded as spans; the backend
+    gets the send span in a W3C traceparent header so its ingest spans join
+    the same trace. Exported as one OTLP/JSON line to TRACE_EXPORT_PATH.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.trace_id = os.urandom(16).hex()
+        self.root_span_id = os.urandom(8).hex()
+        self.start_ns = time.time_ns()
+        self.queue_id = None
+        self.attributes = {}
+        # (name, span id, kind, start, end)
+        self.spans = []
+    
+    def set_queue_id(self, raw_email: bytes):
+        """Queue id from the newest Postfix Received header, if any"""
+        headers = raw_email.split(b"\r\n\r\n", 1)[0].split(b"\n\n", 1)[0]
+        match = POSTFIX_QUEUE_ID_RE.search(b" ".join(headers.split()))
+        if match:
+            self.queue_id = match.group(1).decode()
+            self.attributes["postfix.queue_id"] = self.queue_id
+    
+    def new_span_id(self) -> str:
+        return os.urandom(8).hex()
+    
+    def traceparent(self, span_id: str) -> str:
+        return f"00-{self.trace_id}-{span_id}-01"
+    
+    @contextmanager
+    def stage(self, name: str, span_id: Optional[str] = None, kind: int = SPAN_KIND_INTERNAL):
+        """Time a stage: observed in the stage histogram and recorded as a span"""
+        start_ns = time.time_ns()
+        try:
+            yield
+        finally:
+            end_ns = time.time_ns()
+            metrics.observe("mailpipe_stage_seconds", (end_ns - start_ns) / 1e9, stage=name)
+            self.spans.append((name, span_id or self.new_span_id(), kind, start_ns, end_ns))
+    
+    def export(self):
+        if not self.path:
+            return
+        end_ns = time.time_ns()
+        
+        def span(name, span_id, kind, start_ns, end_ns, parent_id=None, attributes=None):
+            data = {
+                "traceId": self.trace_id, "spanId": span_id, "name": name, "kind": kind,
+                "startTimeUnixNano": str(start_ns), "endTimeUnixNano": str(end_ns),
+                "attributes": [{"key": key, "value": {"stringValue": str(value)}}
+                               for key, value in (attributes or {}).items()],
+            }
+            if parent_id:
+                data["parentSpanId"] = parent_id
+            return data
+        
+        spans = [span("mailpipe", self.root_span_id, SPAN_KIND_INTERNAL, self.start_ns, end_ns, attributes=self.attributes)]
+        spans += [span(*item, parent_id=self.root_span_id) for item in self.spans]
+        line = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "mailpipe"}}]},
+            "scopeSpans": [{"scope": {"name": "mailpipe"}, "spans": spans}],
+        }]}, separators=(",", ":"))
+        with open(self.path, "a") as f:
+            # Concurrent mailpipe runs must not interleave lines
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(line + "\n")
+
+
+tracer = Tracer(TRACE_EXPORT_PATH)
+
+
 def decode_header_value(header_value: str) -> str:
     """Decode MIME header values."""
     if not header_value:
@@ -82,8 +281,7 @@ def parse_email(input_stream) -> Tuple[bytes, Optional[str], Optional[str]]:
             return None, None, None
         
         # Parse email to extract addresses
-        email_file = BytesIO(raw_email)
-        msg = message_from_file(email_file)
+        msg = message_from_bytes(raw_email)
         
         from_addr = parseaddr(msg.get("From", ""))[1] or "unknown@unknown.com"
         to_addr = parseaddr(msg.get("To", ""))[1] or ""
@@ -183,9 +381,21 @@ def sanitize_filename(filename: str) -> str:
     return sanitized or "unnamed"
 
 
-def send_to_backend(raw_email: bytes, attachments: List[Tuple[str, bytes, str]]) -> bool:
+def parse_retry_after(value: str) -> int:
+    """Seconds from a Retry-After header (delta-seconds form only)."""
+    try:
+        return max(0, int(value.strip()))
+    except ValueError:
+        return MAX_RETRY_WAIT + 1
+
+
+def send_to_backend(raw_email: bytes, attachments: List[Tuple[str, bytes, str]],
+                    recipients: Optional[List[str]] = None, trace_headers: Optional[dict] = None) -> bool:
     """
     Send email to backend API with retry logic.
+    Envelope recipients are sent as repeated "recipients" form fields so the
+    backend delivers one stored copy to every recipient inbox.
+    trace_headers (traceparent, X-Postfix-Queue-Id) continue this run's trace.
     Returns: True if successful, False otherwise.
     """
     for attempt in range(MAX_RETRIES):
@@ -193,6 +403,10 @@ def send_to_backend(raw_email: bytes, attachments: List[Tuple[str, bytes, str]])
             # Prepare multipart form data
             files = [("email", ("email.eml", raw_email, "message/rfc822"))]
             
+            # Envelope recipients (plain form fields)
+            for recipient in recipients or []:
+                files.append(("recipients", (None, recipient)))
+            
             # Add attachments if any
             for filename, content, content_type in attachments:
                 files.append(("attachments", (filename, content, content_type)))
@@ -203,13 +417,23 @@ def send_to_backend(raw_email: bytes, attachments: List[Tuple[str, bytes, str]])
                 files=files,
                 timeout=30,
                 headers={
-                    "User-Agent": "Postfix-MailPipe/1.0"
+                    "User-Agent": "Postfix-MailPipe/1.0",
+                    **(trace_headers or {})
                 }
             )
             
             if response.status_code == 200:
                 logger.info(f"Successfully sent email to backend (attempt {attempt + 1})")
                 return True
+            elif response.status_code == 503 and "Retry-After" in response.headers:
+                # Backend is shedding load: wait as asked, or defer to Postfix's queue
+                retry_after = parse_retry_after(response.headers["Retry-After"])
+                if retry_after > MAX_RETRY_WAIT or attempt == MAX_RETRIES - 1:
+                    logger.warning(f"Backend busy (Retry-After {retry_after}s), deferring to Postfix queue")
+                    return False
+                logger.warning(f"Backend busy, retrying in {retry_after}s (attempt {attempt + 1}/{MAX_RETRIES})")
+                time.sleep(retry_after)
+                continue
             elif response.status_code in [500, 502, 503, 504]:
                 # Transient error - retry
                 logger.warning(
@@ -246,6 +470,8 @@ def send_to_backend(raw_email: bytes, attachments: List[Tuple[str, bytes, str]])
 def main():
     """Main entry point for mail pipe."""
     exit_code = 0
+    result = "failed"
+    started = time.monotonic()
     
     try:
         # Check if stdin is available
@@ -253,37 +479,56 @@ def main():
             logger.error("Script must be run as a pipe, not interactively")
             sys.exit(1)
         
+        # Envelope recipients from Postfix (argv=... ${recipient})
+        recipients = [arg.strip().lower() for arg in sys.argv[1:] if arg.strip()]
+        
         # Parse email from stdin
-        raw_email, from_addr, to_addr = parse_email(sys.stdin.buffer)
+        with tracer.stage("read"):
+            raw_email, from_addr, to_addr = parse_email(sys.stdin.buffer)
         
         if not raw_email:
             logger.error("Failed to parse email or email too large")
+            result = "rejected"
             sys.exit(1)
+        metrics.observe("mailpipe_message_bytes", len(raw_email))
+        tracer.attributes["message.size"] = len(raw_email)
+        tracer.set_queue_id(raw_email)
         
-        if not to_addr:
+        if recipients:
+            logger.info(f"Envelope recipients: {', '.join(recipients)}")
+        elif not to_addr:
             logger.warning("No recipient address found in email")
             # Continue anyway - backend will handle
         
         # Parse email for attachments (if needed for logging)
-        try:
-            email_file = BytesIO(raw_email)
-            msg = message_from_file(email_file)
-            attachments = extract_attachments(msg)
-            
-            if attachments:
-                logger.info(f"Found {len(attachments)} attachment(s)")
-        except Exception as e:
-            logger.warning(f"Could not extract attachments for logging: {e}")
-            attachments = []
+        with tracer.stage("attachments"):
+            try:
+                msg = message_from_bytes(raw_email)
+                attachments = extract_attachments(msg)
+                
+                if attachments:
+                    logger.info(f"Found {len(attachments)} attachment(s)")
+            except Exception as e:
+                logger.warning(f"Could not extract attachments for logging: {e}")
+                attachments = []
+        for _, content, _ in attachments:
+            metrics.observe("mailpipe_attachment_bytes", len(content))
         
-        # Send to backend
-        success = send_to_backend(raw_email, attachments)
+        # Send to backend; its spans become children of the send span
+        send_span_id = tracer.new_span_id()
+        trace_headers = {"traceparent": tracer.traceparent(send_span_id)}
+        if tracer.queue_id:
+            trace_headers["X-Postfix-Queue-Id"] = tracer.queue_id
+        with tracer.stage("send", send_span_id, SPAN_KIND_CLIENT):
+            success = send_to_backend(raw_email, attachments, recipients, trace_headers)
         
         if not success:
             exit_code = 75  # EX_TEMPFAIL - Postfix will retry
+            result = "deferred"
             logger.error("Failed to send email to backend")
         else:
-            logger.info(f"Email processed successfully: to={to_addr}")
+            result = "delivered"
+            logger.info(f"Email processed successfully: to={', '.join(recipients) or to_addr}")
     
     except KeyboardInterrupt:
         logger.warning("Interrupted by user")
@@ -294,6 +539,18 @@ def main():
         exit_code = 75  # EX_TEMPFAIL
     
     finally:
+        metrics.observe("mailpipe_stage_seconds", time.monotonic() - started, stage="total")
+        metrics.inc("mailpipe_messages_total", result=result)
+        try:
+            metrics.write()
+        except Exception as e:
+            logger.warning(f"Error writing metrics: {e}")
+        tracer.attributes["mailpipe.result"] = result
+        try:
+            tracer.export()
+        except Exception as e:
+            logger.warning(f"Error exporting trace: {e}")
+        
         # Cleanup temp directory (remove old files)
         try:
             cleanup_temp_files()
@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Settings are read at import time: point storage and the databases (two
+# shards) at a scratch directory before any app module is imported
+_scratch = tempfile.mkdtemp(prefix="tempmail-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_scratch, 'tempmail.db')}")
+os.environ.setdefault("DATABASE_SHARD_URLS", f"sqlite:///{os.path.join(_scratch, 'shard1.db')}")
+os.environ.setdefault("STORAGE_PATH", _scratch)
+os.environ.setdefault("ATTACHMENTS_PATH", os.path.join(_scratch, "attachments"))
+os.environ.setdefault("INGEST_SPOOL_PATH", os.path.join(_scratch, "spool"))
+os.environ.setdefault("PACK_PATH", os.path.join(_scratch, "packs"))
+os.environ.setdefault("STORAGE_BACKEND", "local")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def application():
+    """The FastAPI app; importing it creates the tables on every shard"""
+    from app.main import app
+    return app
+
+
+@pytest.fixture
+def client(application):
+    from fastapi.testclient import TestClient
+    with TestClient(application) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def scratch_dir():
+    return _scratch
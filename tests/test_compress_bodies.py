@@ -0,0 +1,50 @@
+from sqlalchemy import LargeBinary, select, type_coerce
+
+from app.compress_bodies import recompress
+from app.config import settings
+from app.database import engines, session_for_shard
+from app.models import MessageContent
+from app.services.body_compression import RAW, ZLIB
+
+BODY = "Your verification code is 482913. " * 40
+
+
+def stored_codec(shard: int, content_id) -> bytes:
+    db = session_for_shard(shard)
+    try:
+        # Read the stored bytes, skipping the decompressing column type
+        stored = db.execute(
+            select(type_coerce(MessageContent.text_content, LargeBinary))
+            .where(MessageContent.id == content_id)
+        ).scalar_one()
+    finally:
+        db.close()
+    return bytes(stored[:1])
+
+
+def test_recompress_rewrites_bodies_on_every_shard(application, monkeypatch):
+    monkeypatch.setattr(settings, "BODY_COMPRESSION", "none")
+    content_ids = []
+    for shard in range(len(engines)):
+        db = session_for_shard(shard)
+        try:
+            content = MessageContent(text_content=BODY, html_content=f"<p>{BODY}</p>")
+            db.add(content)
+            db.commit()
+            content_ids.append(content.id)
+        finally:
+            db.close()
+        assert stored_codec(shard, content_ids[shard]) == RAW
+
+    monkeypatch.setattr(settings, "BODY_COMPRESSION", "zlib")
+    assert recompress(batch_size=1) >= len(engines)
+
+    for shard, content_id in enumerate(content_ids):
+        assert stored_codec(shard, content_id) == ZLIB
+        db = session_for_shard(shard)
+        try:
+            content = db.get(MessageContent, content_id)
+            assert content.text_content == BODY
+            assert content.html_content == f"<p>{BODY}</p>"
+        finally:
+            db.close()
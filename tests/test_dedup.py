@@ -0,0 +1,99 @@
+import io
+import uuid
+
+from app.services import ingest
+from app.services.dedup import compute_dedup_keys
+
+
+def address() -> str:
+    return f"dedup-{uuid.uuid4().hex[:8]}@example.com"
+
+
+def create_inbox(client, email: str) -> str:
+    return client.post("/api/inboxes/", json={"email": email}).json()["id"]
+
+
+def email(to: str, message_id: str = None, body: str = "hello") -> bytes:
+    message_id_header = f"Message-ID: {message_id}\r\n" if message_id else ""
+    return f"From: s@example.com\r\nTo: {to}\r\n{message_id_header}Subject: hi\r\n\r\n{body}\r\n".encode()
+
+
+def post(client, raw: bytes, recipients: str = ""):
+    headers = {"X-Envelope-To": recipients} if recipients else {}
+    response = client.post("/api/inbound/mail", content=raw, headers=headers)
+    assert response.status_code == 200
+    return response
+
+
+def count(client, inbox_id: str) -> int:
+    return client.get(f"/api/messages/inbox/{inbox_id}").json()["pagination"]["total"]
+
+
+def test_redelivered_email_is_stored_once(client):
+    to = address()
+    inbox_id = create_inbox(client, to)
+    raw = email(to, f"<{uuid.uuid4()}@example.com>")
+
+    post(client, raw)
+    post(client, raw)
+    assert count(client, inbox_id) == 1
+
+
+def test_redelivered_email_without_message_id_is_stored_once(client):
+    to = address()
+    inbox_id = create_inbox(client, to)
+    raw = email(to)
+
+    post(client, raw)
+    post(client, raw)
+    assert count(client, inbox_id) == 1
+
+
+def test_same_message_id_with_another_body_is_stored(client):
+    to = address()
+    inbox_id = create_inbox(client, to)
+    message_id = f"<{uuid.uuid4()}@example.com>"
+
+    post(client, email(to, message_id, "first"))
+    post(client, email(to, message_id, "second"))
+    assert count(client, inbox_id) == 2
+
+
+def test_same_message_to_different_recipients(client):
+    first, second = address(), address()
+    first_id, second_id = create_inbox(client, first), create_inbox(client, second)
+    message_id = f"<{uuid.uuid4()}@example.com>"
+
+    # Separate deliveries of one message (e.g. one per recipient from Postfix)
+    post(client, email(first, message_id), first)
+    post(client, email(first, message_id), second)
+    assert (count(client, first_id), count(client, second_id)) == (1, 1)
+
+    # A redelivery to both stores nothing new
+    post(client, email(first, message_id), f"{first} {second}")
+    assert (count(client, first_id), count(client, second_id)) == (1, 1)
+
+
+def test_copy_racing_past_the_header_check_is_dropped(client, monkeypatch):
+    to = address()
+    inbox_id = create_inbox(client, to)
+    raw = email(to, f"<{uuid.uuid4()}@example.com>")
+    post(client, raw)
+
+    # As if both copies were screened before either was stored
+    monkeypatch.setattr(ingest, "filter_duplicates", lambda keys: (keys, 0))
+    post(client, raw)
+    assert count(client, inbox_id) == 1
+
+
+def test_keys_differ_per_recipient():
+    raw = email("a@example.com", "<same@example.com>")
+    body_start = raw.index(b"\r\n\r\n") + 4
+    headers = {"Message-ID": "<same@example.com>"}
+
+    keys = compute_dedup_keys(headers, io.BytesIO(raw), 0, body_start, ["a@example.com", "b@example.com"])
+    assert keys["a@example.com"] != keys["b@example.com"]
+    # Only the body counts once there is a Message-ID
+    other_headers = b"Received: by relay\r\n" + raw
+    again = compute_dedup_keys(headers, io.BytesIO(other_headers), 0, body_start + 20, ["a@example.com"])
+    assert again["a@example.com"] == keys["a@example.com"]
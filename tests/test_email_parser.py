@@ -0,0 +1,264 @@
+import base64
+import io
+import os
+import quopri
+
+from app.services.body_compression import decompress_text
+from app.services.email_parser import StreamingEmailParser, parse_email_streaming
+from app.services.storage import get_storage
+
+MAX_LINE = StreamingEmailParser.MAX_LINE
+
+
+def attachment_bytes(attachment) -> bytes:
+    with get_storage().open(attachment["file_path"]) as f:
+        return f.read()
+
+
+def email(*lines) -> bytes:
+    return b"\r\n".join(lines) + b"\r\n"
+
+
+class SmallReads(io.RawIOBase):
+    """Seekable raw stream that returns at most a few bytes per read"""
+
+    def __init__(self, data: bytes, step: int = 7):
+        self.data = io.BytesIO(data)
+        self.step = step
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.data.seek(offset, whence)
+
+    def tell(self):
+        return self.data.tell()
+
+    def readinto(self, buffer):
+        chunk = self.data.read(min(len(buffer), self.step))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def test_nested_multipart():
+    raw = email(
+        b"From: Sender <sender@example.com>",
+        b"To: user@example.com",
+        b"Subject: Nested",
+        b"MIME-Version: 1.0",
+        b'Content-Type: multipart/mixed; boundary="outer"',
+        b"",
+        b"preamble",
+        b"--outer",
+        b'Content-Type: multipart/alternative; boundary="inner"',
+        b"",
+        b"--inner",
+        b"Content-Type: text/plain; charset=utf-8",
+        b"",
+        b"Your code is 123456",
+        b"--inner",
+        b"Content-Type: text/html; charset=utf-8",
+        b"",
+        b"<p>Your code is <b>123456</b></p>",
+        b"--inner--",
+        b"--outer",
+        b"Content-Type: text/plain",
+        b'Content-Disposition: attachment; filename="notes.txt"',
+        b"",
+        b"line one",
+        b"line two",
+        b"--outer--",
+        b"epilogue",
+    )
+    parsed = parse_email_streaming(raw)
+
+    assert parsed["from_address"] == "sender@example.com"
+    assert parsed["subject"] == "Nested"
+    assert parsed["text_content"] == "Your code is 123456"
+    assert parsed["html_content"] == "<p>Your code is <b>123456</b></p>"
+    assert [a["filename"] for a in parsed["attachments"]] == ["notes.txt"]
+    assert attachment_bytes(parsed["attachments"][0]) == b"line one\r\nline two"
+
+
+def test_inner_part_closed_by_outer_boundary():
+    raw = email(
+        b"To: user@example.com",
+        b'Content-Type: multipart/mixed; boundary="outer"',
+        b"",
+        b"--outer",
+        b'Content-Type: multipart/alternative; boundary="inner"',
+        b"",
+        b"--inner",
+        b"Content-Type: text/plain",
+        b"",
+        b"inner text",
+        b"--outer",
+        b"Content-Type: text/html",
+        b"",
+        b"<p>after</p>",
+        b"--outer--",
+    )
+    parsed = parse_email_streaming(raw)
+
+    assert parsed["text_content"] == "inner text"
+    assert parsed["html_content"] == "<p>after</p>"
+
+
+def test_missing_closing_boundary():
+    content = os.urandom(300)
+    raw = email(
+        b"To: user@example.com",
+        b'Content-Type: multipart/mixed; boundary="b"',
+        b"",
+        b"--b",
+        b"Content-Type: text/plain",
+        b"",
+        b"body text",
+        b"--b",
+        b"Content-Type: application/octet-stream",
+        b'Content-Disposition: attachment; filename="data.bin"',
+        b"Content-Transfer-Encoding: base64",
+        b"",
+        base64.encodebytes(content).replace(b"\n", b"\r\n").rstrip(),
+    )
+    parsed = parse_email_streaming(raw)
+
+    assert parsed["text_content"] == "body text"
+    assert len(parsed["attachments"]) == 1
+    assert attachment_bytes(parsed["attachments"][0]) == content
+
+
+def test_base64_attachment():
+    content = os.urandom(200 * 1024)
+    encoded = base64.encodebytes(content).replace(b"\n", b"\r\n")
+    raw = email(
+        b"To: user@example.com",
+        b'Content-Type: multipart/mixed; boundary="b"',
+        b"",
+        b"--b",
+        b"Content-Type: application/pdf",
+        b'Content-Disposition: attachment; filename="report.pdf"',
+        b"Content-Transfer-Encoding: base64",
+        b"",
+        encoded.rstrip(),
+        b"--b--",
+    )
+    parsed = parse_email_streaming(raw)
+
+    (attachment,) = parsed["attachments"]
+    assert attachment["filename"] == "report.pdf"
+    assert attachment["content_type"] == "application/pdf"
+    assert attachment["size"] == len(content)
+    assert attachment_bytes(attachment) == content
+
+
+def test_quoted_printable_attachment():
+    content = ("Grüße = café " * 20 + "\r\nsecond line\r\n").encode("utf-8")
+    encoded = quopri.encodestring(content).replace(b"\r\n", b"\n").replace(b"\n", b"\r\n")
+    raw = email(
+        b"To: user@example.com",
+        b'Content-Type: multipart/mixed; boundary="b"',
+        b"",
+        b"--b",
+        b"Content-Type: text/plain; charset=utf-8",
+        b'Content-Disposition: attachment; filename="letter.txt"',
+        b"Content-Transfer-Encoding: quoted-printable",
+        b"",
+        encoded.rstrip(b"\r\n"),
+        b"--b--",
+    )
+    parsed = parse_email_streaming(raw)
+
+    (attachment,) = parsed["attachments"]
+    assert b"=\r\n" in encoded
+    assert attachment_bytes(attachment) == content.rstrip(b"\r\n")
+
+
+def test_crlf_split_at_read_limit():
+    # The CR of the line break falls on the last byte of a MAX_LINE read
+    line = b"x" * (MAX_LINE - 1)
+    raw = email(
+        b"To: user@example.com",
+        b'Content-Type: multipart/mixed; boundary="b"',
+        b"",
+        b"--b",
+        b"Content-Type: application/octet-stream",
+        b'Content-Disposition: attachment; filename="long.txt"',
+        b"Content-Transfer-Encoding: 8bit",
+        b"",
+        line,
+        b"--b--",
+    )
+    parsed = parse_email_streaming(raw)
+
+    assert attachment_bytes(parsed["attachments"][0]) == line
+
+
+def test_delimiter_text_after_read_limit_is_content():
+    # "--b" continuing a line longer than MAX_LINE is not a delimiter
+    line = b"y" * MAX_LINE + b"--b"
+    raw = email(
+        b"To: user@example.com",
+        b'Content-Type: multipart/mixed; boundary="b"',
+        b"",
+        b"--b",
+        b"Content-Type: application/octet-stream",
+        b'Content-Disposition: attachment; filename="long.txt"',
+        b"",
+        line,
+        b"--b",
+        b"Content-Type: text/plain",
+        b"",
+        b"after",
+        b"--b--",
+    )
+    parsed = parse_email_streaming(raw)
+
+    assert attachment_bytes(parsed["attachments"][0]) == line
+    assert parsed["text_content"] == "after"
+
+
+def test_small_reads():
+    content = os.urandom(5000)
+    raw = email(
+        b"To: user@example.com",
+        b'Content-Type: multipart/mixed; boundary="boundary-split"',
+        b"",
+        b"--boundary-split",
+        b"Content-Type: text/plain",
+        b"",
+        b"short reads",
+        b"--boundary-split",
+        b"Content-Type: image/png",
+        b'Content-Disposition: attachment; filename="image.png"',
+        b"Content-Transfer-Encoding: base64",
+        b"",
+        base64.encodebytes(content).replace(b"\n", b"\r\n").rstrip(),
+        b"--boundary-split--",
+    )
+    parsed = parse_email_streaming(io.BufferedReader(SmallReads(raw), buffer_size=16))
+
+    assert parsed["text_content"] == "short reads"
+    assert attachment_bytes(parsed["attachments"][0]) == content
+
+
+def test_file_source_keeps_raw_message():
+    raw = email(
+        b"To: user@example.com",
+        b"Subject: =?utf-8?q?Caf=C3=A9?=",
+        b"Content-Type: text/plain; charset=utf-8",
+        b"",
+        "Grüße ".encode("utf-8") * 100,
+    )
+    # Like a spool file: envelope lines ahead of the raw email
+    source = io.BytesIO(b"RCPT user@example.com\n" + raw)
+    source.readline()
+    parsed = parse_email_streaming(source)
+
+    assert parsed["subject"] == "Café"
+    assert parsed["size"] == len(raw)
+    assert decompress_text(parsed["raw_message"]) == raw.decode("utf-8")
@@ -0,0 +1,122 @@
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app.database import session_for_shard, shard_for_email
+from app.models import Attachment, Inbox, Message, MessageContent
+from app.routers.inboxes import upsert_inbox
+from app.services.storage import get_storage
+
+
+def address() -> str:
+    return f"inbox-{uuid.uuid4().hex[:8]}@example.com"
+
+
+def session_for(email: str):
+    return session_for_shard(shard_for_email(email))
+
+
+def deliver_with_attachment(client, to: str):
+    raw = (
+        f"From: s@example.com\r\nTo: {to}\r\nSubject: Invoice\r\n"
+        'Content-Type: multipart/mixed; boundary="b"\r\n\r\n'
+        "--b\r\nContent-Type: text/plain\r\n\r\nsee attached\r\n"
+        '--b\r\nContent-Type: text/plain\r\nContent-Disposition: attachment; filename="a.txt"\r\n\r\n'
+        "attachment body\r\n--b--\r\n"
+    ).encode()
+    assert client.post("/api/inbound/mail", content=raw).status_code == 200
+
+
+def expire(email: str):
+    db = session_for(email)
+    try:
+        db.query(Inbox).filter(Inbox.email == email).update({Inbox.expires_at: datetime.utcnow() - timedelta(minutes=1)})
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_recreating_an_expired_address_removes_its_data(client):
+    email = address()
+    old_id = client.post("/api/inboxes/", json={"email": email}).json()["id"]
+    deliver_with_attachment(client, email)
+
+    db = session_for(email)
+    try:
+        message = db.query(Message).filter(Message.inbox_id == old_id).one()
+        content_id = message.content_id
+        file_path = db.query(Attachment.file_path).filter(Attachment.content_id == content_id).scalar()
+    finally:
+        db.close()
+    assert get_storage().stat(file_path) is not None
+
+    expire(email)
+    response = client.post("/api/inboxes/", json={"email": email})
+    assert response.status_code == 201
+    assert response.json()["id"] != old_id
+
+    db = session_for(email)
+    try:
+        assert db.query(Message).filter(Message.inbox_id == old_id).count() == 0
+        assert db.get(MessageContent, content_id) is None
+        assert db.query(Attachment).filter(Attachment.content_id == content_id).count() == 0
+        search_rows = db.execute(
+            text("SELECT count(*) FROM message_search WHERE inbox_id = :inbox_id"), {"inbox_id": old_id}
+        ).scalar()
+        assert search_rows == 0
+    finally:
+        db.close()
+    assert get_storage().stat(file_path) is None
+
+
+def concurrent_upserts(email: str, count: int = 8) -> list:
+    barrier = threading.Barrier(count)
+    results, errors = [], []
+
+    def create():
+        db = session_for(email)
+        try:
+            barrier.wait()
+            results.append(upsert_inbox(db, email).id)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=create) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    return results
+
+
+def inbox_ids(email: str) -> list:
+    db = session_for(email)
+    try:
+        return [row.id for row in db.query(Inbox.id).filter(Inbox.email == email)]
+    finally:
+        db.close()
+
+
+def test_concurrent_creates_of_the_same_address(application):
+    email = address()
+    results = concurrent_upserts(email)
+
+    assert len(set(results)) == 1
+    assert inbox_ids(email) == results[:1]
+
+
+def test_concurrent_recreates_of_an_expired_address(application):
+    email = address()
+    (old_id,) = set(concurrent_upserts(email, 1))
+    expire(email)
+
+    results = concurrent_upserts(email)
+
+    assert len(set(results)) == 1
+    assert results[0] != old_id
+    assert inbox_ids(email) == results[:1]
@@ -0,0 +1,108 @@
+import os
+import smtplib
+import time
+import uuid
+
+import pytest
+
+from app.services import lmtp_server as lmtp
+from app.services.lmtp_server import LMTPServer
+
+
+def create_inbox(client) -> dict:
+    response = client.post("/api/inboxes/", json={"email": f"lmtp-{uuid.uuid4().hex[:8]}@example.com"})
+    assert response.status_code == 201
+    return response.json()
+
+
+def messages(client, inbox_id: str) -> list:
+    return client.get(f"/api/messages/inbox/{inbox_id}").json()["messages"]
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+@pytest.fixture
+def socket_path(scratch_dir):
+    return os.path.join(scratch_dir, f"lmtp-{uuid.uuid4().hex[:8]}.sock")
+
+
+@pytest.fixture
+def lmtp_socket(client, socket_path):
+    server = LMTPServer("", 0, socket_path)
+    client.portal.call(server.start)
+    yield socket_path
+    client.portal.call(server.stop)
+
+
+def test_delivers_to_existing_inbox(client, lmtp_socket):
+    inbox = create_inbox(client)
+    raw = (
+        f"From: sender@example.com\r\nTo: {inbox['email']}\r\nSubject: Over LMTP\r\n\r\n"
+        "Your code is 551234\r\n"
+    )
+    with smtplib.LMTP(lmtp_socket) as connection:
+        refused = connection.sendmail("sender@example.com", [inbox["email"]], raw)
+
+    assert refused == {}
+    (message,) = messages(client, inbox["id"])
+    assert message["subject"] == "Over LMTP"
+    assert message["text_content"] == "Your code is 551234\r\n"
+
+
+def test_unknown_recipient_is_refused(client, lmtp_socket):
+    inbox = create_inbox(client)
+    with smtplib.LMTP(lmtp_socket) as connection:
+        refused = connection.sendmail(
+            "sender@example.com",
+            [inbox["email"], "nobody-here@example.com"],
+            f"To: {inbox['email']}\r\nSubject: partly\r\n\r\nhello\r\n"
+        )
+
+        assert refused["nobody-here@example.com"][0] == 550
+        with pytest.raises(smtplib.SMTPRecipientsRefused):
+            connection.sendmail("sender@example.com", ["nobody-here@example.com"], "Subject: x\r\n\r\nx\r\n")
+
+    assert [message["subject"] for message in messages(client, inbox["id"])] == ["partly"]
+
+
+def test_large_message_is_spooled_intact(client, lmtp_socket, monkeypatch):
+    monkeypatch.setattr(lmtp, "SPOOL_MEMORY_BYTES", 1024)
+    inbox = create_inbox(client)
+    # Lines starting with a dot are dot-stuffed on the wire
+    lines = [f".line {n} " + "x" * 60 for n in range(200)]
+    body = "\r\n".join(lines)
+    raw = f"To: {inbox['email']}\r\nSubject: Large\r\n\r\n{body}\r\n"
+    with smtplib.LMTP(lmtp_socket) as connection:
+        assert connection.sendmail("sender@example.com", [inbox["email"]], raw) == {}
+
+    (message,) = messages(client, inbox["id"])
+    assert message["text_content"] == body + "\r\n"
+
+
+def test_only_one_server_listens(client, socket_path, monkeypatch):
+    monkeypatch.setattr(lmtp, "LOCK_RETRY_SECONDS", 0.05)
+    first = LMTPServer("", 0, socket_path)
+    second = LMTPServer("", 0, socket_path)
+    client.portal.call(first.start)
+    client.portal.call(second.start)
+    try:
+        assert first.server is not None
+        assert second.server is None
+        inbox = create_inbox(client)
+        with smtplib.LMTP(socket_path) as connection:
+            connection.noop()
+
+        # The standby takes over once the listener stops
+        client.portal.call(first.stop)
+        wait_for(lambda: second.server is not None)
+        with smtplib.LMTP(socket_path) as connection:
+            connection.sendmail("sender@example.com", [inbox["email"]], "Subject: takeover\r\n\r\nhi\r\n")
+        assert [message["subject"] for message in messages(client, inbox["id"])] == ["takeover"]
+    finally:
+        client.portal.call(first.stop)
+        client.portal.call(second.stop)
@@ -0,0 +1,93 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from app.database import engine
+from app.models import MaintenanceLease
+from app.services import maintenance
+from app.services.maintenance import LeaseElection, MaintenanceScheduler
+
+
+@pytest.fixture
+def lease_name(application, monkeypatch) -> str:
+    """A lease of its own, apart from the one the app's scheduler holds"""
+    name = f"test-{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(maintenance, "LEASE_NAME", name)
+    monkeypatch.setattr(maintenance, "TICK_SECONDS", 0.01)
+    return name
+
+
+def expire_lease(name: str):
+    table = MaintenanceLease.__table__
+    with engine.begin() as connection:
+        connection.execute(
+            update(table).where(table.c.name == name).values(expires_at=datetime.utcnow() - timedelta(seconds=1))
+        )
+
+
+def test_one_leader_at_a_time(lease_name):
+    first = LeaseElection(engine, lease_name, 60)
+    second = LeaseElection(engine, lease_name, 60)
+
+    assert first.try_acquire()
+    assert not second.try_acquire()
+    # Renewing keeps the lease
+    assert first.try_acquire()
+    assert not second.try_acquire()
+
+
+def test_expired_lease_is_taken_over(lease_name):
+    first = LeaseElection(engine, lease_name, 60)
+    second = LeaseElection(engine, lease_name, 60)
+    assert first.try_acquire()
+
+    expire_lease(lease_name)
+    assert second.try_acquire()
+    assert not first.try_acquire()
+
+
+def test_released_lease_is_taken_over(lease_name):
+    first = LeaseElection(engine, lease_name, 60)
+    second = LeaseElection(engine, lease_name, 60)
+    assert first.try_acquire()
+
+    first.release()
+    assert second.try_acquire()
+
+
+def test_jobs_run_only_on_the_leader(lease_name):
+    other = LeaseElection(engine, lease_name, 60)
+    assert other.try_acquire()
+    runs = []
+
+    async def job():
+        runs.append(datetime.utcnow())
+
+    async def scenario():
+        scheduler = MaintenanceScheduler(lease_seconds=0.3)
+        scheduler.add_job("test", 0, job)
+        scheduler.start(engine)
+        try:
+            await asyncio.sleep(0.3)
+            # Another worker holds the lease: stand by
+            assert not scheduler.is_leader
+            assert runs == []
+
+            # The other worker died: its lease runs out and this one takes over
+            expire_lease(lease_name)
+            for _ in range(100):
+                if runs:
+                    break
+                await asyncio.sleep(0.02)
+            assert scheduler.is_leader
+            assert runs
+        finally:
+            await scheduler.stop()
+
+        # Stopping hands the lease back at once
+        assert other.try_acquire()
+
+    asyncio.run(scenario())
@@ -0,0 +1,45 @@
+import uuid
+
+from app.config import settings
+from app.database import session_for_shard, shard_from_id
+from app.models import Message
+
+
+def deliver(client) -> str:
+    """Create an inbox, deliver one email and return the message id"""
+    address = f"cache-{uuid.uuid4().hex[:8]}@example.com"
+    inbox_id = client.post("/api/inboxes/", json={"email": address}).json()["id"]
+    raw = f"From: sender@example.com\r\nTo: {address}\r\nSubject: cached\r\n\r\nhello\r\n".encode()
+    assert client.post("/api/inbound/mail", content=raw).status_code == 200
+    (message,) = client.get(f"/api/messages/inbox/{inbox_id}").json()["messages"]
+    return message["id"]
+
+
+def test_message_evicted_by_another_worker_is_not_served(client):
+    message_id = deliver(client)
+    response = client.get(f"/api/messages/{message_id}")
+    assert response.status_code == 200
+    # Quotas are on: evictable messages are revalidated, not kept
+    assert response.headers["cache-control"] == "private, no-cache"
+
+    # Evicted elsewhere: this worker's cache still holds the message
+    db = session_for_shard(shard_from_id(message_id))
+    try:
+        db.query(Message).filter(Message.id == message_id).delete()
+        db.commit()
+    finally:
+        db.close()
+
+    assert client.get(f"/api/messages/{message_id}").status_code == 404
+
+
+def test_messages_are_immutable_without_quotas(client, monkeypatch):
+    monkeypatch.setattr(settings, "INBOX_MAX_MESSAGES", 0)
+    monkeypatch.setattr(settings, "INBOX_MAX_MB", 0)
+    message_id = deliver(client)
+
+    response = client.get(f"/api/messages/{message_id}")
+    assert response.status_code == 200
+    assert response.headers["cache-control"].endswith("immutable")
+    etag = response.headers["etag"]
+    assert client.get(f"/api/messages/{message_id}", headers={"If-None-Match": etag}).status_code == 304
@@ -0,0 +1,165 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+from app.services.pack_storage import PackStorage
+from app.services.storage import LocalShardedStorage
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_storage(tmp_path, **options) -> PackStorage:
+    settings = dict(
+        max_blob_size=1024,
+        segment_max_size=1024 * 1024,
+        segment_max_age=3600,
+        lifetime=3600,
+        compact_dead_ratio=0.5,
+    )
+    settings.update(options)
+    return PackStorage(
+        base=LocalShardedStorage(str(tmp_path / "blobs")),
+        pack_dir=str(tmp_path / "packs"),
+        **settings
+    )
+
+
+def put(storage, key: str, data: bytes):
+    writer = storage.writer(key)
+    writer.write(data)
+    writer.commit()
+
+
+def read(storage, key: str) -> bytes:
+    reader = storage.open(key)
+    try:
+        return reader.read()
+    finally:
+        reader.close()
+
+
+def pack_files(tmp_path) -> list:
+    return sorted(os.listdir(tmp_path / "packs"))
+
+
+def write_in_other_process(tmp_path, key: str, data: bytes):
+    """Pack a blob from a separate process, which exits without sealing its segment"""
+    script = textwrap.dedent(f"""
+        from tests.test_pack_storage import make_storage, put
+        import pathlib
+        put(make_storage(pathlib.Path({str(tmp_path)!r})), {key!r}, {data!r})
+    """)
+    subprocess.run([sys.executable, "-c", script], cwd=REPO_ROOT, check=True)
+
+
+def test_append_open_delete(tmp_path):
+    storage = make_storage(tmp_path)
+    put(storage, "small", b"packed bytes")
+    put(storage, "large", b"x" * 4096)
+
+    assert read(storage, "small") == b"packed bytes"
+    assert storage.stat("small") == len(b"packed bytes")
+    assert read(storage, "large") == b"x" * 4096
+    # Only the small blob went into a segment
+    assert storage.base.stat("small") is None
+    assert storage.base.stat("large") == 4096
+
+    storage.delete("small")
+    storage.delete("large")
+    assert storage.stat("small") is None
+    assert storage.stat("large") is None
+    with pytest.raises(FileNotFoundError):
+        storage.open("small")
+
+
+def test_compaction_keeps_live_blobs(tmp_path):
+    storage = make_storage(tmp_path)
+    for n in range(10):
+        put(storage, f"blob{n}", bytes([n]) * 100)
+    old_segment = storage.active
+    storage.seal_active()
+    for n in range(8):
+        storage.delete(f"blob{n}")
+
+    assert storage.maintain() == (0, 1)
+    assert old_segment not in storage.segments
+    assert not any(name.startswith(old_segment) for name in pack_files(tmp_path))
+    assert read(storage, "blob8") == bytes([8]) * 100
+    assert read(storage, "blob9") == bytes([9]) * 100
+    with pytest.raises(FileNotFoundError):
+        storage.open("blob0")
+
+
+def test_expired_segments_are_dropped(tmp_path):
+    storage = make_storage(tmp_path, lifetime=0)
+    put(storage, "old", b"expired")
+    storage.seal_active()
+
+    assert storage.maintain() == (1, 0)
+    assert pack_files(tmp_path) == []
+    with pytest.raises(FileNotFoundError):
+        storage.open("old")
+
+
+def test_active_segment_is_sealed_when_idle(tmp_path):
+    storage = make_storage(tmp_path, segment_max_age=0, lifetime=0)
+    other = make_storage(tmp_path, lifetime=0)
+    put(storage, "blob", b"data")
+
+    # Held by its writer: nobody else may drop it
+    assert other.maintain() == (0, 0)
+
+    storage.maintain_local()
+    assert storage.active is None
+    assert other.maintain() == (1, 0)
+
+
+def test_delete_after_segment_dropped_elsewhere(tmp_path):
+    storage = make_storage(tmp_path)
+    put(storage, "blob", b"data")
+    storage.seal_active()
+
+    make_storage(tmp_path, lifetime=0).maintain()
+    assert pack_files(tmp_path) == []
+
+    # The stale location must not bring back an orphan index
+    storage.delete("blob")
+    assert pack_files(tmp_path) == []
+
+
+def test_delete_after_compaction_elsewhere(tmp_path):
+    storage = make_storage(tmp_path)
+    put(storage, "keep", b"live data")
+    put(storage, "gone", b"y" * 200)
+    storage.seal_active()
+
+    other = make_storage(tmp_path)
+    other.delete("gone")
+    assert other.maintain() == (0, 1)
+
+    # Follows the blob into the segment it was compacted into
+    storage.delete("keep")
+    assert storage.stat("keep") is None
+    assert make_storage(tmp_path).stat("keep") is None
+
+
+def test_reads_and_deletes_across_processes(tmp_path):
+    storage = make_storage(tmp_path)
+    write_in_other_process(tmp_path, "remote", b"from another worker")
+
+    assert read(storage, "remote") == b"from another worker"
+
+    fresh = make_storage(tmp_path)
+    write_in_other_process(tmp_path, "unseen", b"never read here")
+    # Not looked up before: delete still finds and marks it
+    fresh.delete("unseen")
+    assert make_storage(tmp_path).stat("unseen") is None
+
+    # Both writers exited, so their unsealed segments are only kept while
+    # they hold live blobs
+    fresh.delete("remote")
+    assert fresh.maintain() == (2, 0)
+    assert pack_files(tmp_path) == []
@@ -0,0 +1,134 @@
+import asyncio
+import os
+import smtplib
+import uuid
+
+import pytest
+
+from app.config import settings
+from app.services import inbox_limits
+from app.services.inbox_limits import TokenBucketLimiter
+from app.services.ingest_queue import IngestSpool
+from app.services.lmtp_server import LMTPServer
+
+
+@pytest.fixture(autouse=True)
+def limiter(monkeypatch):
+    """Two messages per inbox, no noticeable refill during a test"""
+    monkeypatch.setattr(inbox_limits, "inbox_rate_limiter", TokenBucketLimiter(rate_per_minute=1, burst=2))
+
+
+def address() -> str:
+    return f"limited-{uuid.uuid4().hex[:8]}@example.com"
+
+
+def create_inbox(client, email: str) -> str:
+    return client.post("/api/inboxes/", json={"email": email}).json()["id"]
+
+
+def email(to: str, message_id: str = None) -> bytes:
+    message_id = message_id or f"<{uuid.uuid4()}@example.com>"
+    return f"From: s@example.com\r\nTo: {to}\r\nMessage-ID: {message_id}\r\nSubject: hi\r\n\r\nhello\r\n".encode()
+
+
+def post(client, raw: bytes, recipients: str = ""):
+    headers = {"X-Envelope-To": recipients} if recipients else {}
+    return client.post("/api/inbound/mail", content=raw, headers=headers)
+
+
+def count(client, inbox_id: str) -> int:
+    return client.get(f"/api/messages/inbox/{inbox_id}").json()["pagination"]["total"]
+
+
+def test_mail_over_the_rate_is_deferred(client):
+    to = address()
+    inbox_id = create_inbox(client, to)
+    assert post(client, email(to)).status_code == 200
+    assert post(client, email(to)).status_code == 200
+
+    response = post(client, email(to))
+    assert response.status_code == 503
+    assert "retry-after" in response.headers
+    assert count(client, inbox_id) == 2
+
+
+def test_redelivered_copies_are_not_charged(client):
+    to = address()
+    inbox_id = create_inbox(client, to)
+    raw = email(to)
+    for _ in range(3):
+        assert post(client, raw).status_code == 200
+
+    assert post(client, email(to)).status_code == 200
+    assert count(client, inbox_id) == 2
+
+
+def test_unknown_inboxes_are_not_charged(client):
+    to = address()
+    for _ in range(3):
+        assert post(client, email(to)).status_code == 200
+
+    inbox_id = create_inbox(client, to)
+    assert post(client, email(to)).status_code == 200
+    assert count(client, inbox_id) == 1
+
+
+def test_partial_rate_limit_stores_the_others_and_retries(client):
+    busy, quiet = address(), address()
+    busy_id, quiet_id = create_inbox(client, busy), create_inbox(client, quiet)
+    for _ in range(2):
+        post(client, email(busy))
+
+    raw = email(busy, "<both@example.com>")
+    assert post(client, raw, f"{busy} {quiet}").status_code == 503
+    assert (count(client, busy_id), count(client, quiet_id)) == (2, 1)
+
+    # The retry is deduplicated for the recipient already stored
+    inbox_limits.inbox_rate_limiter.buckets.clear()
+    assert post(client, raw, f"{busy} {quiet}").status_code == 200
+    assert (count(client, busy_id), count(client, quiet_id)) == (3, 1)
+
+
+def test_lmtp_defers_only_the_limited_recipient(client, scratch_dir):
+    busy, quiet = address(), address()
+    busy_id, quiet_id = create_inbox(client, busy), create_inbox(client, quiet)
+    for _ in range(2):
+        post(client, email(busy))
+
+    socket_path = os.path.join(scratch_dir, f"lmtp-{uuid.uuid4().hex[:8]}.sock")
+    server = LMTPServer("", 0, socket_path)
+    client.portal.call(server.start)
+    try:
+        with smtplib.LMTP(socket_path) as connection:
+            connection.ehlo()
+            connection.mail("s@example.com")
+            connection.rcpt(busy)
+            connection.rcpt(quiet)
+            # LMTP answers DATA once per recipient, in RCPT order
+            busy_reply = connection.data(email(busy))
+            quiet_reply = connection.getreply()
+    finally:
+        client.portal.call(server.stop)
+
+    assert busy_reply[0] == 451
+    assert quiet_reply[0] == 250
+    assert (count(client, busy_id), count(client, quiet_id)) == (2, 1)
+
+
+def test_spool_retries_limited_recipients(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "INGEST_GROUP_COMMIT", False)
+    busy, quiet = address(), address()
+    busy_id, quiet_id = create_inbox(client, busy), create_inbox(client, quiet)
+    for _ in range(2):
+        post(client, email(busy))
+
+    spool = IngestSpool(str(tmp_path), workers=0, max_attempts=3, retry_delay=60)
+    path = spool.write(email(busy), [busy, quiet])
+
+    asyncio.run(spool.process(path))
+
+    assert (count(client, busy_id), count(client, quiet_id)) == (2, 1)
+    (retry,) = os.listdir(spool.ready_dir)
+    assert retry.endswith(".1.eml")
+    with open(os.path.join(spool.ready_dir, retry), "rb") as f:
+        assert f.readline() == f"RCPT {busy}\n".encode()
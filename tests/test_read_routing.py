@@ -0,0 +1,127 @@
+import os
+import uuid
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app import database
+from app.database import create_shard_engine, engines
+from app.replicate_sqlite import copy_database
+from app.services.read_routing import PIN_COOKIE, SEEN_PARAM, inbox_pins, replica_reads_total
+
+
+def reads(target: str) -> float:
+    return replica_reads_total.values.get((target,), 0)
+
+
+@pytest.fixture
+def replicate(application, scratch_dir):
+    """Give every shard a replica; calling the fixture's value brings them up to date"""
+    pairs = []
+    replica_engines = []
+    for shard, primary in enumerate(engines):
+        path = os.path.join(scratch_dir, f"replica-{shard}-{uuid.uuid4().hex[:8]}.db")
+        pairs.append((primary.url.database, path))
+        copy_database(primary.url.database, path)
+        replica_engine = create_shard_engine(f"sqlite:///{path}", shard, replica=True)
+        replica_engines.append(replica_engine)
+        database.replica_sessions[shard].append(sessionmaker(
+            autocommit=False, autoflush=False, bind=replica_engine, info={"shard": shard, "replica": True}
+        ))
+
+    def sync():
+        for source, target in pairs:
+            copy_database(source, target)
+
+    yield sync
+    for shard, replica_engine in enumerate(replica_engines):
+        database.replica_sessions[shard].clear()
+        replica_engine.dispose()
+
+
+def create_inbox(client) -> dict:
+    response = client.post("/api/inboxes/", json={"email": f"replica-{uuid.uuid4().hex[:8]}@example.com"})
+    assert response.status_code == 201
+    return response.json()
+
+
+def deliver(client, inbox: dict) -> str:
+    raw = f"From: s@example.com\r\nTo: {inbox['email']}\r\nSubject: fresh\r\n\r\nhello\r\n".encode()
+    assert client.post("/api/inbound/mail", content=raw).status_code == 200
+    # As if stored by another worker: neither the client nor the inbox is pinned here
+    client.cookies.clear()
+    inbox_pins.deadlines.pop(inbox["id"], None)
+    return message_ids(client, inbox["id"], pinned=True)[0]
+
+
+def message_ids(client, inbox_id: str, pinned: bool = False, **params) -> list:
+    cookies = {PIN_COOKIE: client.cookies.get(PIN_COOKIE) or "9999999999"} if pinned else None
+    response = client.get(f"/api/messages/inbox/{inbox_id}", params=params, cookies=cookies)
+    assert response.status_code == 200
+    return [message["id"] for message in response.json()["messages"]]
+
+
+def test_creating_an_inbox_pins_the_client(client, replicate):
+    inbox = create_inbox(client)
+    assert PIN_COOKIE in client.cookies
+
+    pinned = reads("primary_pinned")
+    assert client.get(f"/api/inboxes/{inbox['id']}").status_code == 200
+    assert reads("primary_pinned") == pinned + 1
+
+
+def test_unpinned_reads_use_the_replica(client, replicate):
+    inbox = create_inbox(client)
+    replicate()
+    message_id = deliver(client, inbox)
+
+    # The replica hasn't received the message yet
+    served = reads("replica")
+    assert message_ids(client, inbox["id"]) == []
+    assert reads("replica") == served + 1
+
+    replicate()
+    assert message_ids(client, inbox["id"]) == [message_id]
+
+
+def test_seen_message_missing_on_replica_reads_the_primary(client, replicate):
+    inbox = create_inbox(client)
+    replicate()
+    message_id = deliver(client, inbox)
+
+    fallbacks = reads("primary_fallback")
+    assert message_ids(client, inbox["id"], **{SEEN_PARAM: message_id}) == [message_id]
+    assert reads("primary_fallback") == fallbacks + 1
+
+    # Once replicated, the replica answers on its own
+    replicate()
+    assert message_ids(client, inbox["id"], **{SEEN_PARAM: message_id}) == [message_id]
+    assert reads("primary_fallback") == fallbacks + 1
+
+
+def test_find_inbox_falls_back_to_the_primary(client, replicate):
+    inbox = create_inbox(client)
+    client.cookies.clear()
+
+    fallbacks = reads("primary_fallback")
+    response = client.get(f"/api/inboxes/{inbox['id']}")
+    assert response.status_code == 200
+    assert response.json()["email"] == inbox["email"]
+    assert reads("primary_fallback") == fallbacks + 1
+
+
+def test_find_message_falls_back_to_the_primary(client, replicate):
+    inbox = create_inbox(client)
+    replicate()
+    message_id = deliver(client, inbox)
+
+    fallbacks = reads("primary_fallback")
+    response = client.get(f"/api/messages/{message_id}")
+    assert response.status_code == 200
+    assert response.json()["subject"] == "fresh"
+    assert reads("primary_fallback") == fallbacks + 1
+
+
+def test_missing_everywhere_is_404(client, replicate):
+    client.cookies.clear()
+    assert client.get(f"/api/inboxes/{uuid.uuid4()}").status_code == 404
@@ -0,0 +1,129 @@
+import time
+import uuid
+import zlib
+
+import pytest
+
+from app import database
+from app.database import engines, session_for_shard, shard_for_email, shard_from_id
+from app.models import Inbox, Message, generate_uuid
+from app.services.shards import address_shard, group_by_shard
+
+
+def address_on_shard(shard: int, prefix: str = "user") -> str:
+    while True:
+        address = f"{prefix}-{uuid.uuid4().hex[:8]}@example.com"
+        if shard_for_email(address) == shard:
+            return address
+
+
+def stored_on(shard: int, inbox_id: str):
+    db = session_for_shard(shard)
+    try:
+        return db.query(Inbox).filter(Inbox.id == inbox_id).first()
+    finally:
+        db.close()
+
+
+def test_two_shards_configured():
+    assert len(engines) == 2
+
+
+def test_address_routing_is_crc32_of_the_normalized_address():
+    for address in ("a@example.com", "Someone.Else@Example.COM", "x_y+z@mail.test"):
+        expected = zlib.crc32(address.lower().strip().encode("utf-8")) % len(engines)
+        assert shard_for_email(address) == expected
+        assert shard_for_email(f"  {address.upper()} ") == expected
+
+
+def test_ids_carry_their_shard():
+    for shard in range(len(engines)):
+        assert shard_from_id(generate_uuid(shard)) == shard
+
+
+def test_ids_without_shard_bits_route_to_shard_zero(monkeypatch):
+    assert shard_from_id(str(uuid.uuid4())) == 0
+    assert shard_from_id("not-an-id") == 0
+    # Ids minted before sharding was enabled live on shard 0
+    monkeypatch.setattr(database, "shards_since_ms", int(time.time() * 1000) + 60_000)
+    assert shard_from_id(generate_uuid(1)) == 0
+
+
+def test_created_inbox_lives_on_its_address_shard(client):
+    for shard in range(len(engines)):
+        address = address_on_shard(shard)
+        response = client.post("/api/inboxes/", json={"email": address})
+        assert response.status_code == 201
+        inbox_id = response.json()["id"]
+
+        assert shard_from_id(inbox_id) == shard
+        assert stored_on(shard, inbox_id) is not None
+        assert stored_on(1 - shard, inbox_id) is None
+        assert client.get(f"/api/inboxes/{inbox_id}").status_code == 200
+
+
+def test_legacy_inbox_on_shard_zero_is_found_before_sharding_cutoff(client, monkeypatch):
+    address = address_on_shard(1, "legacy")
+    db = session_for_shard(0)
+    try:
+        legacy = Inbox(email=address)
+        db.add(legacy)
+        db.commit()
+        legacy_id = legacy.id
+    finally:
+        db.close()
+
+    # Without a cutoff, addresses go to their hash shard
+    monkeypatch.setattr(database, "shards_since_ms", 0)
+    assert address_shard(address) == 1
+
+    # Sharding enabled a minute ago: shard 0 inboxes may still be valid
+    monkeypatch.setattr(database, "shards_since_ms", int(time.time() * 1000) - 60_000)
+    assert address_shard(address) == 0
+    response = client.post("/api/inboxes/", json={"email": address})
+    assert response.status_code == 201
+    assert response.json()["id"] == legacy_id
+    assert stored_on(1, legacy_id) is None
+
+
+def test_bulk_create_across_shards(client):
+    emails = [address_on_shard(n % 2, "bulk") for n in range(10)]
+    assert set(group_by_shard(emails)) == {0, 1}
+
+    response = client.post("/api/inboxes/bulk", json={"emails": emails})
+    assert response.status_code == 201
+    body = response.json()
+    assert body["created"] == 10
+    assert [inbox["email"] for inbox in body["inboxes"]] == emails
+    for inbox in body["inboxes"]:
+        shard = shard_for_email(inbox["email"])
+        assert shard_from_id(inbox["id"]) == shard
+        assert stored_on(shard, inbox["id"]) is not None
+
+    again = client.post("/api/inboxes/bulk", json={"emails": emails}).json()
+    assert again["created"] == 0
+    assert [inbox["id"] for inbox in again["inboxes"]] == [inbox["id"] for inbox in body["inboxes"]]
+
+
+def test_mail_to_recipients_on_both_shards(client):
+    addresses = [address_on_shard(0, "fanout"), address_on_shard(1, "fanout")]
+    inbox_ids = [client.post("/api/inboxes/", json={"email": a}).json()["id"] for a in addresses]
+    raw = (
+        f"From: sender@example.com\r\nTo: {addresses[0]}\r\nCc: {addresses[1]}\r\n"
+        f"Message-ID: <{uuid.uuid4()}@example.com>\r\nSubject: both\r\n\r\nhello\r\n"
+    ).encode()
+    assert client.post("/api/inbound/mail", content=raw).status_code == 200
+
+    for shard, inbox_id in enumerate(inbox_ids):
+        db = session_for_shard(shard)
+        try:
+            messages = db.query(Message).filter(Message.inbox_id == inbox_id).all()
+        finally:
+            db.close()
+        assert [message.subject for message in messages] == ["both"]
+        assert shard_from_id(messages[0].id) == shard
+
+
+@pytest.mark.parametrize("shard", [0, 1])
+def test_unknown_id_is_404_on_every_shard(client, shard):
+    assert client.get(f"/api/inboxes/{generate_uuid(shard)}").status_code == 404